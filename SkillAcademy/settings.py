@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -40,27 +41,66 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'myapp',
     'accounts',
-    'razorpay',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'myapp.responses.CompressionMiddleware',
+    'myapp.staticfiles.PrecompressedStaticMiddleware',
+    'myapp.profiling.SlowQueryMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'myapp.invalidation.InvalidationMiddleware',
+    'myapp.profiling.ProfilingMiddleware',
 ]
 
+# Seconds between checks of the cross-worker cache invalidation log.
+INVALIDATION_CHECK_INTERVAL = 0.25
+
+# Responses smaller than this (in bytes) are sent uncompressed.
+COMPRESSION_MIN_SIZE = 1024
+
+# SQL statements slower than this (in milliseconds) are logged to SlowQuery.
+SLOW_QUERY_MS = 100
+# Where staff-triggered request profiles (?profile=sample|cprofile) are written.
+PROFILE_ROOT = os.path.join(BASE_DIR, 'profiles')
+
+# Uploads are streamed to disk, hashed and stored once per distinct content.
+FILE_UPLOAD_HANDLERS = ['myapp.uploads.HashingUploadHandler']
+# Largest accepted uploaded file, in bytes.
+UPLOAD_MAX_SIZE = 5 * 1024 * 1024
+
+# `manage.py archive_payments` moves completed payments and unpaid orders
+# older than these many days out of the Payment table.
+ARCHIVE_COMPLETED_DAYS = 365
+ARCHIVE_ABANDONED_DAYS = 7
+
+# Contact form throttle: each client IP may send CONTACT_BURST messages at
+# once, and earns one more every CONTACT_REFILL_SECONDS.
+CONTACT_BURST = 5
+CONTACT_REFILL_SECONDS = 60
+# Request header holding the client address set by a trusted reverse proxy
+# (e.g. 'HTTP_X_FORWARDED_FOR'); None counts messages against REMOTE_ADDR.
+CONTACT_IP_HEADER = None
+
 ROOT_URLCONF = 'SkillAcademy.urls'
 
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': ['templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Compile each template once per worker, in every environment.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -81,10 +121,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than shared-cache memory, so that tests running
+        # requests in parallel threads see the same locking as production.
+        'TEST': {
+            'NAME': os.path.join(tempfile.gettempdir(), 'skillacademy-test.sqlite3'),
+        },
     }
 }
 
 
+# Caches
+# Sessions use a cache shared by every worker on the host (with write-through
+# to the database), so a logout or login in one worker is seen by the others.
+# The default cache is per process; myapp.singleflight coalesces through it
+# unless SINGLEFLIGHT_CACHE names a shared cache with an atomic add().
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'skillacademy-sessions'),
+        'TIMEOUT': 14 * 24 * 60 * 60,
+    },
+}
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -120,10 +186,23 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.1/howto/static-files/
 
 STATIC_URL = '/static/'
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'myapp.uploads.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'myapp.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'Media/')
 MEDIA_URL = '/Media/'
 
+# Static HTML written by `manage.py prerender` for the front-end server.
+PRERENDER_ROOT = os.path.join(BASE_DIR, 'prerendered')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SkillAcademy.settings')
 
 application = get_wsgi_application()
+
+# Compile templates and prerender static components before the first request.
+from myapp import templating  # noqa: E402
+
+templating.warm()
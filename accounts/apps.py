@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+
+        # Importing the middleware registers its invalidation subscriber.
+        from accounts import middleware
+        from myapp import invalidation
+
+        post_save.connect(invalidation.model_changed, User)
+        post_delete.connect(invalidation.model_changed, User)
@@ -0,0 +1,83 @@
+"""
+Module: middleware.py
+
+This module caches the authenticated user so that steady-state logged-in
+requests do not read `auth_user`.
+
+The cache entry for a user is keyed by id and holds the user together with
+the session auth hash (derived from the password hash) it was loaded with.
+It is only used when that hash equals the one stored in the session, so a
+session started before a password change never sees the cached user. Any
+save or delete of a user (`updatedProfile`, the admin, `last_login` updates)
+publishes a 'user' event on `myapp.invalidation`, which drops the entry in
+every worker.
+
+"""
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from myapp import invalidation
+
+USER_CACHE_TIMEOUT = 15 * 60
+
+_generation = 0
+
+
+def user_cache_key(user_id):
+    return 'auth_user:%s:%s' % (_generation, user_id)
+
+
+def invalidate(user_ids):
+    """
+    Invalidation bus subscriber for 'user' events. When every user must be
+    dropped, the key generation moves on instead.
+    """
+    global _generation
+    if user_ids is None:
+        _generation += 1
+    else:
+        cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+invalidation.subscribe(['user'], invalidate)
+
+
+def get_user(request):
+    """
+    Returns the session's user from the cache, falling back to
+    `django.contrib.auth.get_user` (and caching its result).
+    """
+    session = request.session
+    user_id = session.get(SESSION_KEY)
+    session_hash = session.get(HASH_SESSION_KEY)
+    if user_id is None or session_hash is None:
+        return auth.get_user(request)
+
+    entry = cache.get(user_cache_key(user_id))
+    if entry is not None and entry['backend'] == session.get(BACKEND_SESSION_KEY) \
+            and constant_time_compare(entry['hash'], session_hash):
+        return entry['user']
+
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        cache.set(
+            user_cache_key(user.pk),
+            {'user': user, 'hash': user.get_session_auth_hash(), 'backend': session.get(BACKEND_SESSION_KEY)},
+            USER_CACHE_TIMEOUT,
+        )
+    return user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    `AuthenticationMiddleware` that resolves `request.user` through the
+    user cache.
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
@@ -1,3 +1,58 @@
-from django.test import TestCase
+from importlib import import_module
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts import middleware
+
+
+class CachedAuthenticationTests(TestCase):
+    """
+    A logged-in user is read from the cache, and never once the session
+    ends, the password changes or the profile is saved.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('learner', 'learner@example.com', 'password', first_name='Ada')
+        self.client.force_login(self.user)
+
+    def get_user(self, session_key=None):
+        request = RequestFactory().get('/')
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key or self.client.session.session_key)
+        return middleware.get_user(request)
+
+    def user_queries(self, queries):
+        return [query['sql'] for query in queries if 'auth_user' in query['sql']]
+
+    def test_second_request_is_served_from_the_cache(self):
+        self.assertEqual(self.get_user(), self.user)
+        with CaptureQueriesContext(connection) as queries:
+            user = self.get_user()
+        self.assertEqual(user, self.user)
+        self.assertEqual(self.user_queries(queries), [])
+
+    def test_logout_ends_the_cached_session(self):
+        session_key = self.client.session.session_key
+        self.get_user()
+        self.client.post(reverse('logout'))
+        self.assertFalse(self.get_user(session_key).is_authenticated)
+
+    def test_password_change_ends_other_sessions(self):
+        self.get_user()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('changed')
+            self.user.save()
+        self.assertFalse(self.get_user().is_authenticated)
+
+    def test_profile_save_drops_the_cached_user(self):
+        self.get_user()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Grace'
+            self.user.save()
+        self.assertEqual(self.get_user().first_name, 'Grace')
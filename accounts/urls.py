@@ -7,6 +7,8 @@ urlpatterns = [
  path('login/',loginView,name='login'),
  path('register/',registerView,name='register'),
  path('logout/',auth_views.LogoutView.as_view(),name='logout'),
+ path('reset/<uidb64>/<token>/',auth_views.PasswordResetConfirmView.as_view(),name='password_reset_confirm'),
+ path('reset/done/',auth_views.PasswordResetCompleteView.as_view(),name='password_reset_complete'),
 
  path('accounts/profile',updateProfile,name='profile'),
  path('accounts/profile/update',updatedProfile,name='profileupdated')
@@ -1,25 +1,298 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.forms.models import BaseInlineFormSet
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.http import urlencode
+
+from . import pricing
 from .models import *
 # Register your models here.
 
+
+def count_subquery(model, field='course'):
+    """
+    Returns a `COUNT(*)` subquery of `model` rows pointing at the outer row,
+    for use in `annotate()` without joining (and multiplying) several
+    reverse relations.
+    """
+    rows = (
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """
+    Inline formset that only loads one page of related rows. The page is
+    selected with a `<prefix>-page` query parameter on the change form.
+    """
+    per_page = 25
+    request = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.share_choices()
+
+    @property
+    def page_param(self):
+        return '%s-page' % self.prefix
+
+    def get_queryset(self):
+        if not hasattr(self, '_page_queryset'):
+            queryset = super().get_queryset()
+            page_number = self.request.GET.get(self.page_param, 1) if self.request else 1
+            self.page = Paginator(queryset, self.per_page).get_page(page_number)
+            self._page_queryset = self.page.object_list
+        return self._page_queryset
+
+    def page_links(self):
+        """
+        Returns `(number, url, is_current)` tuples for the inline paginator.
+        """
+        self.get_queryset()
+        params = self.request.GET.copy() if self.request else {}
+        links = []
+        for number in self.page.paginator.page_range:
+            params[self.page_param] = number
+            links.append((number, '?' + urlencode(params), number == self.page.number))
+        return links
+
+    def share_choices(self):
+        """
+        Evaluates each foreign key's choices once and reuses them for every
+        form, instead of running one query per row. The hidden primary key
+        field is skipped: its choices would be every row of the table.
+        """
+        forms = self.forms + [self.empty_form]
+        for name, field in forms[0].fields.items():
+            if not hasattr(field, 'queryset') or name == self.model._meta.pk.name:
+                continue
+            choices = list(field.choices)
+            for form in forms:
+                form_field = form.fields[name]
+                form_field.choices = choices
+                if hasattr(form_field.widget, 'widget'):
+                    form_field.widget.widget.choices = choices
+
+
 class Video_TabularInline(admin.TabularInline):
     model = Video
+    formset = PaginatedInlineFormSet
+    template = 'admin/edit_inline/paginated_tabular.html'
+    classes = ['collapse']
+    extra = 0
+    ordering = ['serial_number', 'id']
+    fields = ['serial_number', 'lesson', 'title', 'youtube_id', 'time_duration', 'preview', 'thumbnail']
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.request = request
+        return formset
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'lesson':
+            object_id = request.resolver_match.kwargs.get('object_id')
+            kwargs['queryset'] = Lesson.objects.filter(course_id=object_id).select_related('course')
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
 class course_admin(admin.ModelAdmin):
     inlines = [Video_TabularInline]
+    list_display = ['title', 'category', 'level', 'status', 'selling_price', 'lesson_count', 'video_count', 'enrolled_count']
+    list_filter = ['status', 'category', 'level']
+    list_select_related = ['category', 'level']
+    search_fields = ['title']
+    autocomplete_fields = ['author', 'category', 'level']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            lesson_count=count_subquery(Lesson),
+            video_count=count_subquery(Video),
+            enrolled_count=count_subquery(UserCourse),
+        )
 
-admin.site.register(Categories)
-admin.site.register(Author)
-admin.site.register(Course,course_admin)
-admin.site.register(Level)
-admin.site.register(Lesson)
-admin.site.register(Video)
-admin.site.register(UserCourse)
-admin.site.register(Payment)
-admin.site.register(contactdb)
-admin.site.register(reviewdb)
+    @admin.display(description='Price', ordering='effective_price')
+    def selling_price(self, obj):
+        return pricing.format_rupees(obj.effective_price)
+
+    @admin.display(description='Lessons', ordering='lesson_count')
+    def lesson_count(self, obj):
+        return obj.lesson_count
+
+    @admin.display(description='Videos', ordering='video_count')
+    def video_count(self, obj):
+        return obj.video_count
+
+    @admin.display(description='Enrolled', ordering='enrolled_count')
+    def enrolled_count(self, obj):
+        return obj.enrolled_count
+
+
+class name_search_admin(admin.ModelAdmin):
+    search_fields = ['name']
+
+
+class lesson_admin(admin.ModelAdmin):
+    list_display = ['name', 'course', 'video_count']
+    list_select_related = ['course']
+    search_fields = ['name', 'course__title']
+    autocomplete_fields = ['course']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('course').annotate(
+            video_count=count_subquery(Video, 'lesson'),
+        )
+
+    @admin.display(description='Videos', ordering='video_count')
+    def video_count(self, obj):
+        return obj.video_count
+
+
+class video_admin(admin.ModelAdmin):
+    list_display = ['title', 'course', 'lesson', 'serial_number', 'time_duration', 'preview']
+    list_filter = ['preview']
+    list_select_related = ['course', 'lesson__course']
+    search_fields = ['title']
+    autocomplete_fields = ['course', 'lesson']
+
+
+class usercourse_admin(admin.ModelAdmin):
+    list_display = ['user', 'course', 'paid', 'source', 'date']
+    list_filter = ['paid', 'source']
+    list_select_related = ['user', 'course']
+    search_fields = ['user__email', 'course__title']
+    autocomplete_fields = ['user', 'course']
+
+
+class PaymentItem_TabularInline(admin.TabularInline):
+    model = PaymentItem
+    extra = 0
+    autocomplete_fields = ['course']
+    raw_id_fields = ['user_course']
 
 
+class payment_admin(admin.ModelAdmin):
+    list_display = ['order_id', 'user', 'course', 'status', 'date']
+    list_filter = ['status']
+    list_select_related = ['user', 'course']
+    search_fields = ['order_id', 'payment_id', 'user__email']
+    autocomplete_fields = ['user', 'course']
+    raw_id_fields = ['user_course']
+    inlines = [PaymentItem_TabularInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term and not queryset.exists():
+            archived = ArchivedPayment.objects.filter(order_id=search_term.strip()).first()
+            if archived is not None:
+                url = reverse('admin:myapp_archivedpayment_change', args=[archived.pk])
+                self.message_user(request, format_html('Order {} is archived: <a href="{}">view it</a>.', archived.order_id, url))
+        return queryset, may_have_duplicates
+
+
+class ArchivedPaymentItem_TabularInline(admin.TabularInline):
+    model = ArchivedPaymentItem
+    extra = 0
+    readonly_fields = ['course', 'amount', 'user_course']
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class archived_payment_admin(admin.ModelAdmin):
+    list_display = ['order_id', 'user', 'course', 'status', 'date', 'reason', 'archived_at']
+    list_filter = ['reason', 'status']
+    list_select_related = ['user', 'course']
+    search_fields = ['order_id', 'payment_id', 'user__email']
+    date_hierarchy = 'date'
+    readonly_fields = ['id', 'order_id', 'payment_id', 'user_course', 'user', 'course', 'date', 'status', 'archived_at', 'reason']
+    inlines = [ArchivedPaymentItem_TabularInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class contact_inbox_admin(admin.ModelAdmin):
+    list_display = ['NAME', 'EMAIL', 'message_excerpt', 'ip', 'date']
+    search_fields = ['NAME', 'EMAIL', 'MESSAGE']
+    date_hierarchy = 'date'
+    ordering = ['-date', '-id']
+    list_per_page = 50
+    # Skip the unfiltered COUNT(*) on every search page.
+    show_full_result_count = False
+    readonly_fields = ['NAME', 'EMAIL', 'MESSAGE', 'ip', 'date']
+
+    @admin.display(description='Message')
+    def message_excerpt(self, obj):
+        return (obj.MESSAGE or '')[:100]
+
+    def has_add_permission(self, request):
+        return False
+
+
+class sales_rollup_admin(admin.ModelAdmin):
+    list_display = ['day', 'orders', 'paid_count', 'revenue', 'free_enrollments']
+    date_hierarchy = 'day'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class course_sales_admin(sales_rollup_admin):
+    list_display = ['day', 'course'] + sales_rollup_admin.list_display[1:]
+    list_select_related = ['course']
+
+
+class category_sales_admin(sales_rollup_admin):
+    list_display = ['day', 'category'] + sales_rollup_admin.list_display[1:]
+    list_select_related = ['category']
+
+
+class slow_query_admin(admin.ModelAdmin):
+    list_display = ['sql_excerpt', 'count', 'average', 'max_ms', 'last_path', 'last_seen']
+    ordering = ['-total_ms']
+    search_fields = ['sql', 'last_path']
+    readonly_fields = ['fingerprint', 'sql', 'plan', 'count', 'total_ms', 'max_ms', 'last_path', 'last_seen']
+
+    @admin.display(description='SQL')
+    def sql_excerpt(self, obj):
+        return obj.sql[:120]
+
+    @admin.display(description='Avg ms')
+    def average(self, obj):
+        return round(obj.average_ms, 1)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(Categories, name_search_admin)
+admin.site.register(Author, name_search_admin)
+admin.site.register(Course,course_admin)
+admin.site.register(Level, name_search_admin)
+admin.site.register(Lesson, lesson_admin)
+admin.site.register(Video, video_admin)
+admin.site.register(UserCourse, usercourse_admin)
+admin.site.register(Payment, payment_admin)
+admin.site.register(ArchivedPayment, archived_payment_admin)
+admin.site.register(contactdb, contact_inbox_admin)
+admin.site.register(reviewdb)
+admin.site.register(DailyCourseSales, course_sales_admin)
+admin.site.register(DailyCategorySales, category_sales_admin)
+admin.site.register(SlowQuery, slow_query_admin)
@@ -0,0 +1,278 @@
+"""
+Module: api.py
+
+This module is the read-only JSON API used by the mobile app.
+
+Endpoints (all GET, anonymous):
+
+- `api/categories`
+- `api/courses` (filters: `category`, `level`, `author`) and `api/courses/<id>`
+- `api/courses/<id>/curriculum`: lessons with their videos
+- `api/courses/<id>/reviews`
+
+Every endpoint takes `?fields=a,b,c` and returns only those fields, out of
+the `*_FIELDS` of its resource; without it the `DEFAULT_*` fields are
+returned. Rows are read with `values()` over exactly the columns (and joins)
+the requested fields need, so no model instances are built. Lists are
+paginated by primary key: `?limit=` (at most `MAX_LIMIT`) and the opaque
+`next` cursor of the previous page. Each endpoint runs a fixed number of
+queries however many rows it returns; `myapp.tests` checks the counts.
+
+Responses carry an ETag built from the `myapp.invalidation` versions of the
+entities they are read from and the request URL, so a client revalidating
+an unchanged resource gets a 304 without any query running.
+
+The curriculum returns a video's `youtube_id` only if the video is a
+preview or the user is enrolled in the course; otherwise it is null. Its
+ETag includes the user, and responses to a logged-in user are private.
+
+"""
+import base64
+import binascii
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_safe
+
+from myapp import invalidation
+from myapp.models import Categories, Course, Lesson, UserCourse, Video, reviewdb
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Public field name -> values() path.
+CATEGORY_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'icon': 'icon',
+}
+DEFAULT_CATEGORY = ['id', 'name', 'icon']
+
+COURSE_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'slug': 'slug',
+    'description': 'description',
+    'price': 'price',
+    'discount': 'discount',
+    'effective_price': 'effective_price',
+    'created_at': 'created_at',
+    'featured_image': 'featured_image',
+    'featured_video': 'featured_video',
+    'category_id': 'category_id',
+    'category': 'category__name',
+    'level_id': 'level_id',
+    'level': 'level__name',
+    'author_id': 'author_id',
+    'author': 'author__name',
+    'author_image': 'author__author_profile',
+}
+DEFAULT_COURSE = ['id', 'title', 'slug', 'effective_price', 'discount', 'featured_image', 'category_id', 'level', 'author']
+
+VIDEO_FIELDS = {
+    'id': 'id',
+    'serial_number': 'serial_number',
+    'title': 'title',
+    'youtube_id': 'youtube_id',
+    'time_duration': 'time_duration',
+    'preview': 'preview',
+    'thumbnail': 'thumbnail',
+}
+DEFAULT_VIDEO = ['id', 'serial_number', 'title', 'time_duration', 'preview']
+
+REVIEW_FIELDS = {
+    'id': 'id',
+    'user': 'selectuser',
+    'photo': 'Userphoto',
+    'review': 'Review',
+}
+DEFAULT_REVIEW = ['id', 'user', 'photo', 'review']
+
+# Fields holding storage names, returned as URLs.
+MEDIA_FIELDS = {'featured_image', 'author_image', 'thumbnail', 'photo'}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def api_response(data, status=200):
+    return JsonResponse(data, status=status, encoder=DjangoJSONEncoder, json_dumps_params={'separators': (',', ':')})
+
+
+def parse_fields(request, available, default):
+    """
+    Returns the fields asked for with `?fields=`, or `default`.
+
+    Raises:
+        BadRequest: If a field is unknown.
+    """
+    value = request.GET.get('fields')
+    if not value:
+        return default
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in available]
+    if unknown or not fields:
+        raise BadRequest("unknown fields: %s; available: %s" % (', '.join(unknown), ', '.join(available)))
+    return fields
+
+
+def serialize(rows, fields, available):
+    """
+    Renames `values()` rows to the public `fields`, turning storage names
+    into URLs.
+    """
+    media = [field for field in fields if field in MEDIA_FIELDS]
+    result = []
+    for row in rows:
+        item = {field: row[available[field]] for field in fields}
+        for field in media:
+            if item[field]:
+                item[field] = settings.MEDIA_URL + item[field]
+        result.append(item)
+    return result
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(b'%d' % last_id).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        return int(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, binascii.Error):
+        raise BadRequest("invalid cursor")
+
+
+def _int_param(request, name, default=None):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest("%s must be an integer" % name)
+
+
+def page(request, queryset, available, default):
+    """
+    Returns one page of `queryset`, ordered by id, as the API's
+    `{'results': [...], 'next': cursor or None}`. One query.
+    """
+    fields = parse_fields(request, available, default)
+    limit = min(max(_int_param(request, 'limit', DEFAULT_LIMIT), 1), MAX_LIMIT)
+    cursor = request.GET.get('cursor')
+    if cursor:
+        queryset = queryset.filter(id__gt=decode_cursor(cursor))
+    paths = {available[field] for field in fields} | {'id'}
+    rows = list(queryset.order_by('id').values(*paths)[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'results': serialize(rows, fields, available),
+        'next': encode_cursor(rows[-1]['id']) if more else None,
+    }
+
+
+def api_etag(request, entities, personal=False):
+    parts = [invalidation.version(*entities), request.get_full_path()]
+    if personal:
+        parts.append(request.user.pk)
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def endpoint(*entities, personal=False):
+    """
+    View decorator for API endpoints: GET/HEAD only, conditional on the
+    versions of `entities`, and `BadRequest` answered with a 400.
+
+    Args:
+        personal: The response depends on the user, who is then part of the
+            ETag; responses to a logged-in user are private.
+    """
+    def decorator(view):
+        @wraps(view)
+        def handle(request, *args, **kwargs):
+            try:
+                return view(request, *args, **kwargs)
+            except BadRequest as e:
+                return api_response({'error': str(e)}, status=400)
+
+        conditional = condition(etag_func=lambda request, *args, **kwargs: api_etag(request, entities, personal))(handle)
+
+        @require_safe
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                if personal and request.user.is_authenticated:
+                    patch_cache_control(response, private=True, no_cache=True)
+                else:
+                    patch_cache_control(response, public=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def published():
+    return Course.objects.filter(status='PUBLISH')
+
+
+@endpoint('categories')
+def API_CATEGORIES(request):
+    return api_response(page(request, Categories.objects.all(), CATEGORY_FIELDS, DEFAULT_CATEGORY))
+
+
+@endpoint('course', 'categories', 'level', 'author')
+def API_COURSES(request):
+    courses = published()
+    for name in ('category', 'level', 'author'):
+        value = _int_param(request, name)
+        if value is not None:
+            courses = courses.filter(**{name + '_id': value})
+    return api_response(page(request, courses, COURSE_FIELDS, DEFAULT_COURSE))
+
+
+@endpoint('course', 'categories', 'level', 'author')
+def API_COURSE(request, id):
+    fields = parse_fields(request, COURSE_FIELDS, DEFAULT_COURSE)
+    rows = published().filter(id=id).values(*{COURSE_FIELDS[field] for field in fields})
+    if not rows:
+        raise Http404
+    return api_response(serialize(rows, fields, COURSE_FIELDS)[0])
+
+
+def enrolled(request, course_id):
+    user = request.user
+    return user.is_authenticated and UserCourse.objects.filter(user=user, course_id=course_id).exists()
+
+
+@endpoint('course', 'curriculum', 'usercourse', personal=True)
+def API_CURRICULUM(request, id):
+    fields = parse_fields(request, VIDEO_FIELDS, DEFAULT_VIDEO)
+    if not published().filter(id=id).exists():
+        raise Http404
+    lessons = {row['id']: dict(row, videos=[]) for row in Lesson.objects.filter(course_id=id).order_by('id').values('id', 'name')}
+    paths = {VIDEO_FIELDS[field] for field in fields} | {'lesson_id', 'preview'}
+    videos = Video.objects.filter(course_id=id).order_by('serial_number', 'id').values(*paths)
+    # Only previews are free to watch.
+    hide = 'youtube_id' in fields and not enrolled(request, id)
+    for video, row in zip(serialize(videos, fields, VIDEO_FIELDS), videos):
+        if hide and not row['preview']:
+            video['youtube_id'] = None
+        if row['lesson_id'] in lessons:
+            lessons[row['lesson_id']]['videos'].append(video)
+    return api_response({'course_id': id, 'lessons': list(lessons.values())})
+
+
+@endpoint('course', 'reviewdb')
+def API_REVIEWS(request, id):
+    title = published().filter(id=id).values_list('title', flat=True).first()
+    if title is None:
+        raise Http404
+    # Reviews name their course by title.
+    return api_response(page(request, reviewdb.objects.filter(selectcourse=title), REVIEW_FIELDS, DEFAULT_REVIEW))
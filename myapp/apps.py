@@ -1,6 +1,30 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
 
 
 class MyappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myapp'
+
+    def ready(self):
+        # Importing catalog, course_stats and progress registers their invalidation subscribers.
+        from myapp import catalog, course_stats, invalidation, prerender, progress, recommendations, templating, uploads
+        from myapp.models import Author, Categories, Course, Lesson, Level, UserCourse, Video, reviewdb
+
+        for model in (Lesson, Video):
+            post_save.connect(course_stats.curriculum_changed, model)
+            post_delete.connect(course_stats.curriculum_changed, model)
+        for model in (Course, Categories, Level, Author, UserCourse, reviewdb):
+            post_save.connect(invalidation.model_changed, model)
+            post_delete.connect(invalidation.model_changed, model)
+        for model in (Author, Course, Video, reviewdb):
+            pre_save.connect(uploads.remember_files, model)
+            post_save.connect(uploads.track_files, model)
+            post_delete.connect(uploads.untrack_files, model)
+        post_save.connect(prerender.course_changed, Course)
+        post_delete.connect(prerender.course_changed, Course)
+        if settings.DEBUG:
+            from django.utils.autoreload import file_changed
+            file_changed.connect(templating.clear)
+        post_save.connect(recommendations.enrollment_created, UserCourse)
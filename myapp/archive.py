@@ -0,0 +1,154 @@
+"""
+Module: archive.py
+
+This module keeps the hot `Payment` table small by moving old rows into
+`ArchivedPayment` and `ArchivedPaymentItem`:
+
+- completed payments older than `COMPLETED_DAYS`;
+- unpaid orders older than `ABANDONED_DAYS` (every submitted checkout form
+  creates one, paid or not).
+
+`archive()` works in batches of `BATCH_SIZE` payments. Each batch is its own
+short transaction (copy, then delete), with a pause between batches, so that
+SQLite's database-wide write lock is never held for long and checkouts keep
+going while a large backlog is moved.
+
+Lookups fall back to the archive. `find()` returns the hot or the archived
+row for an order id, and `restore()` moves an archived order back when a
+late payment for it is verified. Exports, the sales rollup backfill and
+the ranking rebuild read both tables.
+
+"""
+from datetime import timedelta
+from time import sleep
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from myapp.models import ArchivedPayment, ArchivedPaymentItem, Payment, PaymentItem
+
+COMPLETED_DAYS = getattr(settings, 'ARCHIVE_COMPLETED_DAYS', 365)
+ABANDONED_DAYS = getattr(settings, 'ARCHIVE_ABANDONED_DAYS', 7)
+BATCH_SIZE = 500
+PAUSE = 0.05
+
+PAYMENT_FIELDS = ['id', 'order_id', 'payment_id', 'user_course_id', 'user_id', 'course_id', 'date', 'status', 'amount']
+ITEM_FIELDS = ['id', 'payment_id', 'course_id', 'amount', 'user_course_id']
+
+
+def eligible(completed_days=COMPLETED_DAYS, abandoned_days=ABANDONED_DAYS, now=None):
+    """
+    Returns `{reason: queryset}` of the hot payments due for archival.
+    """
+    now = now or timezone.now()
+    return {
+        'completed': Payment.objects.filter(status=True, date__lt=now - timedelta(days=completed_days)),
+        'abandoned': Payment.objects.filter(status=False, date__lt=now - timedelta(days=abandoned_days)),
+    }
+
+
+def _move_batch(queryset, reason, batch_size):
+    """
+    Moves up to `batch_size` payments of `queryset` to the archive.
+
+    Returns:
+        tuple: `(candidates, moved)`, the number of payments read and moved.
+    """
+    rows = list(queryset.order_by('id').values(*PAYMENT_FIELDS)[:batch_size])
+    if not rows:
+        return 0, 0
+    ids = [row['id'] for row in rows]
+    now = timezone.now()
+    with transaction.atomic():
+        # Copy before reading anything in the transaction: a SQLite
+        # transaction that reads first cannot take the write lock while a
+        # concurrent one (e.g. a checkout) holds it, and fails instead of
+        # waiting. Under the lock, copies of payments that changed since
+        # they were read (a late payment) are dropped again.
+        ArchivedPayment.objects.bulk_create(
+            [ArchivedPayment(archived_at=now, reason=reason, **row) for row in rows]
+        )
+        current = {row['id']: row for row in queryset.filter(id__in=ids).values(*PAYMENT_FIELDS)}
+        stale = [row['id'] for row in rows if current.get(row['id']) != row]
+        if stale:
+            ArchivedPayment.objects.filter(id__in=stale).delete()
+        ids = [payment_id for payment_id in ids if payment_id not in stale]
+        items = list(PaymentItem.objects.filter(payment_id__in=ids).values(*ITEM_FIELDS))
+        ArchivedPaymentItem.objects.bulk_create([ArchivedPaymentItem(**item) for item in items])
+        PaymentItem.objects.filter(payment_id__in=ids).delete()
+        Payment.objects.filter(id__in=ids).delete()
+    return len(rows), len(ids)
+
+
+def archive(completed_days=COMPLETED_DAYS, abandoned_days=ABANDONED_DAYS, batch_size=BATCH_SIZE,
+            pause=PAUSE, limit=None):
+    """
+    Moves eligible payments to the archive tables.
+
+    Args:
+        completed_days: Age after which completed payments are archived.
+        abandoned_days: Age after which unpaid orders are archived.
+        batch_size: Payments moved per transaction.
+        pause: Seconds to sleep between batches.
+        limit: Stop after about this many payments (None for all).
+
+    Returns:
+        dict: Payments moved per reason.
+    """
+    moved = {}
+    for reason, queryset in eligible(completed_days, abandoned_days).items():
+        moved[reason] = 0
+        while limit is None or sum(moved.values()) < limit:
+            candidates, count = _move_batch(queryset, reason, batch_size)
+            moved[reason] += count
+            if candidates < batch_size:
+                break
+            sleep(pause)
+    return moved
+
+
+def find(order_id):
+    """
+    Returns the `Payment` or, failing that, the `ArchivedPayment` for
+    `order_id`, or None.
+    """
+    return (Payment.objects.filter(order_id=order_id).first()
+            or ArchivedPayment.objects.filter(order_id=order_id).first())
+
+
+def restore(order_id):
+    """
+    Moves an archived order back into the hot tables, e.g. when a payment
+    for an abandoned order arrives late.
+
+    Returns:
+        Payment: The restored payment, or None if `order_id` is not archived.
+    """
+    archived = ArchivedPayment.objects.filter(order_id=order_id).values(*PAYMENT_FIELDS).first()
+    if archived is None:
+        return None
+    try:
+        with transaction.atomic():
+            # Insert before reading anything in the transaction (see
+            # _move_batch). A concurrent restore of the same order inserted
+            # the same id first.
+            payment = Payment.objects.create(**archived)
+            # `date` is auto_now_add, so create() replaced it.
+            Payment.objects.filter(id=payment.id).update(date=archived['date'])
+            items = list(ArchivedPaymentItem.objects.filter(payment_id=archived['id']).values(*ITEM_FIELDS))
+            PaymentItem.objects.bulk_create([PaymentItem(**item) for item in items])
+            ArchivedPayment.objects.filter(id=archived['id']).delete()
+    except IntegrityError:
+        return Payment.objects.filter(id=archived['id']).first()
+    payment.refresh_from_db()
+    return payment
+
+
+def table_sizes():
+    return {
+        'payments': Payment.objects.count(),
+        'payment_items': PaymentItem.objects.count(),
+        'archived_payments': ArchivedPayment.objects.count(),
+        'archived_payment_items': ArchivedPaymentItem.objects.count(),
+    }
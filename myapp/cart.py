@@ -0,0 +1,118 @@
+"""
+Module: cart.py
+
+This module lets a learner buy several courses with one Razorpay order.
+
+The cart is a list of course ids in the session (sessions are cached, so
+reading it costs no query). At checkout the courses the user is not yet
+enrolled in are priced, one gateway order is created for their total, and
+one `Payment` row is written with a `PaymentItem` per course. When the
+payment is verified, `fulfil()` enrolls every item in one transaction with a
+single `bulk_create` of `UserCourse` (see `myapp.enrollment`). A learner buying five courses now
+costs one gateway round trip and one verification callback instead of five.
+
+Single-course `CHECKOUT` orders keep using `Payment.course`; `fulfil()`
+handles both.
+
+"""
+from django.db import transaction
+
+from myapp import archive, enrollment, rollups
+from myapp.models import Course, Payment, PaymentItem, UserCourse
+
+SESSION_KEY = 'cart'
+
+
+def course_ids(request):
+    return list(request.session.get(SESSION_KEY, []))
+
+
+def add(request, course_id):
+    ids = course_ids(request)
+    if course_id not in ids:
+        request.session[SESSION_KEY] = ids + [course_id]
+
+
+def remove(request, course_id):
+    ids = course_ids(request)
+    if course_id in ids:
+        ids.remove(course_id)
+        request.session[SESSION_KEY] = ids
+
+
+def clear(request):
+    request.session.pop(SESSION_KEY, None)
+
+
+def courses(request):
+    """
+    Returns the courses in the cart that exist and that the user is not
+    already enrolled in, in the order they were added.
+    """
+    ids = course_ids(request)
+    if not ids:
+        return []
+    rows = Course.objects.in_bulk(ids)
+    if request.user.is_authenticated:
+        enrolled = set(UserCourse.objects.filter(user=request.user, course_id__in=ids).values_list('course_id', flat=True))
+    else:
+        enrolled = set()
+    return [rows[course_id] for course_id in ids if course_id in rows and course_id not in enrolled]
+
+
+def total(items):
+    """
+    Returns the amount to charge for `items`, in paise.
+    """
+    return sum(course.effective_price for course in items)
+
+
+def create_payment(user, items, order_id):
+    """
+    Records an unpaid cart order and its line items.
+
+    Returns:
+        Payment: The new payment.
+    """
+    with transaction.atomic():
+        payment = Payment.objects.create(user=user, order_id=order_id, amount=total(items))
+        PaymentItem.objects.bulk_create(
+            [PaymentItem(payment=payment, course=course, amount=course.effective_price) for course in items]
+        )
+    rollups.record_order(payment)
+    return payment
+
+
+def fulfil(order_id, payment_id):
+    """
+    Marks the order `order_id` as paid and enrolls its user in every course
+    it covers, all in one transaction. The order is claimed with a single
+    conditional UPDATE of its `status`, so of any number of repeated or
+    concurrent callbacks only the first enrolls and is counted in the
+    rollups; the others change nothing. An order that was archived as
+    abandoned is restored first.
+
+    Returns:
+        Payment: The verified payment.
+
+    Raises:
+        Payment.DoesNotExist: If there is no such order.
+    """
+    if not Payment.objects.filter(order_id=order_id).exists():
+        archive.restore(order_id)
+    with transaction.atomic():
+        claimed = Payment.objects.filter(order_id=order_id, status=False).update(status=True, payment_id=payment_id)
+        payment = Payment.objects.select_related('user', 'course').get(order_id=order_id)
+        if claimed != 1:
+            return payment
+        items = list(payment.items.select_related('course'))
+        courses = [item.course for item in items] or [payment.course]
+        enrolled = enrollment.enroll(payment.user, courses, paid=True)
+        for item in items:
+            item.user_course = enrolled.get(item.course_id)
+        PaymentItem.objects.bulk_update(items, ['user_course'])
+        if payment.course_id is not None:
+            payment.user_course = enrolled.get(payment.course_id)
+            payment.save(update_fields=['user_course'])
+    rollups.record_payment(payment)
+    return payment
@@ -0,0 +1,177 @@
+"""
+Module: catalog.py
+
+This module keeps an immutable, in-process snapshot of the course catalog so
+that listing, filtering and search requests do not go back to SQLite.
+
+The snapshot stores one compact `array` column per attribute (id, category,
+level, effective price, discount, status, created_at) plus an id -> course
+card map. Facets are precomputed as integer bitmasks over row positions, so
+a filter is a handful of bitwise AND/OR operations on Python ints, which run
+in C over the whole catalog at once; sort orders are precomputed position
+arrays.
+
+The snapshot is tagged with a generation number. Catalog edits in any
+worker reach this process through `myapp.invalidation`, which bumps the
+generation, and the next request that sees a different generation builds a
+new snapshot and swaps it in with a single assignment.
+
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from myapp import invalidation
+from myapp.models import Course
+
+ENTITIES = ['course', 'categories', 'level', 'author']
+
+_snapshot = None
+_generation = 0
+_build_lock = threading.Lock()
+
+
+def invalidate(object_ids=None):
+    """
+    Invalidation bus subscriber: any catalog change outdates the snapshot.
+    """
+    global _generation
+    _generation += 1
+
+
+invalidation.subscribe(ENTITIES, invalidate)
+
+
+def _bits(positions):
+    mask = 0
+    for position in positions:
+        mask |= 1 << position
+    return mask
+
+
+class CatalogSnapshot:
+    """
+    An immutable, column-oriented view of every course.
+
+    Columns (all indexed by row position):
+    - `ids`, `category_ids`, `level_ids` (0 when unset)
+    - `prices`: effective price in paise; `discounts`: percentage
+    - `published`: 1 for PUBLISH, 0 otherwise; `created_at`: proleptic ordinal
+
+    Rows are stored in `-id` order, which is also the default sort.
+    """
+
+    def __init__(self, version, courses):
+        self.version = version
+        self.ids = array('q', (course.id for course in courses))
+        self.category_ids = array('q', (course.category_id or 0 for course in courses))
+        self.level_ids = array('q', (course.level_id or 0 for course in courses))
+        self.prices = array('q', (course.effective_price for course in courses))
+        self.discounts = array('h', (course.discount or 0 for course in courses))
+        self.published = array('b', (course.status == 'PUBLISH' for course in courses))
+        self.created_at = array('l', (course.created_at.toordinal() if course.created_at else 0 for course in courses))
+        self.titles = [course.title.casefold() for course in courses]
+        self.cards = {course.id: course for course in courses}
+
+        count = len(self.ids)
+        self.all_mask = (1 << count) - 1
+        self.by_category = self._group(self.category_ids)
+        self.by_level = self._group(self.level_ids)
+        self.free_mask = _bits(i for i in range(count) if self.prices[i] == 0)
+        self.paid_mask = self.all_mask & ~self.free_mask
+        self.published_mask = _bits(i for i in range(count) if self.published[i])
+
+        by_price = sorted(range(count), key=lambda i: (self.prices[i], -self.ids[i]))
+        self.price_order = array('l', by_price)
+        self.sorted_prices = array('q', (self.prices[i] for i in by_price))
+        self.orders = {
+            'newest': array('l', range(count)),
+            'price_asc': self.price_order,
+            'price_desc': array('l', sorted(range(count), key=lambda i: (-self.prices[i], -self.ids[i]))),
+        }
+
+    @staticmethod
+    def _group(column):
+        groups = {}
+        for position, value in enumerate(column):
+            groups[value] = groups.get(value, 0) | (1 << position)
+        return groups
+
+    def filter(self, categories=(), levels=(), price=None, min_price=None, max_price=None, published=False, query=None):
+        """
+        Returns the bitmask of rows matching every given facet. Values
+        within `categories` or `levels` are ORed; facets are ANDed.
+        Prices are in paise.
+        """
+        mask = self.published_mask if published else self.all_mask
+        if categories:
+            mask &= _or(self.by_category.get(int(value), 0) for value in categories)
+        if levels:
+            mask &= _or(self.by_level.get(int(value), 0) for value in levels)
+        if price == 'free':
+            mask &= self.free_mask
+        elif price == 'paid':
+            mask &= self.paid_mask
+        if min_price is not None or max_price is not None:
+            low = bisect_left(self.sorted_prices, min_price) if min_price is not None else 0
+            high = bisect_right(self.sorted_prices, max_price) if max_price is not None else len(self.sorted_prices)
+            mask &= _bits(self.price_order[low:high])
+        if query:
+            query = query.casefold()
+            mask &= _bits(i for i, title in enumerate(self.titles) if query in title)
+        return mask
+
+    def select(self, mask, sort='newest'):
+        """
+        Returns the course cards selected by `mask`, in `sort` order.
+        """
+        order = self.orders.get(sort, self.orders['newest'])
+        ids = self.ids
+        return [self.cards[ids[position]] for position in order if mask >> position & 1]
+
+    def count(self, mask):
+        return bin(mask).count('1')
+
+    def facet_counts(self, mask=None):
+        """
+        Returns `(category_counts, level_counts)` dicts of id -> number of
+        rows within `mask` (all rows by default).
+        """
+        mask = self.all_mask if mask is None else mask
+        return (
+            {key: self.count(bits & mask) for key, bits in self.by_category.items()},
+            {key: self.count(bits & mask) for key, bits in self.by_level.items()},
+        )
+
+
+def _or(masks):
+    result = 0
+    for mask in masks:
+        result |= mask
+    return result
+
+
+def build_snapshot(version):
+    courses = list(Course.objects.select_related('author', 'category', 'level').order_by('-id'))
+    return CatalogSnapshot(version, courses)
+
+
+def get_snapshot():
+    """
+    Returns the current catalog snapshot, rebuilding it if the catalog
+    has been invalidated since it was built. Only one thread rebuilds;
+    while it does, other threads keep getting the previous snapshot.
+    """
+    global _snapshot
+    version = _generation
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    if not _build_lock.acquire(blocking=snapshot is None):
+        return snapshot
+    try:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = build_snapshot(version)
+        return _snapshot
+    finally:
+        _build_lock.release()
@@ -0,0 +1,184 @@
+"""
+Module: contact.py
+
+This module takes in contact form messages without letting a flood of them
+contend for SQLite's write lock with checkouts.
+
+`submit()` is called by the `contactdata` view and never writes to the
+database itself:
+
+- Each client IP may send `BURST` messages per window of `BURST *
+  REFILL_SECONDS` seconds (one every `REFILL_SECONDS` on average). The
+  count is a cache key per IP and window, taken with `cache.add` and
+  `cache.incr`, which are atomic, so concurrent posts cannot share a
+  message. Windows are fixed, so up to twice `BURST` can get through
+  around a window boundary. The default cache is a `LocMemCache`, which
+  is per process: with several workers the limit applies to each of them
+  (`BURST` times the number of workers in all) unless `CACHES['default']`
+  is a shared backend such as Memcached or Redis.
+- A message is identified by a SHA-256 of its normalized email and text.
+  The same message sent again is dropped while the first one is still
+  buffered, and for `DEDUPE_SECONDS` after `flush()` has stored it (the
+  cache key is only set once the row is written, so a message lost with
+  its buffer can be sent again). `contactdb.digest` is unique, so
+  duplicates that get past both (other workers, expired keys) are
+  dropped on insert.
+- Accepted messages are buffered in-process, like `progress` heartbeats. A
+  background thread writes the buffer with one `bulk_create` every
+  `FLUSH_INTERVAL` seconds, or sooner once it holds `FLUSH_SIZE` messages,
+  and what is left is written when the process exits.
+
+The client IP is `REMOTE_ADDR`. Behind a reverse proxy that is the
+proxy's address, so every visitor would share one bucket; set
+`CONTACT_IP_HEADER` to the header the proxy sets (e.g.
+`HTTP_X_FORWARDED_FOR` or `HTTP_X_REAL_IP`) to use the address it reports
+instead. The last address in the header is used, as the one the trusted
+proxy appended. Only set it when Django cannot be reached except through
+that proxy: clients can send the header themselves.
+
+"""
+import atexit
+import hashlib
+import threading
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from myapp.models import contactdb
+
+BURST = getattr(settings, 'CONTACT_BURST', 5)
+REFILL_SECONDS = getattr(settings, 'CONTACT_REFILL_SECONDS', 60)
+IP_HEADER = getattr(settings, 'CONTACT_IP_HEADER', None)
+DEDUPE_SECONDS = 24 * 60 * 60
+FLUSH_SIZE = 100
+FLUSH_INTERVAL = 5
+MAX_MESSAGE_LENGTH = 5000
+
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'
+THROTTLED = 'throttled'
+INVALID = 'invalid'
+
+_pending = []
+_pending_digests = set()
+_lock = threading.Lock()
+_wake = threading.Event()
+_worker = None
+
+
+def client_ip(request):
+    """
+    Returns the address that the throttle counts a request against: the
+    last entry of `CONTACT_IP_HEADER` if it is set and present, otherwise
+    `REMOTE_ADDR`.
+    """
+    if IP_HEADER:
+        forwarded = [address.strip() for address in request.META.get(IP_HEADER, '').split(',') if address.strip()]
+        if forwarded:
+            return forwarded[-1]
+    return request.META.get('REMOTE_ADDR') or 'unknown'
+
+
+def take_token(ip, now=None):
+    """
+    Counts one message against `ip`'s current window.
+
+    Returns:
+        bool: False if `ip` has already sent `BURST` messages in it.
+    """
+    now = time() if now is None else now
+    window = BURST * REFILL_SECONDS
+    key = 'contact-count:%s:%d' % (ip, now // window)
+    cache.add(key, 0, window)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # The key expired between add() and incr().
+        count = 1 if cache.add(key, 1, window) else cache.incr(key)
+    return count <= BURST
+
+
+def digest(email, message):
+    normalized = '%s\0%s' % ((email or '').strip().lower(), ' '.join((message or '').split()).lower())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def submit(name, email, message, ip):
+    """
+    Throttles, dedupes and buffers one contact message.
+
+    Returns:
+        str: `ACCEPTED`, `DUPLICATE`, `THROTTLED` or `INVALID`.
+    """
+    message = (message or '').strip()
+    if not message:
+        return INVALID
+    if not take_token(ip):
+        return THROTTLED
+    key = digest(email, message)
+    if cache.get('contact-seen:%s' % key):
+        return DUPLICATE
+    row = contactdb(
+        NAME=(name or '').strip()[:50], EMAIL=(email or '').strip()[:50],
+        MESSAGE=message[:MAX_MESSAGE_LENGTH], ip=ip if ip != 'unknown' else None, digest=key,
+    )
+    with _lock:
+        if key in _pending_digests:
+            return DUPLICATE
+        _pending_digests.add(key)
+        _pending.append(row)
+        full = len(_pending) >= FLUSH_SIZE
+    _start_worker()
+    if full:
+        _wake.set()
+    return ACCEPTED
+
+
+def flush():
+    """
+    Writes the buffered messages with one `bulk_create`, then remembers
+    their digests in the cache. Messages whose digest is already stored are
+    skipped.
+
+    Returns:
+        int: The number of messages handed to the database.
+    """
+    with _lock:
+        batch = list(_pending)
+        _pending.clear()
+    if batch:
+        try:
+            contactdb.objects.bulk_create(batch, ignore_conflicts=True)
+        except Exception:
+            with _lock:
+                _pending[:0] = batch
+            raise
+        digests = [row.digest for row in batch]
+        cache.set_many({'contact-seen:%s' % key: True for key in digests}, DEDUPE_SECONDS)
+        with _lock:
+            _pending_digests.difference_update(digests)
+    return len(batch)
+
+
+def _run():
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            # The batch is back in the buffer; retry on the next round.
+            pass
+
+
+def _start_worker():
+    global _worker
+    if _worker is None:
+        with _lock:
+            if _worker is None:
+                _worker = threading.Thread(target=_run, name='contact-flush', daemon=True)
+                _worker.start()
+
+
+atexit.register(flush)
@@ -0,0 +1,182 @@
+"""
+Module: course_stats.py
+
+This module provides course-level curriculum statistics (total minutes,
+lesson count, video count and preview count) for listing and detail pages.
+
+Statistics for a batch of courses are computed with a single grouped query
+and cached per course with stale-while-revalidate semantics: a cached entry
+is served as long as it exists, and once it is older than
+`STATS_FRESH_SECONDS` it is recomputed in a background thread while the
+stale value keeps being served. Admin edits to `Lesson` and `Video` are
+published on `myapp.invalidation` as 'curriculum' events, and every worker
+marks the affected courses stale and triggers the same background refresh.
+
+"""
+import threading
+from time import time
+
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from myapp import invalidation
+from myapp.models import Course, Lesson
+
+STATS_FRESH_SECONDS = 10 * 60
+STATS_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+CACHE_KEY = 'course_stats:%s'
+
+EMPTY_STATS = {
+    'total_minutes': 0,
+    'lesson_count': 0,
+    'video_count': 0,
+    'preview_count': 0,
+}
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def compute_stats(course_ids):
+    """
+    Computes statistics for the given courses in one grouped query.
+
+    Returns:
+        dict: A mapping of course id to a statistics dict.
+    """
+    lesson_count = (
+        Lesson.objects.filter(course=OuterRef('pk'))
+        .order_by()
+        .values('course')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    rows = (
+        Course.objects.filter(id__in=course_ids)
+        .order_by()
+        .values('id')
+        .annotate(
+            total_minutes=Coalesce(Sum('video__time_duration'), 0.0),
+            video_count=Count('video'),
+            preview_count=Count('video', filter=Q(video__preview=True)),
+            lesson_count=Coalesce(Subquery(lesson_count, output_field=IntegerField()), 0),
+        )
+    )
+    stats = {course_id: dict(EMPTY_STATS) for course_id in course_ids}
+    for row in rows:
+        stats[row.pop('id')] = row
+    return stats
+
+
+def _store(stats):
+    fresh_until = time() + STATS_FRESH_SECONDS
+    cache.set_many(
+        {CACHE_KEY % course_id: {'stats': value, 'fresh_until': fresh_until}
+         for course_id, value in stats.items()},
+        STATS_CACHE_TIMEOUT,
+    )
+
+
+def get_stats(course_ids):
+    """
+    Returns statistics for the given courses, serving cached values where
+    possible. Missing entries are computed synchronously in one query;
+    stale entries are returned as-is and refreshed in the background.
+
+    Returns:
+        dict: A mapping of course id to a statistics dict.
+    """
+    course_ids = list(dict.fromkeys(course_ids))
+    cached = cache.get_many([CACHE_KEY % course_id for course_id in course_ids])
+    now = time()
+    result, missing, stale = {}, [], []
+    for course_id in course_ids:
+        entry = cached.get(CACHE_KEY % course_id)
+        if entry is None:
+            missing.append(course_id)
+            continue
+        result[course_id] = entry['stats']
+        if entry['fresh_until'] < now:
+            stale.append(course_id)
+
+    if missing:
+        computed = compute_stats(missing)
+        _store(computed)
+        result.update(computed)
+    if stale:
+        refresh_in_background(stale)
+    return result
+
+
+def prime(courses):
+    """
+    Attaches statistics to each course instance in `courses` (a queryset or
+    list) so that `Course.stats` does not hit the cache again per row.
+    Evaluating a queryset here fills its result cache, so templates that
+    iterate the same queryset see the primed instances.
+
+    Returns:
+        The `courses` argument, for chaining.
+    """
+    instances = list(courses)
+    stats = get_stats([course.id for course in instances])
+    for course in instances:
+        course._stats = stats.get(course.id, EMPTY_STATS)
+    return courses
+
+
+def _refresh(course_ids):
+    try:
+        _store(compute_stats(course_ids))
+    finally:
+        with _refreshing_lock:
+            _refreshing.difference_update(course_ids)
+        close_old_connections()
+
+
+def refresh_in_background(course_ids):
+    """
+    Recomputes statistics for `course_ids` in a daemon thread. Courses that
+    already have a refresh in flight are skipped.
+    """
+    with _refreshing_lock:
+        pending = [course_id for course_id in course_ids if course_id not in _refreshing]
+        _refreshing.update(pending)
+    if pending:
+        threading.Thread(target=_refresh, args=(pending,), daemon=True).start()
+
+
+def mark_stale(course_ids):
+    """
+    Marks cached statistics for `course_ids` as stale and schedules a
+    background refresh. Existing values keep being served until then.
+    """
+    keys = [CACHE_KEY % course_id for course_id in course_ids]
+    cached = cache.get_many(keys)
+    for entry in cached.values():
+        entry['fresh_until'] = 0
+    if cached:
+        cache.set_many(cached, STATS_CACHE_TIMEOUT)
+    refresh_in_background(course_ids)
+
+
+def invalidate(course_ids):
+    """
+    Invalidation bus subscriber for 'curriculum' events.
+    """
+    if course_ids is None:
+        course_ids = Course.objects.values_list('id', flat=True)
+    mark_stale(list(course_ids))
+
+
+invalidation.subscribe(['curriculum'], invalidate)
+
+
+def curriculum_changed(sender, instance, *args, **kwargs):
+    """
+    `post_save`/`post_delete` receiver for `Lesson` and `Video`.
+    """
+    if instance.course_id is not None:
+        invalidation.publish('curriculum', instance.course_id)
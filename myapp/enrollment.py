@@ -0,0 +1,64 @@
+"""
+Module: enrollment.py
+
+This module is the one place that creates `UserCourse` rows. The free
+`CHECKOUT` and `CART` paths and payment verification (`cart.fulfil`) all
+go through it.
+
+`UserCourse` has a unique `(user, course)` constraint, so enrolling is
+idempotent however often a request is repeated or raced:
+
+- `enroll_one()` is `get_or_create()`: one indexed lookup when the user is
+  already enrolled, otherwise an INSERT whose conflict (a parallel request
+  won) falls back to that lookup.
+- `enroll()` enrolls in several courses with one INSERT per course, each
+  in a savepoint, and nothing read beforehand. An INSERT that hits the
+  constraint means the user is already enrolled. Inside a transaction its
+  first statement is therefore a write, which SQLite makes wait for a
+  concurrent writer; a transaction that reads first fails instead.
+
+"""
+from django.db import IntegrityError, transaction
+
+from myapp import invalidation, recommendations, rollups
+from myapp.models import UserCourse
+
+
+def enroll_one(user, course, paid=False):
+    """
+    Enrolls `user` in `course` unless they already are. A new free
+    enrollment is counted in the sales rollups.
+
+    Returns:
+        tuple: `(usercourse, created)`.
+    """
+    usercourse, created = UserCourse.objects.get_or_create(user=user, course=course, defaults={'paid': paid})
+    if created and not paid:
+        rollups.record_free_enrollment(usercourse)
+    return usercourse, created
+
+
+def enroll(user, courses, paid=False):
+    """
+    Enrolls `user` in every course of `courses` they are not enrolled in
+    yet. Unlike `enroll_one()`, no rollups are recorded.
+
+    Returns:
+        dict: Course id -> the new `UserCourse`.
+    """
+    created = []
+    for course in courses:
+        usercourse = UserCourse(user=user, course_id=course.id, paid=paid)
+        try:
+            with transaction.atomic():
+                # bulk_create sends no post_save, so that the new rows are
+                # added to the recommendations together, below.
+                UserCourse.objects.bulk_create([usercourse])
+        except IntegrityError:
+            continue
+        created.append(usercourse)
+    if created:
+        invalidation.publish('usercourse')
+        new_ids = [usercourse.course_id for usercourse in created]
+        transaction.on_commit(lambda: recommendations.record_enrollments(user.id, new_ids))
+    return {usercourse.course_id: usercourse for usercourse in created}
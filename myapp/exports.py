@@ -0,0 +1,120 @@
+"""
+Module: exports.py
+
+This module streams finance exports of payments, enrollments and contact
+messages as CSV or JSON Lines.
+
+Rows are read with `values_list()` and `.iterator(chunk_size=...)`, so no
+model instances are built and memory use stays constant however many rows
+match. Every export is filtered on its indexed `date` column.
+
+"""
+import csv
+import heapq
+import json
+from datetime import datetime, time, timedelta
+from operator import itemgetter
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from myapp.models import ArchivedPayment, Payment, UserCourse, contactdb
+
+CHUNK_SIZE = 2000
+
+EXPORTS = {
+    'payments': (Payment, [
+        'id', 'order_id', 'payment_id', 'status', 'date',
+        'user_id', 'user__email', 'course_id', 'course__title', 'amount',
+    ]),
+    'enrollments': (UserCourse, [
+        'id', 'paid', 'date', 'user_id', 'user__email', 'course_id', 'course__title',
+    ]),
+    'contacts': (contactdb, [
+        'id', 'NAME', 'EMAIL', 'MESSAGE', 'date',
+    ]),
+}
+
+# Rows moved out of an export's table by `myapp.archive`.
+ARCHIVES = {
+    'payments': ArchivedPayment,
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def parse_day(value):
+    """
+    Parses a `YYYY-MM-DD` string.
+
+    Raises:
+        ValueError: If the value is not a valid date.
+    """
+    day = parse_date(value)
+    if day is None:
+        raise ValueError("invalid date: %r" % value)
+    return day
+
+
+def _dated(model, columns, start, end):
+    queryset = model.objects.all()
+    if start:
+        queryset = queryset.filter(date__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end:
+        queryset = queryset.filter(date__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+    return queryset.order_by('date', 'id').values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+
+
+def export_rows(name, start=None, end=None):
+    """
+    Returns the column names and a lazy iterator of row tuples for the
+    export `name`, limited to rows dated from `start` to `end` inclusive.
+    Exports with an archive table merge its rows in date order.
+
+    Raises:
+        KeyError: If `name` is not a known export.
+    """
+    model, columns = EXPORTS[name]
+    rows = _dated(model, columns, start, end)
+    if name in ARCHIVES:
+        key = itemgetter(columns.index('date'), columns.index('id'))
+        rows = heapq.merge(rows, _dated(ARCHIVES[name], columns, start, end), key=key)
+    return columns, rows
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(columns, rows):
+    """
+    Yields the export as CSV lines, header first.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_format_value(value) for value in row])
+
+
+def jsonl_lines(columns, rows):
+    """
+    Yields the export as one JSON object per line.
+    """
+    for row in rows:
+        yield json.dumps(dict(zip(columns, map(_format_value, row)))) + "\n"
+
+
+def render_lines(fmt, columns, rows):
+    if fmt == 'jsonl':
+        return jsonl_lines(columns, rows)
+    return csv_lines(columns, rows)
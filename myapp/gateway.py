@@ -0,0 +1,60 @@
+"""
+Module: gateway.py
+
+This module gives access to the Razorpay client. The client (and the
+razorpay/requests stack it imports) is only built on the first call to
+`client()`, by the first request that needs the payment gateway, instead
+of when the URLconf is imported. Workers, management commands and tests that
+never touch payments don't pay for it.
+
+Calls to the gateway run inside a web request, so they must not hang it.
+Every call gets `GATEWAY_TIMEOUT` (connect, read) seconds unless it passes
+its own `timeout`. A connection that cannot be established is retried up
+to `CONNECT_RETRIES` times, since nothing reached Razorpay yet. A request
+that was sent is never retried (creating an order is not idempotent), and a
+read timeout is raised to the caller.
+
+"""
+import threading
+
+from django.conf import settings
+
+TIMEOUT = getattr(settings, 'GATEWAY_TIMEOUT', (3.05, 10))
+CONNECT_RETRIES = 2
+RETRY_BACKOFF = 0.2
+
+_client = None
+_lock = threading.Lock()
+
+
+def _session():
+    """
+    Returns a `requests.Session` with the default timeout and connection
+    retries for every URL.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class GatewayAdapter(HTTPAdapter):
+        def send(self, request, timeout=None, **kwargs):
+            return super().send(request, timeout=timeout or TIMEOUT, **kwargs)
+
+    retries = Retry(total=CONNECT_RETRIES, connect=CONNECT_RETRIES, read=0, other=0, backoff_factor=RETRY_BACKOFF)
+    session = requests.Session()
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, GatewayAdapter(max_retries=retries))
+    return session
+
+
+def client():
+    """
+    Returns the shared `razorpay.Client`, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import razorpay
+                _client = razorpay.Client(session=_session(), auth=(settings.KEY_ID, settings.KEY_SECRET))
+    return _client
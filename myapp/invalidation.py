@@ -0,0 +1,199 @@
+"""
+Module: invalidation.py
+
+This module is a cross-process cache invalidation bus for in-memory caches
+built on top of `myapp.models` (the catalog snapshot, course statistics).
+
+Every change is appended to `InvalidationEvent`, whose auto-increment id is
+the bus's monotonically increasing version. Model signals publish events
+once the writing transaction commits. Each worker remembers the last event
+id it has processed and, at most every `INVALIDATION_CHECK_INTERVAL`
+seconds (checked at the start of a request by `InvalidationMiddleware`),
+reads the newer events with one indexed primary-key range query. The events
+go to the subscribers of their entity, which drop only the affected
+entries.
+
+Workers also track the newest event id per entity. `version()` turns these
+into version numbers that every worker agrees on, for use in ETags.
+
+A worker that has fallen behind the pruned part of the log, or that sees the
+log reset, cannot know what it missed and tells every subscriber to drop
+everything (`object_ids` is None).
+
+"""
+import threading
+from datetime import timedelta
+from time import monotonic
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from myapp.models import InvalidationEvent
+
+CHECK_INTERVAL = getattr(settings, 'INVALIDATION_CHECK_INTERVAL', 0.25)
+RETENTION = timedelta(hours=1)
+PRUNE_EVERY = 100
+
+_subscribers = {}
+_lock = threading.Lock()
+_last_seen = None
+_next_check = 0.0
+_published = set()
+_versions = {}
+
+
+def subscribe(entities, callback):
+    """
+    Registers `callback(object_ids)` for events about any of `entities`.
+    `object_ids` is a set of ids, or None when everything must be dropped.
+    """
+    for entity in entities:
+        _subscribers.setdefault(entity, []).append(callback)
+
+
+def _merge(changes, entity, object_ids):
+    if object_ids is None or changes.get(entity, ()) is None:
+        changes[entity] = None
+    else:
+        changes.setdefault(entity, set()).update(object_ids)
+
+
+def _dispatch(changes):
+    callbacks = {}
+    for entity, object_ids in changes.items():
+        for callback in _subscribers.get(entity, ()):
+            _merge(callbacks, callback, object_ids)
+    for callback, object_ids in callbacks.items():
+        callback(object_ids)
+
+
+def current_version():
+    """
+    Returns the id of the last event this worker has applied (0 before
+    any event has been published).
+    """
+    if _last_seen is None:
+        check(force=True)
+    return _last_seen or 0
+
+
+def version(*entities):
+    """
+    Returns the id of the newest applied event about any of `entities`
+    (0 if there is none). Every worker reports the same value once it has
+    caught up, because pruning keeps the newest event of each entity.
+    """
+    if _last_seen is None:
+        check(force=True)
+    return max([_versions.get(entity, 0) for entity in entities] or [0])
+
+
+def _load_versions():
+    rows = InvalidationEvent.objects.values('entity').annotate(newest=Max('id')).order_by()
+    _versions.clear()
+    _versions.update((row['entity'], row['newest']) for row in rows)
+
+
+def publish(entity, object_id=None):
+    """
+    Records a change to `entity` (optionally a single object) once the
+    current transaction commits. The publishing worker applies it at once
+    rather than waiting for its next check.
+    """
+    def send():
+        event = InvalidationEvent.objects.create(entity=entity, object_id=object_id)
+        with _lock:
+            _published.add(event.id)
+            _versions[entity] = max(_versions.get(entity, 0), event.id)
+        _dispatch({entity: None if object_id is None else {object_id}})
+        if event.id % PRUNE_EVERY == 0:
+            prune()
+
+    transaction.on_commit(send)
+
+
+def prune():
+    """
+    Deletes events older than `RETENTION`. The newest event of each entity
+    is always kept, so ids never restart from 1 and entity versions stay
+    the same in every worker.
+
+    Returns:
+        int: The number of events deleted.
+    """
+    newest = InvalidationEvent.objects.values('entity').annotate(newest=Max('id')).order_by().values_list('newest', flat=True)
+    deleted, _ = InvalidationEvent.objects.filter(
+        created_at__lt=timezone.now() - RETENTION,
+    ).exclude(id__in=list(newest)).delete()
+    return deleted
+
+
+def check(force=False):
+    """
+    Applies the events published by other workers since the last check.
+    Does nothing if the previous check was less than `CHECK_INTERVAL`
+    seconds ago, unless `force` is set.
+
+    Returns:
+        int: The number of events applied.
+    """
+    global _last_seen, _next_check
+    now = monotonic()
+    if not force and now < _next_check:
+        return 0
+    with _lock:
+        if not force and now < _next_check:
+            return 0
+        _next_check = now + CHECK_INTERVAL
+        if _last_seen is None:
+            # A fresh worker has nothing cached yet.
+            _load_versions()
+            _last_seen = max(_versions.values(), default=0)
+            return 0
+        # Including the last applied event detects a pruned or reset log.
+        events = list(
+            InvalidationEvent.objects.filter(id__gte=_last_seen)
+            .order_by('id')
+            .values_list('id', 'entity', 'object_id')
+        )
+        changes = {}
+        if _last_seen and (not events or events[0][0] != _last_seen):
+            changes = dict.fromkeys(_subscribers)
+            _load_versions()
+        elif events and events[0][0] == _last_seen:
+            events = events[1:]
+        for event_id, entity, object_id in events:
+            _versions[entity] = max(_versions.get(entity, 0), event_id)
+            if event_id in _published:
+                continue
+            _merge(changes, entity, None if object_id is None else {object_id})
+        if events:
+            _last_seen = events[-1][0]
+        elif changes:
+            _last_seen = max(_versions.values(), default=0)
+        _published.difference_update([event_id for event_id in _published if event_id <= _last_seen])
+    _dispatch(changes)
+    return len(events)
+
+
+def model_changed(sender, instance, *args, **kwargs):
+    """
+    `post_save`/`post_delete` receiver that publishes an event named after
+    the model (e.g. 'course', 'categories') for the changed row.
+    """
+    publish(sender._meta.model_name, instance.pk)
+
+
+class InvalidationMiddleware:
+    """
+    Applies pending invalidation events before each request is handled.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        check()
+        return self.get_response(request)
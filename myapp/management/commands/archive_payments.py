@@ -0,0 +1,35 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from myapp import archive
+
+
+class Command(BaseCommand):
+    help = "Move old completed payments and abandoned orders into the archive tables, in small batches. Meant to run daily."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completed-days', type=int, default=archive.COMPLETED_DAYS,
+                            help="Archive completed payments older than this many days.")
+        parser.add_argument('--abandoned-days', type=int, default=archive.ABANDONED_DAYS,
+                            help="Archive unpaid orders older than this many days.")
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE, help="Payments moved per transaction.")
+        parser.add_argument('--pause', type=float, default=archive.PAUSE, help="Seconds to wait between batches.")
+        parser.add_argument('--limit', type=int, help="Stop after about this many payments.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the eligible payments.")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            for reason, queryset in archive.eligible(options['completed_days'], options['abandoned_days']).items():
+                self.stdout.write("%s: %d payments eligible" % (reason, queryset.count()))
+            return
+
+        started = perf_counter()
+        moved = archive.archive(
+            options['completed_days'], options['abandoned_days'],
+            batch_size=options['batch_size'], pause=options['pause'], limit=options['limit'],
+        )
+        seconds = perf_counter() - started
+        self.stdout.write("Archived %s in %.2fs" % (
+            ", ".join("%d %s" % (count, reason) for reason, count in moved.items()), seconds))
+        self.stdout.write("Table sizes: %s" % ", ".join("%s=%d" % item for item in archive.table_sizes().items()))
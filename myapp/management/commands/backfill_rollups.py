@@ -0,0 +1,38 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from myapp import exports, rollups
+from myapp.models import ArchivedPayment, Payment, UserCourse
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily sales rollups from Payment, ArchivedPayment and UserCourse."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day to rebuild (YYYY-MM-DD, default: first order, archived or not).")
+        parser.add_argument('--end', help="Last day to rebuild (YYYY-MM-DD, default: today).")
+
+    def handle(self, *args, **options):
+        try:
+            start = exports.parse_day(options['start']) if options['start'] else None
+            end = exports.parse_day(options['end']) if options['end'] else timezone.localdate()
+        except ValueError as e:
+            raise CommandError(e)
+        if start is None:
+            first = [
+                Payment.objects.aggregate(first=Min('date'))['first'],
+                ArchivedPayment.objects.aggregate(first=Min('date'))['first'],
+                UserCourse.objects.aggregate(first=Min('date'))['first'],
+            ]
+            first = [timezone.localdate(value) for value in first if value]
+            if not first:
+                self.stdout.write("Nothing to backfill")
+                return
+            start = min(first)
+
+        started = perf_counter()
+        rows = rollups.backfill(start, end)
+        self.stdout.write("Rebuilt %d course-day rows from %s to %s in %.2fs" % (rows, start, end, perf_counter() - started))
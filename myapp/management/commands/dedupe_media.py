@@ -0,0 +1,107 @@
+import hashlib
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from myapp import uploads
+from myapp.models import Author, Course, StoredFile, Video, reviewdb
+
+MODELS = (Author, Course, Video, reviewdb)
+
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = "Move every referenced media file to its content-addressed name, so identical files are stored once, and rebuild the reference counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without touching files or rows.")
+        parser.add_argument('--remove-orphans', action='store_true', help="Also delete media files no row references.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        root = settings.MEDIA_ROOT
+
+        # name -> [(model, field)] for every row referencing it.
+        references = {}
+        for model in MODELS:
+            for field in uploads.file_fields(model):
+                for name in model.objects.exclude(**{field: ''}).exclude(**{field: None}).values_list(field, flat=True):
+                    references.setdefault(name, []).append((model, field))
+
+        targets, contents, missing = {}, {}, []
+        bytes_before = 0
+        for name in sorted(references):
+            path = os.path.join(root, name)
+            if not os.path.isfile(path):
+                missing.append(name)
+                continue
+            sha256 = sha256_of(path)
+            size = os.path.getsize(path)
+            bytes_before += size
+            targets[name] = uploads.content_name(sha256, name)
+            contents[targets[name]] = (sha256, size)
+
+        self.stdout.write("%d referenced files, %d bytes; %d distinct contents, %d bytes" % (
+            len(targets), bytes_before, len(contents), sum(size for _, size in contents.values())))
+        for name in missing:
+            self.stderr.write("missing: %s" % name)
+
+        referenced = {os.path.normpath(os.path.join(root, name)) for name in targets.values()}
+        referenced.update(os.path.normpath(os.path.join(root, name)) for name in missing)
+        orphans = []
+        for directory, dirs, files in os.walk(root):
+            dirs[:] = sorted(d for d in dirs if d != uploads.INCOMING_DIR)
+            for file_name in sorted(files):
+                path = os.path.normpath(os.path.join(directory, file_name))
+                if path not in referenced and os.path.relpath(path, root) not in targets:
+                    orphans.append(path)
+        self.stdout.write("%d unreferenced files, %d bytes" % (len(orphans), sum(os.path.getsize(p) for p in orphans)))
+        if dry_run:
+            return
+
+        for name, target in targets.items():
+            target_path = os.path.join(root, target)
+            if not os.path.exists(target_path):
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                shutil.copy2(os.path.join(root, name), target_path)
+                os.chmod(target_path, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+
+        counts = {}
+        for name, target in targets.items():
+            counts[target] = counts.get(target, 0) + len(references[name])
+        with transaction.atomic():
+            # Queryset updates skip the save signals; the counts are set below.
+            for name, target in targets.items():
+                if name == target:
+                    continue
+                for model, field in set(references[name]):
+                    model.objects.filter(**{field: name}).update(**{field: target})
+            for target, (sha256, size) in contents.items():
+                StoredFile.objects.update_or_create(
+                    name=target, defaults={'sha256': sha256, 'size': size, 'refcount': counts[target]},
+                )
+            StoredFile.objects.exclude(name__in=contents).update(refcount=0)
+
+        removed = 0
+        for name, target in targets.items():
+            if name != target:
+                os.remove(os.path.join(root, name))
+                removed += 1
+        if options['remove_orphans']:
+            for path in orphans:
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed += 1
+            uploads.release_unreferenced(list(StoredFile.objects.filter(refcount__lte=0).values_list('name', flat=True)))
+        self.stdout.write("Removed %d files; media now holds %d bytes" % (removed, sum(
+            os.path.getsize(os.path.join(directory, f)) for directory, _, files in os.walk(root) for f in files)))
@@ -0,0 +1,44 @@
+import sys
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp import exports
+
+
+class Command(BaseCommand):
+    help = "Stream payments, enrollments or contact messages to CSV/JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--start', help="First day to include (YYYY-MM-DD).")
+        parser.add_argument('--end', help="Last day to include (YYYY-MM-DD).")
+        parser.add_argument('--format', default='csv', choices=sorted(exports.FORMATS))
+        parser.add_argument('--output', help="File to write to (default: stdout).")
+
+    def handle(self, *args, **options):
+        try:
+            start = exports.parse_day(options['start']) if options['start'] else None
+            end = exports.parse_day(options['end']) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(e)
+
+        columns, rows = exports.export_rows(options['name'], start, end)
+        count = 0
+
+        def counted():
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        started = perf_counter()
+        try:
+            for line in exports.render_lines(options['format'], columns, counted()):
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
+        elapsed = perf_counter() - started
+        self.stderr.write("Exported %d rows in %.2fs (%.0f rows/sec)" % (count, elapsed, count / elapsed if elapsed else 0))
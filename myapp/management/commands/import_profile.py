@@ -0,0 +1,77 @@
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker does before it can serve its first request: build the WSGI
+# application (settings, apps, middleware) and load the URLconf.
+BOOT = (
+    "import time; started = time.perf_counter(); "
+    "import {module}; "
+    "from django.urls import get_resolver; get_resolver().url_patterns; "
+    "print('boot-ms', (time.perf_counter() - started) * 1000)"
+)
+
+
+def parse_importtime(stderr):
+    """
+    Parses `python -X importtime` output.
+
+    Returns:
+        list: `(module, self_us, cumulative_us, depth)` in output order.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Measure how long a fresh worker takes to import the WSGI application and URLconf, and which imports cost the most."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default=settings.WSGI_APPLICATION.rsplit('.', 1)[0],
+                            help="Module to import (default: the WSGI module).")
+        parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters to time; the median is reported.")
+        parser.add_argument('--top', type=int, default=15, help="Rows to show per table.")
+
+    def handle(self, *args, **options):
+        code = BOOT.format(module=options['module'])
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'SkillAcademy.settings'))
+        cwd = str(settings.BASE_DIR)
+
+        timings = []
+        for _ in range(max(options['repeat'], 1)):
+            result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, cwd=cwd)
+            if result.returncode:
+                raise CommandError(result.stderr.strip())
+            timings.append(float(result.stdout.split()[-1]))
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                capture_output=True, text=True, env=env, cwd=cwd)
+        rows = parse_importtime(result.stderr)
+
+        self.stdout.write("Boot (%s + URLconf): median %.1f ms, min %.1f ms over %d runs; %d modules imported" % (
+            options['module'], statistics.median(timings), min(timings), len(timings), len(rows)))
+
+        packages = {}
+        for name, self_us, _, _ in rows:
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + self_us
+        self.stdout.write("\nSelf time by top-level package:")
+        for package, total in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write("  %8.1f ms  %s" % (total / 1000, package))
+
+        # Importtime lists a module after everything it imported; a row's
+        # importer is the next row at a shallower depth.
+        self.stdout.write("\nSlowest imports (cumulative) and who imported them:")
+        for index in sorted(range(len(rows)), key=lambda i: -rows[i][2])[:options['top']]:
+            name, _, cumulative_us, depth = rows[index]
+            importer = next((row[0] for row in rows[index + 1:] if row[3] < depth), '-')
+            self.stdout.write("  %8.1f ms  %s  <- %s" % (cumulative_us / 1000, name, importer))
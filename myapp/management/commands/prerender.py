@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from myapp import prerender
+
+
+class Command(BaseCommand):
+    help = "Render the anonymous catalog pages to static HTML, re-rendering only pages whose inputs changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None, help="Worker processes (default: CPU count, 0 = no pool).")
+        parser.add_argument('--force', action='store_true', help="Render every page even if its inputs are unchanged.")
+        parser.add_argument('--output', default=None, help="Output directory (default: PRERENDER_ROOT).")
+
+    def handle(self, *args, **options):
+        result = prerender.build(processes=options['processes'], force=options['force'], root=options['output'])
+        self.stdout.write(
+            "Rendered %(rendered)d, unchanged %(unchanged)d, removed %(removed)d, failed %(failed)d "
+            "pages in %(seconds).2fs" % result
+        )
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from myapp import provisioning
+
+
+class Command(BaseCommand):
+    help = "Create accounts and enrollments for a CSV of learners (columns: email, course) and report throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv', help="CSV file with an 'email' and an optional 'course' (id) column.")
+        parser.add_argument('--mode', default='token', choices=provisioning.MODES,
+                            help="Issue password-reset tokens (default) or random initial passwords.")
+        parser.add_argument('--processes', type=int, help="Password hashing processes (default: CPU count).")
+        parser.add_argument('--unpaid', action='store_true', help="Create the enrollments with paid=False.")
+        parser.add_argument('--base-url', default='', help="Prefix for the reset links, e.g. https://example.com.")
+        parser.add_argument('--output', help="File to write the new accounts' credentials to (CSV).")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['csv'], newline='') as f:
+                rows = provisioning.read_rows(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        report = provisioning.provision(rows, options['mode'], options['processes'], paid=not options['unpaid'])
+        credentials = report.pop('credentials')
+        if options['output']:
+            def reset_url(uid, token):
+                return options['base_url'] + reverse('password_reset_confirm', args=[uid, token])
+            with open(options['output'], 'w', newline='') as f:
+                f.write(provisioning.credentials_csv(credentials, reset_url))
+        for entry in report.pop('rejected'):
+            self.stderr.write("rejected %(email)s (course %(course)s): %(reason)s" % entry)
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,66 @@
+import random
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from myapp import recommendations
+from myapp.models import Categories, Course, UserCourse
+
+
+class Command(BaseCommand):
+    help = "Rebuild the course co-occurrence matrix and top-K recommendations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--benchmark', type=int, metavar='N',
+                            help="Time rebuild() with N synthetic enrollments added to the database, "
+                                 "then roll everything back.")
+        parser.add_argument('--courses', type=int, default=500, help="Courses in the synthetic catalog.")
+        parser.add_argument('--per-user', type=int, default=8, help="Average enrollments per synthetic user.")
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            return self.benchmark(options['benchmark'], options['courses'], options['per_user'])
+
+        started = perf_counter()
+        cells = recommendations.rebuild()
+        self.stdout.write("Rebuilt %d co-occurrence cells in %.2fs" % (cells, perf_counter() - started))
+
+    def benchmark(self, total, courses, per_user):
+        with transaction.atomic():
+            self.seed(total, courses, per_user)
+            started = perf_counter()
+            cells = recommendations.rebuild()
+            finished = perf_counter()
+            transaction.set_rollback(True)
+        self.stdout.write(
+            "%d synthetic enrollments, %d courses: rebuilt %d co-occurrence cells in %.2fs (rolled back)"
+            % (total, courses, cells, finished - started)
+        )
+
+    def seed(self, total, courses, per_user):
+        """
+        Adds `courses` courses and enough users to hold `total` enrollments,
+        about `per_user` each, with bulk INSERTs that fire no signals.
+        """
+        rng = random.Random(0)
+        category = Categories.objects.create(name='Benchmark')
+        course_ids = [
+            course.id for course in Course.objects.bulk_create(
+                Course(title='Benchmark %d' % i, description='', category=category) for i in range(courses)
+            )
+        ]
+        enrolled = []
+        while len(enrolled) < total:
+            size = min(rng.randint(1, per_user * 2 - 1), courses, total - len(enrolled))
+            enrolled.append(rng.sample(course_ids, size))
+        prefix = 'benchmark-%08x-' % rng.getrandbits(32)
+        users = User.objects.bulk_create(
+            (User(username=prefix + str(i)) for i in range(len(enrolled))), batch_size=recommendations.BATCH_SIZE,
+        )
+        UserCourse.objects.bulk_create(
+            (UserCourse(user_id=user.id, course_id=course_id)
+             for user, ids in zip(users, enrolled) for course_id in ids),
+            batch_size=recommendations.BATCH_SIZE,
+        )
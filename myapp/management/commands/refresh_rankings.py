@@ -0,0 +1,17 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from myapp import rankings
+
+
+class Command(BaseCommand):
+    help = "Decay and update the popular/trending course rankings. Run it on a schedule (e.g. hourly from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Discard stored scores and replay every event.")
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        updated = rankings.refresh(full=options['full'])
+        self.stdout.write("Updated rankings for %d courses in %.2fs" % (updated, perf_counter() - started))
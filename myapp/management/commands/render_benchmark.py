@@ -0,0 +1,83 @@
+import statistics
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Engine, engines
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from myapp import templating
+from myapp.models import Categories, Course
+
+UNCACHED_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
+
+def pages():
+    urls = [reverse('home'), reverse('single_course'), reverse('about_us'), reverse('contact_us')]
+    course = Course.objects.filter(status='PUBLISH').order_by('id').values_list('id', flat=True).first()
+    if course is not None:
+        urls.append(reverse('course_details', args=[course]))
+    category = Categories.objects.order_by('id').values_list('id', flat=True).first()
+    if category is not None:
+        urls.append(reverse('category_courses', args=[category]))
+    return urls
+
+
+def capture(client, url):
+    """
+    Requests `url` and returns the name and flattened context of the page
+    template it rendered.
+    """
+    response = client.get(url)
+    context = response.context
+    if not isinstance(context, Context):
+        context = context[0]
+    return response.templates[0].name, context.flatten()
+
+
+def timed(engine, name, context, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = perf_counter()
+        engine.get_template(name).render(Context(context, autoescape=engine.autoescape))
+        timings.append((perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = "Compare page render times with uncached loaders and plain includes against the cached loader and prerendered static components."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50, help="Renders per page and mode; the median is reported.")
+
+    def handle(self, *args, **options):
+        repeat = max(options['repeat'], 1)
+        cached = engines['django'].engine
+        uncached = Engine(dirs=cached.dirs, loaders=UNCACHED_LOADERS, libraries=cached.libraries,
+                          debug=cached.debug, autoescape=cached.autoescape)
+        templating.warm()
+
+        setup_test_environment()
+        try:
+            client = Client()
+            captured = [(url,) + capture(client, url) for url in pages()]
+        finally:
+            teardown_test_environment()
+
+        self.stdout.write("%-28s %-30s %10s %10s %8s" % ('page', 'template', 'before ms', 'after ms', 'speedup'))
+        totals = [0, 0]
+        for url, name, context in captured:
+            templating.enabled = False
+            try:
+                before = timed(uncached, name, context, repeat)
+            finally:
+                templating.enabled = True
+            after = timed(cached, name, context, repeat)
+            totals[0] += before
+            totals[1] += after
+            self.stdout.write("%-28s %-30s %10.2f %10.2f %7.1fx" % (url, name, before, after, before / after))
+        self.stdout.write("%-59s %10.2f %10.2f %7.1fx" % ('total', totals[0], totals[1], totals[0] / totals[1]))
@@ -0,0 +1,57 @@
+import json
+import os
+import re
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from myapp import prerender, staticfiles
+
+ASSET_URL = re.compile(r'(?:href|src)=["\']([^"\']+)["\']')
+
+
+class Command(BaseCommand):
+    help = "Report, per page, the static bytes a browser downloads with and without the precompressed variants. Run collectstatic first."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help="URL paths to report on (default: every prerendered page).")
+
+    def handle(self, *args, **options):
+        try:
+            with open(os.path.join(settings.STATIC_ROOT, ManifestStaticFilesStorage.manifest_name)) as f:
+                hashed = json.load(f)['paths']
+            with open(os.path.join(settings.STATIC_ROOT, staticfiles.COMPRESSION_MANIFEST)) as f:
+                compressed = json.load(f)
+        except (OSError, ValueError, KeyError):
+            raise CommandError("No static build found in %s; run collectstatic first." % settings.STATIC_ROOT)
+
+        paths = options['paths'] or sorted(prerender.page_digests())
+        client = Client(HTTP_HOST=prerender._host())
+        totals = [0, 0]
+        for path in paths:
+            response = client.get(path)
+            if response.status_code != 200:
+                self.stderr.write("%s: HTTP %d, skipped" % (path, response.status_code))
+                continue
+            raw = best = assets = 0
+            for url in set(ASSET_URL.findall(response.content.decode())):
+                url = unquote(urlsplit(url).path)
+                if not url.startswith(settings.STATIC_URL):
+                    continue
+                name = url[len(settings.STATIC_URL):]
+                name = hashed.get(name, name)
+                file_path = os.path.join(settings.STATIC_ROOT, name)
+                if not os.path.isfile(file_path):
+                    continue
+                entry = compressed.get(name, {'size': os.path.getsize(file_path)})
+                assets += 1
+                raw += entry['size']
+                best += min(entry.get('br', entry['size']), entry.get('gzip', entry['size']))
+            totals[0] += raw
+            totals[1] += best
+            self.stdout.write("%-45s %3d assets %10d -> %10d bytes, saved %10d (%.1f%%)" % (
+                path, assets, raw, best, raw - best, 100.0 * (raw - best) / raw if raw else 0.0))
+        self.stdout.write("Total saved %d of %d bytes" % (totals[0] - totals[1], totals[0]))
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.3 on 2026-10-19 14:52
+
+from django.db import migrations, models
+
+from myapp.pricing import effective_price
+
+
+def populate_effective_price(apps, schema_editor):
+    Course = apps.get_model('myapp', 'Course')
+    courses = list(Course.objects.only('id', 'price', 'discount'))
+    for course in courses:
+        course.effective_price = effective_price(course.price, course.discount)
+    Course.objects.bulk_update(courses, ['effective_price'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_remove_reviewdb_user_reviewdb_selectuser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='effective_price',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(populate_effective_price, migrations.RunPython.noop),
+    ]
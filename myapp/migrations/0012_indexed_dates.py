@@ -0,0 +1,28 @@
+# Generated by Django 4.2.3 on 2026-10-19 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_courseprogress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contactdb',
+            name='date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='usercourse',
+            name='date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.3 on 2026-10-19 15:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_indexed_dates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseRecommendation',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='myapp.course')),
+                ('neighbours', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CourseCooccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='myapp.course')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='myapp.course')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='coursecooccurrence',
+            constraint=models.UniqueConstraint(fields=('course', 'other'), name='unique_course_cooccurrence'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-19 15:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseRanking',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='myapp.course')),
+                ('popularity', models.FloatField(db_index=True, default=0)),
+                ('trending', models.FloatField(db_index=True, default=0)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.3 on 2026-10-19 15:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0014_courseranking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCourseSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('paid_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.PositiveBigIntegerField(default=0)),
+                ('free_enrollments', models.PositiveIntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.course')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('paid_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.PositiveBigIntegerField(default=0)),
+                ('free_enrollments', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.categories')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailycoursesales',
+            constraint=models.UniqueConstraint(fields=('day', 'course'), name='unique_daily_course_sales'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycategorysales',
+            constraint=models.UniqueConstraint(fields=('day', 'category'), name='unique_daily_category_sales'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.3 on 2026-10-19 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0016_invalidationevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True)),
+                ('sql', models.TextField()),
+                ('plan', models.TextField(blank=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('last_path', models.CharField(blank=True, max_length=500)),
+                ('last_seen', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-19 15:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0018_storedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.course')),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='myapp.payment')),
+                ('user_course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='myapp.usercourse')),
+            ],
+        ),
+    ]
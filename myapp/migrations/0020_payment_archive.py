@@ -0,0 +1,46 @@
+# Generated by Django 4.2.3 on 2026-10-19 15:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('myapp', '0019_paymentitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_id', models.CharField(blank=True, db_index=True, max_length=100, null=True)),
+                ('payment_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('date', models.DateTimeField(db_index=True)),
+                ('status', models.BooleanField(default=False)),
+                ('archived_at', models.DateTimeField()),
+                ('reason', models.CharField(max_length=10)),
+                ('course', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='myapp.course')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('user_course', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='myapp.usercourse')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='order_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedPaymentItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.PositiveIntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.course')),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='myapp.archivedpayment')),
+                ('user_course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='myapp.usercourse')),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.3 on 2026-10-19 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0020_payment_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contactdb',
+            name='digest',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='contactdb',
+            name='ip',
+            field=models.GenericIPAddressField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='contactdb',
+            name='MESSAGE',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
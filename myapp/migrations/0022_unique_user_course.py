@@ -0,0 +1,43 @@
+# Generated by Django 4.2.3 on 2026-10-19 15:36
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def merge_duplicate_enrollments(apps, schema_editor):
+    """
+    Keeps the oldest `UserCourse` of each (user, course), paid if any of
+    the duplicates was, and points payments at it before deleting the rest.
+    """
+    UserCourse = apps.get_model('myapp', 'UserCourse')
+    referencing = [apps.get_model('myapp', name) for name in ('Payment', 'PaymentItem', 'ArchivedPayment', 'ArchivedPaymentItem')]
+    duplicates = (
+        UserCourse.objects.values('user_id', 'course_id')
+        .annotate(rows=Count('id'), keep=Min('id'), paid_any=Max('paid'))
+        .filter(rows__gt=1)
+    )
+    for group in duplicates.iterator():
+        others = list(
+            UserCourse.objects.filter(user_id=group['user_id'], course_id=group['course_id'])
+            .exclude(id=group['keep']).values_list('id', flat=True)
+        )
+        for model in referencing:
+            model.objects.filter(user_course_id__in=others).update(user_course_id=group['keep'])
+        if group['paid_any']:
+            UserCourse.objects.filter(id=group['keep']).update(paid=True)
+        UserCourse.objects.filter(id__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0021_contact_ingestion'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_enrollments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='usercourse',
+            constraint=models.UniqueConstraint(fields=('user', 'course'), name='unique_user_course'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.3 on 2026-10-19 15:48
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+
+
+def populate_amount(apps, schema_editor):
+    """
+    Fills the new column with the best record of what was charged: the
+    items of cart orders, the course's current price otherwise.
+    """
+    Course = apps.get_model('myapp', 'Course')
+    for payment_model, item_model in (('Payment', 'PaymentItem'), ('ArchivedPayment', 'ArchivedPaymentItem')):
+        Payment = apps.get_model('myapp', payment_model)
+        Item = apps.get_model('myapp', item_model)
+        price = Course.objects.filter(id=OuterRef('course_id')).values('effective_price')
+        Payment.objects.filter(course__isnull=False).update(amount=Subquery(price))
+        items = (
+            Item.objects.filter(payment_id=OuterRef('id')).order_by()
+            .values('payment_id').annotate(total=Sum('amount')).values('total')
+        )
+        Payment.objects.filter(course__isnull=True, items__isnull=False).update(amount=Subquery(items))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0022_unique_user_course'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedpayment',
+            name='amount',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='amount',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_amount, migrations.RunPython.noop),
+    ]
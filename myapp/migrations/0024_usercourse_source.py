@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-19 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0023_payment_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercourse',
+            name='source',
+            field=models.CharField(choices=[('SELF', 'SELF'), ('PROVISIONED', 'PROVISIONED')], default='SELF', max_length=20),
+        ),
+    ]
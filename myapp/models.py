@@ -11,6 +11,8 @@ from django.db import models
 from django.utils.text import slugify
 from django.db.models.signals import pre_save
 
+from myapp.pricing import effective_price
+
 
 # Create your models here.
 class Categories(models.Model):
@@ -86,12 +88,14 @@ class Course(models.Model):
     - `description`: A text field for the course description.
     - `price`: An integer field for the course price (nullable, default: 0).
     - `discount`: An integer field for any discount (nullable).
+    - `effective_price`: The indexed selling price in paise, derived from `price` and `discount` on save.
     - `slug`: A slug field for a human-readable URL (nullable).
     - `status`: A choice field for the course status.
 
     Methods:
     - `__str__`: Returns the title of the course.
     - `get_absolute_url()`: Returns the absolute URL of the course details page.
+    - `stats`: Curriculum statistics (minutes, lessons, videos, previews) from `myapp.course_stats`.
 
     """
     STATUS = (
@@ -109,6 +113,7 @@ class Course(models.Model):
     description = models.TextField()
     price = models.IntegerField(null=True,default=0)
     discount = models.IntegerField(null=True)
+    effective_price = models.PositiveIntegerField(default=0, db_index=True, editable=False)
     slug = models.SlugField(default='', max_length=500, null=True, blank=True)
     status = models.CharField(choices=STATUS,max_length=100,null=True)
 
@@ -118,6 +123,13 @@ class Course(models.Model):
     def get_absolute_url(self):
         from django.urls import reverse
         return reverse("course_details", kwargs={'slug': self.slug})
+
+    @property
+    def stats(self):
+        if not hasattr(self, '_stats'):
+            from myapp import course_stats
+            self._stats = course_stats.get_stats([self.id]).get(self.id, course_stats.EMPTY_STATS)
+        return self._stats
     
 
 def create_slug(instance, new_slug=None):
@@ -139,6 +151,12 @@ def pre_save_post_receiver(sender, instance, *args, **kwargs):
 pre_save.connect(pre_save_post_receiver, Course)
 
 
+def update_effective_price(sender, instance, *args, **kwargs):
+    instance.effective_price = effective_price(instance.price, instance.discount)
+
+pre_save.connect(update_effective_price, Course)
+
+
 class Lesson(models.Model):
     """
     Represents a lesson associated with a course.
@@ -198,20 +216,63 @@ class UserCourse(models.Model):
     - `course`: A foreign key to the Course model, indicating the enrolled course.
     - `paid`: A boolean field indicating whether the user has paid for the course (default: False).
     - `date`: A date and time field representing the enrollment date (auto-generated).
+    - `source`: `SELF` when the learner enrolled (free or paid checkout), `PROVISIONED` when the
+      enrollment was created in bulk for a corporate cohort by `myapp.provisioning`.
+
+    A user is enrolled in a course at most once; create rows through
+    `myapp.enrollment`.
 
     Methods:
     - `__str__`: Returns a formatted string with the user's first name and the enrolled course title.
 
     """
+    SOURCE = (
+        ('SELF', 'SELF'),
+        ('PROVISIONED', 'PROVISIONED'),
+    )
+
     user = models.ForeignKey(User,on_delete=models.CASCADE)
     course = models.ForeignKey(Course,on_delete=models.CASCADE)
     paid = models.BooleanField(default=0)
-    date = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
+    source = models.CharField(choices=SOURCE, max_length=20, default='SELF')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'course'], name='unique_user_course'),
+        ]
 
     def __str__(self):
         return self.user.first_name + "-" + self.course.title
 
 
+class CourseProgress(models.Model):
+    """
+    Represents a user's progress through the videos of a course.
+
+    Fields:
+    - `user`: A foreign key to the User model.
+    - `course`: A foreign key to the Course model.
+    - `watched`: A little-endian bitmap; bit `n` is set once the video with `serial_number` n has been watched.
+    - `updated_at`: A date and time field updated on every flush.
+
+    Rows are written in batches by `myapp.progress`, never per heartbeat.
+
+    """
+    user = models.ForeignKey(User,on_delete=models.CASCADE)
+    course = models.ForeignKey(Course,on_delete=models.CASCADE)
+    watched = models.BinaryField(default=b'')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'course'], name='unique_course_progress'),
+        ]
+
+    def __str__(self):
+        return "%s-%s" % (self.user_id, self.course_id)
+
+
 class Payment(models.Model):
     """
     Represents a payment transaction for a user's enrollment in a course.
@@ -224,21 +285,261 @@ class Payment(models.Model):
     - `course`: A foreign key to the Course model, indicating the enrolled course (nullable).
     - `date`: A date and time field representing the payment transaction date (auto-generated).
     - `status`: A boolean field indicating the payment status (default: False).
+    - `amount`: The amount charged for the order, in paise, fixed when the order is created.
 
     Methods:
     - `__str__`: Returns a formatted string with the user's first name and the enrolled course title.
 
     """
-    order_id = models.CharField(max_length=100,null=True,blank=True)
+    order_id = models.CharField(max_length=100,null=True,blank=True,db_index=True)
     payment_id = models.CharField(max_length=100,null=True,blank=True)
     user_course = models.ForeignKey(UserCourse,on_delete=models.CASCADE,null=True)
     user = models.ForeignKey(User,on_delete=models.CASCADE,null=True)
     course = models.ForeignKey(Course,on_delete=models.CASCADE,null=True)
-    date = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
     status = models.BooleanField(default=False)
+    amount = models.PositiveIntegerField(default=0)
 
     def __str__(self):
-        return self.user.first_name + "-" + self.course.title
+        return self.user.first_name + "-" + (self.course.title if self.course_id else "cart")
+
+
+class PaymentItem(models.Model):
+    """
+    One course of a multi-course (cart) order. Cart orders leave
+    `Payment.course` and `Payment.user_course` empty and list their courses
+    here instead.
+
+    Fields:
+    - `payment`: The order the item belongs to.
+    - `course`: The purchased course.
+    - `amount`: The course's selling price in paise when the order was created.
+    - `user_course`: The enrollment created when the payment was verified (nullable).
+
+    """
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='items')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField(default=0)
+    user_course = models.ForeignKey(UserCourse, on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return "%s-%s" % (self.payment.order_id, self.course.title)
+
+
+class ArchivedPayment(models.Model):
+    """
+    A `Payment` moved out of the hot table by `myapp.archive`: a completed
+    payment past its retention period, or an order that was never paid.
+    The row keeps its original id and columns.
+
+    Fields:
+    - The columns of `Payment`, with the same meaning.
+    - `archived_at`: When the row was moved.
+    - `reason`: `completed` or `abandoned`.
+
+    """
+    id = models.BigIntegerField(primary_key=True)
+    order_id = models.CharField(max_length=100, null=True, blank=True, db_index=True)
+    payment_id = models.CharField(max_length=100, null=True, blank=True)
+    user_course = models.ForeignKey(UserCourse, on_delete=models.CASCADE, null=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, null=True)
+    date = models.DateTimeField(db_index=True)
+    status = models.BooleanField(default=False)
+    amount = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField()
+    reason = models.CharField(max_length=10)
+
+    def __str__(self):
+        return "%s (archived)" % self.order_id
+
+
+class ArchivedPaymentItem(models.Model):
+    """
+    A `PaymentItem` of an archived cart order, keeping its original id.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    payment = models.ForeignKey(ArchivedPayment, on_delete=models.CASCADE, related_name='items')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField(default=0)
+    user_course = models.ForeignKey(UserCourse, on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return "%s-%s" % (self.payment.order_id, self.course.title)
+
+
+class CourseCooccurrence(models.Model):
+    """
+    One non-zero cell of the sparse course x course co-occurrence matrix:
+    the number of users enrolled in both `course` and `other`.
+
+    Fields:
+    - `course`: A foreign key to the Course model (the row).
+    - `other`: A foreign key to the Course model (the column).
+    - `count`: The number of users enrolled in both courses.
+
+    Both (a, b) and (b, a) are stored. Maintained by `myapp.recommendations`.
+
+    """
+    course = models.ForeignKey(Course,on_delete=models.CASCADE,related_name='+')
+    other = models.ForeignKey(Course,on_delete=models.CASCADE,related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'other'], name='unique_course_cooccurrence'),
+        ]
+
+
+class CourseRecommendation(models.Model):
+    """
+    The precomputed "students also enrolled in" list for a course.
+
+    Fields:
+    - `course`: A one-to-one key to the Course model.
+    - `neighbours`: A JSON list of up to `TOP_K` course ids, best first.
+
+    """
+    course = models.OneToOneField(Course,on_delete=models.CASCADE,primary_key=True,related_name='+')
+    neighbours = models.JSONField(default=list)
+
+
+class CourseRanking(models.Model):
+    """
+    Materialized, time-decayed popularity scores for a course.
+
+    Fields:
+    - `course`: A one-to-one key to the Course model.
+    - `popularity`: Long half-life score from enrollments, paid payments and reviews.
+    - `trending`: Short half-life score from the same events.
+    - `review_count`: Reviews already counted into the scores.
+    - `updated_at`: The time both scores are decayed to.
+
+    Maintained by `myapp.rankings` (`manage.py refresh_rankings`).
+
+    """
+    course = models.OneToOneField(Course,on_delete=models.CASCADE,primary_key=True,related_name='ranking')
+    popularity = models.FloatField(default=0, db_index=True)
+    trending = models.FloatField(default=0, db_index=True)
+    review_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(null=True)
+
+
+class SalesRollup(models.Model):
+    """
+    Abstract base for the daily sales rollups maintained by `myapp.rollups`.
+
+    Fields:
+    - `day`: The day the orders were created.
+    - `orders`: Orders (Payment rows) created.
+    - `paid_count`: Orders verified as paid.
+    - `revenue`: Revenue from paid orders, in paise.
+    - `free_enrollments`: Enrollments in free courses.
+
+    """
+    day = models.DateField(db_index=True)
+    orders = models.PositiveIntegerField(default=0)
+    paid_count = models.PositiveIntegerField(default=0)
+    revenue = models.PositiveBigIntegerField(default=0)
+    free_enrollments = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DailyCourseSales(SalesRollup):
+    course = models.ForeignKey(Course,on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'course'], name='unique_daily_course_sales'),
+        ]
+
+    def __str__(self):
+        return "%s %s" % (self.day, self.course_id)
+
+
+class DailyCategorySales(SalesRollup):
+    category = models.ForeignKey(Categories,on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='unique_daily_category_sales'),
+        ]
+
+    def __str__(self):
+        return "%s %s" % (self.day, self.category_id)
+
+
+class InvalidationEvent(models.Model):
+    """
+    One entry in the cross-process cache invalidation log.
+
+    Fields:
+    - `id`: Monotonically increasing sequence number; workers remember the last one they processed.
+    - `entity`: What changed (e.g. 'course', 'curriculum').
+    - `object_id`: The affected object id (nullable, meaning "all").
+    - `created_at`: When the event was published; old events are pruned.
+
+    Written and read by `myapp.invalidation`.
+
+    """
+    entity = models.CharField(max_length=50)
+    object_id = models.BigIntegerField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class SlowQuery(models.Model):
+    """
+    Aggregated statistics for one slow SQL statement shape, recorded by
+    `myapp.profiling`.
+
+    Fields:
+    - `fingerprint`: SHA-1 of the normalised SQL (literals and IN lists collapsed).
+    - `sql`: The normalised SQL.
+    - `plan`: The SQLite `EXPLAIN QUERY PLAN` output from the latest occurrence.
+    - `count`: Number of slow executions.
+    - `total_ms` / `max_ms`: Total and worst duration in milliseconds.
+    - `last_path`: Request path of the latest occurrence.
+    - `last_seen`: Time of the latest occurrence.
+
+    """
+    fingerprint = models.CharField(max_length=40, unique=True)
+    sql = models.TextField()
+    plan = models.TextField(blank=True)
+    count = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    last_path = models.CharField(max_length=500, blank=True)
+    last_seen = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.sql[:80]
+
+    @property
+    def average_ms(self):
+        return self.total_ms / self.count if self.count else 0
+
+
+class StoredFile(models.Model):
+    """
+    One content-addressed media file, shared by every field that stores
+    the same bytes. Maintained by `myapp.uploads`.
+
+    Fields:
+    - `name`: Storage path (`Media/content/<sha[:2]>/<sha><ext>`).
+    - `sha256`: Hex digest of the content.
+    - `size`: Size in bytes.
+    - `refcount`: Number of model fields pointing at the file; it is deleted at zero.
+
+    """
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.name
 
 
 class contactdb (models.Model):
@@ -248,7 +549,11 @@ class contactdb (models.Model):
     Fields:
     - `NAME`: A character field for the user's name (nullable).
     - `EMAIL`: A character field for the user's email address (nullable).
-    - `MESSAGE`: A character field for the user's message (nullable).
+    - `MESSAGE`: A text field for the user's message (nullable).
+    - `date`: A date and time field for when the message was received (null for older rows).
+    - `ip`: The address the message was sent from (null for older rows).
+    - `digest`: SHA-256 of the normalized email and message, unique so that
+      repeated submissions are stored once (see `myapp.contact`).
 
     Methods:
     - `__str__`: Returns the user's name.
@@ -256,7 +561,10 @@ class contactdb (models.Model):
     """
     NAME = models.CharField(max_length=50, null=True, blank=True)
     EMAIL = models.CharField(max_length=50, null=True, blank=True)
-    MESSAGE = models.CharField(max_length=50, null=True, blank=True)
+    MESSAGE = models.TextField(null=True, blank=True)
+    date = models.DateTimeField(auto_now_add=True, null=True, db_index=True)
+    ip = models.GenericIPAddressField(null=True, blank=True)
+    digest = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.NAME
@@ -0,0 +1,275 @@
+"""
+Module: prerender.py
+
+This module renders the anonymous versions of the catalog pages (HOME,
+SINGLE_COURSE, ABOUT_US, the per-category listings and every
+COURSE_DETAILS page) to static HTML files under `PRERENDER_ROOT`, one
+`index.html` per URL path, so that a front-end server can serve them
+without reaching Django. Django stays the fallback for everything else.
+
+Every page has an input digest computed from a few cheap queries: the
+templates, the navigation (categories and course titles), the levels, the
+cards (course row, author and curriculum statistics) it lists, and, for
+course pages, the curriculum, reviews and related courses. The digests are
+kept in `manifest.json`, and a build only renders pages whose digest
+changed, in a pool of forked processes. Files are replaced atomically, and
+pages that no longer exist are removed.
+
+Nothing is rendered while serving requests. Saving or deleting a course
+only withdraws (deletes) the files of the pages that show its card or its
+details, so the front end falls back to Django for them. The next run of
+the `prerender` command, e.g. from cron, finds the files missing and
+renders them again. Other pages keep showing the old course title in
+their header until that run, which re-renders them because the title is
+part of every page's digest.
+
+The files are what an anonymous visitor sees. The front end must serve
+them only to requests without a session cookie (`sessionid`, e.g. an
+empty `$cookie_sessionid` in nginx) and without a `messages` cookie. A
+logged-in visitor would otherwise get a header without their name, and a
+visitor with a pending flash message would not see the message.
+
+Forms on these pages also need a CSRF token, which cannot be baked into a
+file shared by every visitor. The token field holds `CSRF_PLACEHOLDER`.
+The front end should also require a `csrftoken` cookie and substitute its
+value (e.g. nginx `sub_filter` with `$cookie_csrftoken`). Every other
+request goes to Django, which sets the cookie.
+
+"""
+import hashlib
+import json
+import os
+import re
+from io import BytesIO
+from time import monotonic
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+from django.db import connections, transaction
+from django.urls import reverse
+
+from myapp import catalog, course_stats
+from myapp.models import Author, Categories, Course, Lesson, Level, Video, reviewdb
+
+MANIFEST = 'manifest.json'
+CSRF_PLACEHOLDER = '__CSRF_TOKEN__'
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+_handler = None
+
+
+def output_root():
+    return str(getattr(settings, 'PRERENDER_ROOT', os.path.join(settings.BASE_DIR, 'prerendered')))
+
+
+def _digest(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _templates_digest():
+    sha = hashlib.sha1()
+    for engine in settings.TEMPLATES:
+        directories = [os.path.join(settings.BASE_DIR, directory) for directory in engine.get('DIRS', [])]
+        directories.append(os.path.join(settings.BASE_DIR, 'myapp', 'templates'))
+        for directory in directories:
+            for root, dirs, files in os.walk(directory):
+                dirs.sort()
+                for name in sorted(files):
+                    with open(os.path.join(root, name), 'rb') as f:
+                        sha.update(name.encode())
+                        sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _grouped(queryset, key):
+    groups = {}
+    for row in queryset:
+        groups.setdefault(row[key], []).append(row)
+    return groups
+
+
+def page_digests():
+    """
+    Computes the input digest of every prerenderable page.
+
+    Returns:
+        dict: A mapping of URL path to digest.
+    """
+    from myapp.views import related_courses
+
+    base = _templates_digest()
+    categories = list(Categories.objects.order_by('id').values_list())
+    # The header lists every course by category.
+    nav = _digest(base, categories, list(Course.objects.order_by('id').values_list('id', 'title', 'category_id')))
+    levels = list(Level.objects.order_by('id').values_list())
+    authors = {row[0]: row for row in Author.objects.values_list()}
+    rows = {row[0]: row for row in Course.objects.values_list()}
+    snapshot = catalog.get_snapshot()
+    # The snapshot may still list a course deleted since it was built.
+    cards = [card for card in snapshot.select(snapshot.all_mask) if card.id in rows]
+    stats = course_stats.compute_stats([card.id for card in cards])
+    card_digest = {card.id: _digest(rows[card.id], authors.get(card.author_id), stats[card.id]) for card in cards}
+    lessons = _grouped(Lesson.objects.order_by('id').values(), 'course_id')
+    videos = _grouped(Video.objects.order_by('id').values(), 'course_id')
+    reviews = _grouped(reviewdb.objects.order_by('id').values(), 'selectcourse')
+
+    pages = {
+        reverse('home'): _digest(nav, [card_digest[card.id] for card in cards if card.status == 'PUBLISH']),
+        reverse('single_course'): _digest(nav, levels, [card_digest[card.id] for card in cards]),
+        reverse('about_us'): _digest(nav, list(reviews.items())),
+    }
+    for category in categories:
+        listed = [card_digest[card.id] for card in cards if card.category_id == category[0]]
+        pages[reverse('category_courses', args=[category[0]])] = _digest(nav, levels, listed)
+    for card in cards:
+        related = [card_digest.get(other.id) for other in related_courses(snapshot, card.id, cards)]
+        pages[reverse('course_details', args=[card.id])] = _digest(
+            nav, card_digest[card.id], lessons.get(card.id), videos.get(card.id),
+            reviews.get(card.title), related,
+        )
+    return pages
+
+
+def _file_for(root, path):
+    return os.path.join(root, path.strip('/'), 'index.html')
+
+
+def _host():
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+    return getattr(settings, 'PRERENDER_HOST', None) or (hosts[0] if hosts else 'localhost')
+
+
+def _get(path):
+    """
+    Sends a cookieless GET for `path` through the full middleware stack,
+    like the WSGI server would, without the request signals (which would
+    close the build's database connection).
+    """
+    global _handler
+    if _handler is None:
+        _handler = WSGIHandler()
+    host = _host()
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'SERVER_NAME': host, 'SERVER_PORT': '80',
+        'HTTP_HOST': host, 'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(),
+    }
+    return _handler.get_response(WSGIRequest(environ))
+
+
+def render_page(root, path):
+    """
+    Renders `path` as an anonymous visitor and writes it to its file.
+
+    Returns:
+        tuple: `(path, status_code)`; the file is only written on 200.
+    """
+    response = _get(path)
+    if response.status_code == 200:
+        content = CSRF_INPUT.sub(rb'\g<1>' + CSRF_PLACEHOLDER.encode() + rb'\g<2>', response.content)
+        target = _file_for(root, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(target + '.tmp', target)
+    return path, response.status_code
+
+
+def _render_batch(root, paths):
+    try:
+        return [render_page(root, path) for path in paths]
+    finally:
+        connections.close_all()
+
+
+def build(processes=None, force=False, root=None):
+    """
+    Renders every page whose inputs changed since the last build.
+
+    Args:
+        processes: Worker processes (defaults to the CPU count); 0 renders
+            in the calling process.
+        force: Render every page regardless of the manifest.
+        root: Output directory (defaults to `PRERENDER_ROOT`).
+
+    Returns:
+        dict: Counts of `rendered`, `unchanged`, `removed` and `failed`
+        pages, plus `seconds`.
+    """
+    started = monotonic()
+    root = root or output_root()
+    manifest_path = os.path.join(root, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    digests = page_digests()
+    stale = [path for path, digest in digests.items()
+             if force or previous.get(path) != digest or not os.path.exists(_file_for(root, path))]
+
+    results = []
+    if stale:
+        processes = os.cpu_count() if processes is None else processes
+        if processes and len(stale) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            from multiprocessing import get_context
+
+            batches = [stale[i::processes] for i in range(min(processes, len(stale)))]
+            connections.close_all()
+            with ProcessPoolExecutor(len(batches), mp_context=get_context('fork')) as pool:
+                for batch in pool.map(_render_batch, [root] * len(batches), batches):
+                    results.extend(batch)
+        else:
+            results = [render_page(root, path) for path in stale]
+
+    failed = {path for path, status in results if status != 200}
+    manifest = {path: digest for path, digest in digests.items() if path not in failed}
+    removed = 0
+    for path in set(previous) - set(digests):
+        try:
+            os.remove(_file_for(root, path))
+            removed += 1
+        except OSError:
+            pass
+    os.makedirs(root, exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return {
+        'rendered': len(results) - len(failed),
+        'unchanged': len(digests) - len(stale),
+        'removed': removed,
+        'failed': len(failed),
+        'seconds': round(monotonic() - started, 3),
+    }
+
+
+def withdraw(paths, root=None):
+    """
+    Deletes the files of `paths`, so that they are served by Django until
+    the next build renders them again.
+
+    Returns:
+        int: The number of files deleted.
+    """
+    root = root or output_root()
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(_file_for(root, path))
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def course_changed(sender, instance, **kwargs):
+    """
+    `post_save`/`post_delete` receiver for `Course`: once the transaction
+    commits, withdraws the listings and the details page of the course.
+    """
+    paths = [reverse('home'), reverse('single_course'), reverse('course_details', args=[instance.id])]
+    if instance.category_id is not None:
+        paths.append(reverse('category_courses', args=[instance.category_id]))
+    transaction.on_commit(lambda: withdraw(paths))
@@ -0,0 +1,57 @@
+"""
+Module: pricing.py
+
+This module owns the price calculation for courses. `Course.price` is stored
+in whole rupees and `Course.discount` as a percentage; everything derived
+from them (the selling price shown on listings, the amount sent to Razorpay
+and the indexed `Course.effective_price` column) is computed here in integer
+paise so that display, filtering and checkout always agree.
+
+"""
+PAISE_PER_RUPEE = 100
+
+
+def effective_price(price, discount):
+    """
+    Returns the selling price of a course in paise.
+
+    The discount is applied in integer arithmetic and rounded down to the
+    nearest paisa, so the result never exceeds what is shown to the user.
+
+    Args:
+        price: The list price in rupees (may be None).
+        discount: The discount percentage (may be None).
+
+    Returns:
+        int: The selling price in paise.
+    """
+    price_paise = (price or 0) * PAISE_PER_RUPEE
+    discount = min(max(discount or 0, 0), 100)
+    return price_paise * (100 - discount) // 100
+
+
+def rupees_to_paise(amount):
+    """
+    Converts a whole-rupee amount (as entered in a filter form) to paise.
+
+    Returns:
+        int: The amount in paise.
+    """
+    return int(amount) * PAISE_PER_RUPEE
+
+
+def format_rupees(paise):
+    """
+    Formats an amount in paise for display, without the currency symbol.
+
+    Whole-rupee amounts are shown without decimals (``499``); anything else
+    keeps two decimal places (``449.10``).
+
+    Returns:
+        str: The formatted amount.
+    """
+    rupees, remainder = divmod(paise or 0, PAISE_PER_RUPEE)
+    if remainder:
+        return "%d.%02d" % (rupees, remainder)
+    return "%d" % rupees
+
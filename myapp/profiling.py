@@ -0,0 +1,216 @@
+"""
+Module: profiling.py
+
+This module provides two production diagnostics.
+
+`ProfilingMiddleware` profiles a single request when a staff user asks for
+it with `?profile=` or an `X-Profile` header. Profiling covers the view and
+its template rendering. The default mode (`sample`) samples the request
+thread's stack every `SAMPLE_INTERVAL` seconds and writes folded stacks
+(`*.folded`, one `frame;frame;frame count` line per stack), which
+flamegraph.pl and speedscope read directly. `cprofile` writes a
+`pstats` dump (`*.prof`) instead. Files go to `PROFILE_ROOT`, and the name
+is returned in the `X-Profile-File` response header.
+
+`SlowQueryMiddleware` times every SQL statement run while handling a
+request. Statements slower than `SLOW_QUERY_MS` are fingerprinted (literals
+and IN lists collapsed). Once the response is ready, each one is explained
+with SQLite's `EXPLAIN QUERY PLAN` and added to the `SlowQuery` row for its
+fingerprint, which the admin lists. A statement that cannot be recorded
+(e.g. the database is locked) is logged and dropped; the response is
+returned unchanged.
+
+"""
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from time import perf_counter, strftime
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from myapp.models import SlowQuery
+
+SLOW_QUERY_MS = getattr(settings, 'SLOW_QUERY_MS', 100)
+SAMPLE_INTERVAL = 0.001
+MODES = ('sample', 'cprofile')
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+_local = threading.local()
+
+logger = logging.getLogger(__name__)
+
+
+def profile_root():
+    return str(getattr(settings, 'PROFILE_ROOT', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread from a background thread and counts
+    identical stacks.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+
+def requested_mode(request):
+    """
+    Returns the profiling mode asked for by a staff user, or None.
+    """
+    value = request.GET.get('profile') or request.headers.get('X-Profile')
+    if not value or not request.user.is_staff:
+        return None
+    return value if value in MODES else MODES[0]
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the rest of the stack (the view and template rendering) for
+    staff requests that ask for it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+
+        root = profile_root()
+        os.makedirs(root, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-') or 'root'
+        name = '%s-%s-%d' % (strftime('%Y%m%d-%H%M%S'), slug, os.getpid())
+        if mode == 'cprofile':
+            import cProfile
+
+            profiler = cProfile.Profile()
+            response = profiler.runcall(self.get_response, request)
+            name += '.prof'
+            profiler.dump_stats(os.path.join(root, name))
+        else:
+            with StackSampler(threading.get_ident()) as sampler:
+                response = self.get_response(request)
+            name += '.folded'
+            sampler.write(os.path.join(root, name))
+        response.headers['X-Profile-File'] = name
+        return response
+
+
+def fingerprint(sql):
+    """
+    Normalises SQL so that statements differing only in literal values or
+    IN-list length share a fingerprint.
+    """
+    normalised = _LITERALS.sub('?', sql.replace('%s', '?'))
+    normalised = _IN_LIST.sub('(...)', normalised)
+    return ' '.join(normalised.split())
+
+
+def explain(sql, params):
+    """
+    Returns SQLite's query plan for a SELECT as indented lines, or '' for
+    other statements and databases.
+    """
+    if connection.vendor != 'sqlite' or not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return ''
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params or ())
+        rows = cursor.fetchall()
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node] + detail)
+    return '\n'.join(lines)
+
+
+def record(sql, params, duration_ms, path):
+    normalised = fingerprint(sql)
+    key = hashlib.sha1(normalised.encode()).hexdigest()
+    plan = explain(sql, params)
+    now = timezone.now()
+    updated = SlowQuery.objects.filter(fingerprint=key).update(
+        count=F('count') + 1,
+        total_ms=F('total_ms') + duration_ms,
+        max_ms=Greatest('max_ms', duration_ms),
+        plan=plan,
+        last_path=path[:500],
+        last_seen=now,
+    )
+    if not updated:
+        SlowQuery.objects.get_or_create(
+            fingerprint=key,
+            defaults={'sql': normalised, 'plan': plan, 'count': 1, 'total_ms': duration_ms,
+                      'max_ms': duration_ms, 'last_path': path[:500], 'last_seen': now},
+        )
+
+
+def _timed(execute, sql, params, many, context):
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration_ms = (perf_counter() - started) * 1000
+        if duration_ms >= SLOW_QUERY_MS and not many:
+            _local.slow.append((sql, params, duration_ms))
+
+
+class SlowQueryMiddleware:
+    """
+    Records the request's slow SQL statements after the response is built.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.slow = []
+        with connection.execute_wrapper(_timed):
+            response = self.get_response(request)
+        slow, _local.slow = _local.slow, []
+        for sql, params, duration_ms in slow:
+            try:
+                record(sql, params, duration_ms, request.path)
+            except Exception:
+                logger.exception('Could not record a slow query on %s', request.path)
+        return response
@@ -0,0 +1,218 @@
+"""
+Module: progress.py
+
+This module tracks which videos of a course a user has watched.
+
+Progress is stored per (user, course) as a bitmap over `Video.serial_number`
+in `CourseProgress.watched`. Player heartbeats do not touch the database:
+`record_heartbeat` ORs the bit into an in-process buffer. A background
+thread flushes the buffer with a handful of bulk statements every
+`FLUSH_INTERVAL` seconds, or sooner once it holds `FLUSH_SIZE` entries,
+and what is left is flushed when the process exits. A failed flush puts
+its entries back into the buffer for the next round. At most
+`FLUSH_INTERVAL` seconds of progress are lost if the process is killed.
+
+Only real videos count. A heartbeat must name the serial number of one of
+the course's videos (`course_serials()`, cached and dropped on
+'curriculum' events), a flush drops the entries of users who are not
+enrolled in the course, and percentages only count the bits of videos the
+course still has.
+
+"""
+import atexit
+import threading
+
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from myapp import invalidation
+from myapp.models import Course, CourseProgress, UserCourse, Video
+
+FLUSH_SIZE = 500
+FLUSH_INTERVAL = 30
+MAX_SERIAL_NUMBER = 4095
+SERIALS_KEY = 'progress-serials:%s'
+SERIALS_TIMEOUT = 24 * 60 * 60
+
+_pending = {}
+_lock = threading.Lock()
+_wake = threading.Event()
+_worker = None
+
+
+def to_bitmap(value):
+    """
+    Encodes an integer bit set as little-endian bytes for `CourseProgress.watched`.
+    """
+    return value.to_bytes((value.bit_length() + 7) // 8, 'little')
+
+
+def from_bitmap(data):
+    """
+    Decodes `CourseProgress.watched` back to an integer bit set.
+    """
+    return int.from_bytes(bytes(data or b''), 'little')
+
+
+def course_serials(course_ids):
+    """
+    Returns `{course_id: bit set of its videos' serial numbers}`, from the
+    cache or with one query for the courses missing from it.
+    """
+    course_ids = list(dict.fromkeys(course_ids))
+    cached = cache.get_many([SERIALS_KEY % course_id for course_id in course_ids])
+    serials = {course_id: cached[SERIALS_KEY % course_id] for course_id in course_ids if SERIALS_KEY % course_id in cached}
+    missing = [course_id for course_id in course_ids if course_id not in serials]
+    if missing:
+        computed = dict.fromkeys(missing, 0)
+        rows = Video.objects.filter(
+            course_id__in=missing, serial_number__gte=0, serial_number__lte=MAX_SERIAL_NUMBER,
+        ).values_list('course_id', 'serial_number')
+        for course_id, serial_number in rows:
+            computed[course_id] |= 1 << serial_number
+        cache.set_many({SERIALS_KEY % course_id: bits for course_id, bits in computed.items()}, SERIALS_TIMEOUT)
+        serials.update(computed)
+    return serials
+
+
+def forget_serials(course_ids):
+    """
+    Invalidation bus subscriber for 'curriculum' events.
+    """
+    if course_ids is None:
+        course_ids = Course.objects.values_list('id', flat=True)
+    cache.delete_many([SERIALS_KEY % course_id for course_id in course_ids])
+
+
+invalidation.subscribe(['curriculum'], forget_serials)
+
+
+def record_heartbeat(user_id, course_id, serial_number):
+    """
+    Marks a video as watched. This only updates the in-process buffer; the
+    database is written when the buffer is flushed.
+
+    Raises:
+        ValueError: If `serial_number` is not a video of the course.
+    """
+    if not 0 <= serial_number <= MAX_SERIAL_NUMBER:
+        raise ValueError("serial_number out of range")
+    if not course_serials([course_id])[course_id] >> serial_number & 1:
+        raise ValueError("serial_number is not a video of this course")
+    key = (user_id, course_id)
+    with _lock:
+        _pending[key] = _pending.get(key, 0) | (1 << serial_number)
+        full = len(_pending) >= FLUSH_SIZE
+    _start_worker()
+    if full:
+        _wake.set()
+
+
+def flush():
+    """
+    Writes buffered progress to the database. Each row is ORed with what is
+    already stored, so flushes from several workers never lose bits.
+    Entries of users not enrolled in the course, and bits of serial numbers
+    the course has no video for, are dropped. If the write fails, the
+    entries go back into the buffer.
+
+    Returns:
+        int: The number of (user, course) records written.
+    """
+    with _lock:
+        batch = dict(_pending)
+        _pending.clear()
+    if not batch:
+        return 0
+    try:
+        return _write(batch)
+    except Exception:
+        with _lock:
+            for key, bits in batch.items():
+                _pending[key] = _pending.get(key, 0) | bits
+        raise
+
+
+def _write(batch):
+    enrolled = set(
+        UserCourse.objects.filter(
+            user_id__in={user_id for user_id, _ in batch},
+            course_id__in={course_id for _, course_id in batch},
+        ).values_list('user_id', 'course_id')
+    )
+    serials = course_serials(course_id for _, course_id in batch)
+    batch = {key: bits & serials[key[1]] for key, bits in batch.items() if key in enrolled}
+    batch = {key: bits for key, bits in batch.items() if bits}
+    if not batch:
+        return 0
+
+    with transaction.atomic():
+        CourseProgress.objects.bulk_create(
+            [CourseProgress(user_id=user_id, course_id=course_id) for user_id, course_id in batch],
+            ignore_conflicts=True,
+        )
+        rows = [
+            row for row in CourseProgress.objects.filter(
+                user_id__in={user_id for user_id, _ in batch},
+                course_id__in={course_id for _, course_id in batch},
+            )
+            if (row.user_id, row.course_id) in batch
+        ]
+        now = timezone.now()
+        for row in rows:
+            row.watched = to_bitmap(from_bitmap(row.watched) | batch[(row.user_id, row.course_id)])
+            row.updated_at = now
+        CourseProgress.objects.bulk_update(rows, ['watched', 'updated_at'], batch_size=500)
+    return len(rows)
+
+
+def attach(user_courses):
+    """
+    Sets `progress` (percentage of videos watched) on each `UserCourse` in
+    `user_courses`, using one query for all stored bitmaps plus whatever is
+    still buffered, counting only the course's current videos. Course
+    statistics must already be primed.
+    """
+    user_courses = list(user_courses)
+    if not user_courses:
+        return user_courses
+    user_id = user_courses[0].user_id
+    stored = dict(
+        CourseProgress.objects.filter(
+            user_id=user_id, course_id__in=[uc.course_id for uc in user_courses]
+        ).values_list('course_id', 'watched')
+    )
+    with _lock:
+        pending = {course_id: bits for (uid, course_id), bits in _pending.items() if uid == user_id}
+    serials = course_serials(uc.course_id for uc in user_courses)
+    for uc in user_courses:
+        watched = (from_bitmap(stored.get(uc.course_id)) | pending.get(uc.course_id, 0)) & serials[uc.course_id]
+        total = uc.course.stats['video_count']
+        uc.progress = min(100, bin(watched).count('1') * 100 // total) if total else 0
+    return user_courses
+
+
+def _run():
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            # The entries are back in the buffer; retry on the next round.
+            pass
+        finally:
+            close_old_connections()
+
+
+def _start_worker():
+    global _worker
+    if _worker is None:
+        with _lock:
+            if _worker is None:
+                _worker = threading.Thread(target=_run, name='progress-flush', daemon=True)
+                _worker.start()
+
+
+atexit.register(flush)
@@ -0,0 +1,243 @@
+"""
+Module: provisioning.py
+
+This module creates learner accounts and enrollments in bulk for corporate
+cohorts, from CSV rows of `email,course` (the course id may be blank to
+only create the account, and an email may appear once per course).
+
+`provision()` works in a constant number of queries per `BATCH_SIZE`
+learners. Emails that already have an account are found with one
+case-insensitive `IN` lookup per batch and are enrolled, not recreated. New
+`User` rows and all `UserCourse` rows are written with `bulk_create`, and
+enrollments that already exist are skipped. New accounts get one of two
+kinds of credentials:
+
+- `token` (default): an unusable password plus a password-reset token,
+  redeemed at the `password_reset_confirm` URL. Tokens are cheap HMACs.
+- `password`: a random initial password. The `provision_learners` command
+  computes the PBKDF2 hashes in a pool of forked processes, because hashing
+  dominates the run time. The `PROVISION_LEARNERS` view hashes in its own
+  process: forking a web worker mid-request would copy its threads, locks
+  and open connections. Large cohorts should go through the command or use
+  `token` mode.
+
+`bulk_create` does not send `post_save`, so the work those receivers do is
+done once at the end: the `usercourse` invalidation is published, and the
+new enrollments are added to the recommendations with
+`recommendations.record_new_enrollments()`. Provisioned enrollments
+(`source='PROVISIONED'`) are not counted in the sales rollups.
+
+"""
+import csv
+import io
+import os
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connections, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from myapp import invalidation, recommendations
+from myapp.models import Course, UserCourse
+
+BATCH_SIZE = 500
+PASSWORD_LENGTH = 12
+MODES = ('token', 'password')
+
+
+def read_rows(lines):
+    """
+    Parses CSV lines with an `email` and an optional `course` column.
+
+    Returns:
+        list: `(email, course_id or None)` tuples, lowercased and stripped.
+
+    Raises:
+        ValueError: If there is no `email` column or a course id is not a
+            number.
+    """
+    reader = csv.DictReader(lines)
+    if 'email' not in (reader.fieldnames or []):
+        raise ValueError("the CSV needs an 'email' column")
+    rows = []
+    for line_number, row in enumerate(reader, start=2):
+        email = (row.get('email') or '').strip().lower()
+        course = (row.get('course') or '').strip()
+        if not course.isdigit() and course:
+            raise ValueError("line %d: invalid course id %r" % (line_number, course))
+        rows.append((email, int(course) if course else None))
+    return rows
+
+
+def _hash_passwords(passwords, processes):
+    processes = os.cpu_count() if processes is None else processes
+    if processes == 0 or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    connections.close_all()
+    with ProcessPoolExecutor(processes, mp_context=get_context('fork')) as pool:
+        return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (processes * 4))))
+
+
+def _batches(items):
+    items = list(items)
+    for start in range(0, len(items), BATCH_SIZE):
+        yield items[start:start + BATCH_SIZE]
+
+
+def provision(rows, mode='token', processes=None, paid=True):
+    """
+    Creates the missing accounts and enrollments for `rows`.
+
+    Args:
+        rows: `(email, course_id or None)` pairs, e.g. from `read_rows`.
+        mode: `token` or `password`, the credentials issued to new accounts.
+        processes: Hashing processes for `password` mode (defaults to the
+            CPU count); 0 hashes in the calling process.
+        paid: The `paid` flag of the new enrollments.
+
+    Returns:
+        dict: Counts (`learners`, `created`, `existing`, `enrolled`,
+        `already_enrolled`), `rejected` rows with reasons, per-phase
+        `seconds`, `learners_per_second`, and `credentials`: one
+        `{'email', 'username', 'uid', 'token' or 'password'}` dict per
+        new account.
+    """
+    if mode not in MODES:
+        raise ValueError("unknown mode: %r" % mode)
+    started = perf_counter()
+    timings = {}
+    rejected = []
+
+    courses_by_email = {}
+    for email, course_id in rows:
+        try:
+            validate_email(email)
+        except ValidationError:
+            rejected.append({'email': email, 'course': course_id, 'reason': 'invalid email'})
+            continue
+        courses = courses_by_email.setdefault(email, set())
+        if course_id is not None:
+            courses.add(course_id)
+
+    wanted_courses = set().union(*courses_by_email.values()) if courses_by_email else set()
+    known_courses = set(Course.objects.filter(id__in=wanted_courses).values_list('id', flat=True))
+    for email, courses in courses_by_email.items():
+        for course_id in sorted(courses - known_courses):
+            rejected.append({'email': email, 'course': course_id, 'reason': 'unknown course'})
+        courses &= known_courses
+
+    user_ids = {}
+    taken_usernames = set()
+    for batch in _batches(courses_by_email):
+        for user_id, email in (User.objects.annotate(email_lower=Lower('email'))
+                               .filter(email_lower__in=batch).values_list('id', 'email_lower')):
+            user_ids.setdefault(email, user_id)
+        new = [email for email in batch if email not in user_ids]
+        taken_usernames.update(User.objects.filter(username__in=[email[:150] for email in new])
+                               .values_list('username', flat=True))
+    existing = len(user_ids)
+    new_emails = []
+    for email in courses_by_email:
+        if email in user_ids:
+            continue
+        if email[:150] in taken_usernames:
+            rejected.append({'email': email, 'course': None, 'reason': 'username taken'})
+        else:
+            new_emails.append(email)
+    timings['lookup'] = perf_counter() - started
+
+    phase = perf_counter()
+    passwords = {}
+    if mode == 'password':
+        passwords = {email: get_random_string(PASSWORD_LENGTH) for email in new_emails}
+        hashes = _hash_passwords([passwords[email] for email in new_emails], processes)
+    else:
+        hashes = [make_password(None) for _ in new_emails]
+    timings['hashing'] = perf_counter() - phase
+
+    phase = perf_counter()
+    now = timezone.now()
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [User(username=email[:150], email=email, password=password, date_joined=now)
+             for email, password in zip(new_emails, hashes)],
+            batch_size=BATCH_SIZE,
+        )
+        created = {}
+        for batch in _batches(new_emails):
+            for user in User.objects.filter(username__in=[email[:150] for email in batch]).only(
+                    'id', 'username', 'email', 'password', 'last_login'):
+                created[user.email] = user
+        user_ids.update((email, user.id) for email, user in created.items())
+        timings['users'] = perf_counter() - phase
+
+        phase = perf_counter()
+        enrolled_before = set()
+        existing_ids = [user_ids[email] for email in courses_by_email if email in user_ids and email not in created]
+        for batch in _batches(existing_ids):
+            enrolled_before.update(UserCourse.objects.filter(user_id__in=batch).values_list('user_id', 'course_id'))
+        enrollments = [
+            UserCourse(user_id=user_ids[email], course_id=course_id, paid=paid, source='PROVISIONED')
+            for email, courses in courses_by_email.items() if email in user_ids
+            for course_id in sorted(courses) if (user_ids[email], course_id) not in enrolled_before
+        ]
+        UserCourse.objects.bulk_create(enrollments, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        already_enrolled = sum(1 for email, courses in courses_by_email.items() if email in user_ids
+                               for course_id in courses if (user_ids[email], course_id) in enrolled_before)
+        timings['enrollments'] = perf_counter() - phase
+
+        if enrollments:
+            invalidation.publish('usercourse')
+            new_pairs = [(usercourse.user_id, usercourse.course_id) for usercourse in enrollments]
+            transaction.on_commit(lambda: recommendations.record_new_enrollments(new_pairs))
+
+    credentials = []
+    for email in new_emails:
+        user = created.get(email)
+        if user is None:
+            continue
+        entry = {'email': email, 'username': user.username, 'uid': urlsafe_base64_encode(force_bytes(user.pk))}
+        if mode == 'password':
+            entry['password'] = passwords[email]
+        else:
+            entry['token'] = default_token_generator.make_token(user)
+        credentials.append(entry)
+
+    seconds = perf_counter() - started
+    timings = {name: round(value, 3) for name, value in timings.items()}
+    return {
+        'learners': len(courses_by_email),
+        'created': len(created),
+        'existing': existing,
+        'enrolled': len(enrollments),
+        'already_enrolled': already_enrolled,
+        'rejected': rejected,
+        'seconds': {'total': round(seconds, 3), **timings},
+        'learners_per_second': round(len(courses_by_email) / seconds, 1) if seconds else None,
+        'credentials': credentials,
+    }
+
+
+def credentials_csv(credentials, reset_url=None):
+    """
+    Renders the credentials of new accounts as CSV. `reset_url(uid, token)`
+    turns tokens into links.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['email', 'username', 'password', 'reset_url'])
+    for entry in credentials:
+        link = reset_url(entry['uid'], entry['token']) if reset_url and 'token' in entry else ''
+        writer.writerow([entry['email'], entry['username'], entry.get('password', ''), link])
+    return output.getvalue()
@@ -0,0 +1,177 @@
+"""
+Module: rankings.py
+
+This module maintains the time-decayed "popular" and "trending" scores in
+`CourseRanking`.
+
+Every enrollment, paid payment and review adds a weighted point to its
+course, and each point halves in value every `POPULARITY_HALF_LIFE` (for
+`popularity`) or `TRENDING_HALF_LIFE` (for `trending`). Scores are stored
+decayed to `updated_at`, so a refresh only has to multiply every row by the
+same factor (one UPDATE) and add the events that arrived since the previous
+run. Reviews carry no timestamp, so new reviews are counted as happening at
+refresh time.
+
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from myapp import invalidation, singleflight
+from myapp.models import (
+    ArchivedPayment, ArchivedPaymentItem, Course, CourseRanking, Payment, PaymentItem, UserCourse, reviewdb,
+)
+
+POPULARITY_HALF_LIFE = timedelta(days=90)
+TRENDING_HALF_LIFE = timedelta(days=3)
+
+ENROLLMENT_WEIGHT = 1.0
+PAYMENT_WEIGHT = 2.0
+REVIEW_WEIGHT = 3.0
+
+ORDER_TTL = 5 * 60
+
+SORTS = {
+    'popular': 'popularity',
+    'trending': 'trending',
+}
+
+
+def decay(elapsed, half_life):
+    return 0.5 ** (elapsed / half_life)
+
+
+def refresh(full=False, now=None):
+    """
+    Brings every course's scores up to `now`.
+
+    Args:
+        full: Discard stored scores and replay all events.
+        now: The reference time (defaults to the current time).
+
+    Returns:
+        int: The number of courses whose scores received new events.
+    """
+    now = now or timezone.now()
+    since = None if full else _stamp()
+    with transaction.atomic():
+        if full:
+            CourseRanking.objects.all().delete()
+        else:
+            # Write before reading anything: a SQLite transaction that reads
+            # first cannot take the write lock while a concurrent refresh
+            # holds it, and fails instead of waiting. The UPDATE only
+            # matches rows still stamped `since`; if another refresh moved
+            # them on in between, decay again from its stamp, under the lock.
+            while not _decay(since, now):
+                current = _stamp()
+                if current == since:
+                    break
+                since = current
+        existing = set(CourseRanking.objects.values_list('course_id', flat=True))
+        CourseRanking.objects.bulk_create(
+            [CourseRanking(course_id=course_id, updated_at=now)
+             for course_id in Course.objects.exclude(id__in=existing).values_list('id', flat=True)]
+        )
+
+        deltas = {}
+
+        def add(course_id, weight, when):
+            age = now - when
+            popularity, trending = deltas.get(course_id, (0.0, 0.0))
+            deltas[course_id] = (
+                popularity + weight * decay(age, POPULARITY_HALF_LIFE),
+                trending + weight * decay(age, TRENDING_HALF_LIFE),
+            )
+
+        enrollments = UserCourse.objects.filter(date__lte=now)
+        if since is not None:
+            enrollments = enrollments.filter(date__gt=since)
+        for course_id, when in enrollments.values_list('course_id', 'date').iterator():
+            add(course_id, ENROLLMENT_WEIGHT, when)
+        paid = [model.objects.filter(status=True, course__isnull=False) for model in (Payment, ArchivedPayment)]
+        paid += [model.objects.filter(payment__status=True) for model in (PaymentItem, ArchivedPaymentItem)]
+        for queryset in paid:
+            queryset = queryset.filter(user_course__date__lte=now)
+            if since is not None:
+                queryset = queryset.filter(user_course__date__gt=since)
+            for course_id, when in queryset.values_list('course_id', 'user_course__date').iterator():
+                add(course_id, PAYMENT_WEIGHT, when)
+
+        review_counts = _review_counts()
+        rows = CourseRanking.objects.in_bulk(set(deltas) | set(review_counts))
+        changed = []
+        for course_id, row in rows.items():
+            popularity, trending = deltas.get(course_id, (0.0, 0.0))
+            new_reviews = review_counts.get(course_id, 0) - row.review_count
+            if new_reviews > 0:
+                popularity += new_reviews * REVIEW_WEIGHT
+                trending += new_reviews * REVIEW_WEIGHT
+                row.review_count += new_reviews
+            elif course_id not in deltas:
+                continue
+            row.popularity += popularity
+            row.trending += trending
+            changed.append(row)
+        CourseRanking.objects.bulk_update(changed, ['popularity', 'trending', 'review_count'], batch_size=500)
+    singleflight.invalidate(*('rankings:%s' % field for field in SORTS.values()))
+    if changed:
+        invalidation.publish('ranking')
+    return len(changed)
+
+
+def _stamp():
+    """
+    Returns the time the stored scores are decayed to (None when empty).
+    """
+    return CourseRanking.objects.aggregate(since=Max('updated_at'))['since']
+
+
+def _decay(since, now):
+    """
+    Decays the scores stored at `since` to `now` in one UPDATE.
+
+    Returns:
+        int: The number of rows updated.
+    """
+    changes = {'updated_at': now}
+    if since is not None:
+        elapsed = now - since
+        changes.update(
+            popularity=F('popularity') * decay(elapsed, POPULARITY_HALF_LIFE),
+            trending=F('trending') * decay(elapsed, TRENDING_HALF_LIFE),
+        )
+    return CourseRanking.objects.filter(updated_at=since).update(**changes)
+
+
+def _review_counts():
+    """
+    Returns course id -> number of reviews. `reviewdb.selectcourse` holds
+    the course title, so counts are matched to courses by title.
+    """
+    ids_by_title = dict(Course.objects.values_list('title', 'id'))
+    counts = {}
+    for title, count in reviewdb.objects.values('selectcourse').annotate(count=Count('id')).values_list('selectcourse', 'count'):
+        if title in ids_by_title:
+            counts[ids_by_title[title]] = count
+    return counts
+
+
+def _positions(field):
+    ranked = CourseRanking.objects.order_by('-' + field, 'course_id').values_list('course_id', flat=True)
+    return {course_id: index for index, course_id in enumerate(ranked)}
+
+
+def order_cards(cards, sort):
+    """
+    Reorders course cards by a stored ranking (`popular` or `trending`).
+    The ranking order is read once per `ORDER_TTL` through
+    `myapp.singleflight`. Other `sort` values leave `cards` unchanged.
+    """
+    field = SORTS.get(sort)
+    if field is None:
+        return cards
+    position = singleflight.get('rankings:%s' % field, lambda: _positions(field), ORDER_TTL)
+    return sorted(cards, key=lambda card: position.get(card.id, len(position)))
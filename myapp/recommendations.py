@@ -0,0 +1,206 @@
+"""
+Module: recommendations.py
+
+This module builds the "students also enrolled in" recommendations shown on
+course pages.
+
+`CourseCooccurrence` holds the sparse course x course co-occurrence matrix
+built from `UserCourse` enrollments, and `CourseRecommendation` holds the
+top `TOP_K` neighbours of every course so that a page view needs a single
+primary-key lookup. `rebuild()` recomputes everything in batch; new
+enrollments (from CHECKOUT or VERIFY_PAYMENT) update only the affected rows
+through `record_enrollment()`, `record_enrollments()` for a whole cart, or
+`record_new_enrollments()` for many users at once.
+
+"""
+from collections import Counter
+from itertools import groupby, permutations
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from myapp import singleflight
+from myapp.models import CourseCooccurrence, CourseRecommendation, UserCourse
+
+TOP_K = 6
+BATCH_SIZE = 2000
+CACHE_TTL = 10 * 60
+
+
+def count_pairs(enrollments):
+    """
+    Counts co-enrolled course pairs.
+
+    Args:
+        enrollments: `(user_id, course_id)` pairs sorted by user id.
+
+    Returns:
+        Counter: `(course_id, other_id)` -> number of shared users, with
+        both orientations of every pair present.
+    """
+    counts = Counter()
+    for _, rows in groupby(enrollments, key=itemgetter(0)):
+        courses = {course_id for _, course_id in rows}
+        if len(courses) > 1:
+            counts.update(permutations(courses, 2))
+    return counts
+
+
+def top_neighbours(counts, k=TOP_K):
+    """
+    Returns a mapping of course id to its `k` most co-enrolled course ids,
+    ordered by count and then by id.
+    """
+    rows = {}
+    for (course_id, other_id), count in counts.items():
+        rows.setdefault(course_id, []).append((-count, other_id))
+    return {course_id: [other_id for _, other_id in sorted(row)[:k]] for course_id, row in rows.items()}
+
+
+def rebuild():
+    """
+    Recomputes the co-occurrence matrix and every recommendation list from
+    `UserCourse`.
+
+    Returns:
+        int: The number of non-zero matrix cells.
+    """
+    enrollments = (
+        UserCourse.objects.order_by('user_id')
+        .values_list('user_id', 'course_id')
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    counts = count_pairs(enrollments)
+    neighbours = top_neighbours(counts)
+    with transaction.atomic():
+        CourseCooccurrence.objects.all().delete()
+        CourseCooccurrence.objects.bulk_create(
+            (CourseCooccurrence(course_id=a, other_id=b, count=count) for (a, b), count in counts.items()),
+            batch_size=BATCH_SIZE,
+        )
+        CourseRecommendation.objects.all().delete()
+        CourseRecommendation.objects.bulk_create(
+            (CourseRecommendation(course_id=course_id, neighbours=ids) for course_id, ids in neighbours.items()),
+            batch_size=BATCH_SIZE,
+        )
+    return len(counts)
+
+
+def _refresh_neighbours(course_ids):
+    """
+    Recomputes the recommendation lists of `course_ids` from the matrix,
+    with one read and one bulk write whatever their number.
+    """
+    cells = (
+        CourseCooccurrence.objects.filter(course_id__in=course_ids)
+        .order_by('course_id', '-count', 'other_id')
+        .values_list('course_id', 'other_id')
+    )
+    neighbours = {course_id: [] for course_id in course_ids}
+    for course_id, other_id in cells:
+        if len(neighbours[course_id]) < TOP_K:
+            neighbours[course_id].append(other_id)
+    rows = CourseRecommendation.objects.in_bulk(list(neighbours))
+    for course_id, row in rows.items():
+        row.neighbours = neighbours[course_id]
+    CourseRecommendation.objects.bulk_update(rows.values(), ['neighbours'], batch_size=BATCH_SIZE)
+    CourseRecommendation.objects.bulk_create(
+        [CourseRecommendation(course_id=course_id, neighbours=ids) for course_id, ids in neighbours.items() if course_id not in rows],
+        ignore_conflicts=True,
+    )
+
+
+def record_enrollment(user_id, course_id):
+    """
+    Adds one enrollment to the matrix and refreshes the recommendation
+    lists of the courses it touches. Repeat enrollments are ignored.
+    """
+    record_enrollments(user_id, [course_id])
+
+
+def record_enrollments(user_id, course_ids):
+    """
+    Adds a user's just-created enrollments in `course_ids` (e.g. a whole
+    cart) to the matrix, counting every new pair once.
+    """
+    record_new_enrollments([(user_id, course_id) for course_id in course_ids])
+
+
+def record_new_enrollments(enrollments):
+    """
+    Adds just-created enrollments, `(user_id, course_id)` pairs of any
+    number of users (e.g. a provisioned cohort), to the matrix and
+    refreshes the recommendation lists of the courses they touch. The
+    courses of `BATCH_SIZE` users are read per query, and the matrix is
+    updated with one bulk INSERT of the missing cells and one bulk UPDATE.
+    """
+    new_by_user = {}
+    for user_id, course_id in enrollments:
+        new_by_user.setdefault(user_id, set()).add(course_id)
+    user_ids = sorted(new_by_user)
+    new = set().union(*new_by_user.values())
+    with transaction.atomic():
+        # Write before reading anything: a SQLite transaction that reads
+        # first cannot take the write lock while a concurrent one holds it,
+        # and fails instead of waiting. Every new course gets a (possibly
+        # empty) list below anyway, so its missing rows are created here,
+        # and the enrollments are then read under the lock, so concurrent
+        # callers see each other's rows in order.
+        CourseRecommendation.objects.bulk_create(
+            [CourseRecommendation(course_id=course_id, neighbours=[]) for course_id in sorted(new)],
+            batch_size=BATCH_SIZE, ignore_conflicts=True,
+        )
+        pairs = Counter()
+        for start in range(0, len(user_ids), BATCH_SIZE):
+            rows = (
+                UserCourse.objects.filter(user_id__in=user_ids[start:start + BATCH_SIZE])
+                .order_by('user_id')
+                .values_list('user_id', 'course_id')
+            )
+            for user_id, group in groupby(rows, itemgetter(0)):
+                enrolled = {course_id for _, course_id in group}
+                added = new_by_user[user_id] & enrolled
+                old = enrolled - added
+                pairs.update([(a, b) for a in added for b in old] + [(b, a) for a in added for b in old])
+                pairs.update(permutations(added, 2))
+        if not pairs:
+            return
+        touched = {course_id for pair in pairs for course_id in pair}
+        CourseCooccurrence.objects.bulk_create(
+            [CourseCooccurrence(course_id=a, other_id=b, count=0) for a, b in pairs],
+            batch_size=BATCH_SIZE, ignore_conflicts=True,
+        )
+        # Every pair has a new course on one side.
+        cells = [
+            cell for cell in CourseCooccurrence.objects.filter(
+                Q(course_id__in=new, other_id__in=touched) | Q(course_id__in=touched, other_id__in=new)
+            ).only('id', 'course_id', 'other_id')
+            if (cell.course_id, cell.other_id) in pairs
+        ]
+        for cell in cells:
+            cell.count = F('count') + pairs[cell.course_id, cell.other_id]
+        CourseCooccurrence.objects.bulk_update(cells, ['count'], batch_size=BATCH_SIZE)
+        _refresh_neighbours(sorted(touched))
+    singleflight.invalidate(*('recommendations:%s' % course_id for course_id in sorted(touched)))
+
+
+def _load_neighbours(course_id):
+    row = CourseRecommendation.objects.filter(course_id=course_id).values_list('neighbours', flat=True).first()
+    return row or []
+
+
+def recommended_ids(course_id):
+    """
+    Returns the precomputed neighbour ids for a course (may be empty),
+    cached through `myapp.singleflight`.
+    """
+    return singleflight.get('recommendations:%s' % course_id, lambda: _load_neighbours(course_id), CACHE_TTL)
+
+
+def enrollment_created(sender, instance, created, **kwargs):
+    """
+    `post_save` receiver for `UserCourse`.
+    """
+    if created:
+        transaction.on_commit(lambda: record_enrollment(instance.user_id, instance.course_id))
@@ -0,0 +1,141 @@
+"""
+Module: responses.py
+
+This module keeps repeat page views and filter toggles cheap.
+
+`versioned(*entities, extra=None)` wraps a view with Django's
+`condition()`. Its ETag is built from the `myapp.invalidation` versions of
+the entities the page depends on, not from a hash of the rendered body. It
+also covers the deployed templates, the logged-in user (their id, password
+hash version and the profile fields pages display, read from the cached
+user) and the CSRF cookie. `extra(request, *args, **kwargs)` adds
+per-request parts, e.g. whether the user is enrolled in the course shown,
+so that a page does not depend on a site-wide version that changes with
+every other user's activity. A matching `If-None-Match` is answered with
+304 before the view runs. Responses are marked `private, no-cache` so
+browsers always revalidate instead of guessing freshness.
+
+`CompressionMiddleware` gzips (or, when the optional `brotli` package is
+installed and accepted, brotli-compresses) responses larger than
+`COMPRESSION_MIN_SIZE` bytes. Against BREACH, gzip bodies carry a header
+filename of random length (as Django's `GZipMiddleware` does), and
+responses that vary on `Cookie` (they may embed a CSRF token or session
+data) are never brotli-compressed, because brotli has no such padding.
+
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY
+from django.utils.cache import has_vary_header, patch_cache_control, patch_vary_headers
+from django.utils.text import compress_string
+from django.views.decorators.http import condition
+
+from myapp import invalidation
+from myapp.staticfiles import accepted_encodings, brotli
+
+CATALOG = ['course', 'categories', 'level', 'author', 'curriculum']
+
+MIN_SIZE = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+BROTLI_QUALITY = 5
+# Upper bound of the random gzip header padding, as in GZipMiddleware.
+MAX_RANDOM_BYTES = 100
+
+_templates_digest = None
+
+
+def templates_digest():
+    global _templates_digest
+    if _templates_digest is None:
+        from myapp import prerender
+        _templates_digest = prerender._templates_digest()
+    return _templates_digest
+
+
+def _user_parts(request):
+    """
+    Returns the profile fields of the logged-in user shown on pages. The
+    user comes from the authentication cache, which drops it whenever the
+    user is saved.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    return [user.get_username(), user.first_name, user.last_name, user.email]
+
+
+def page_etag(request, entities, extra=()):
+    """
+    Returns the ETag for a page depending on `entities` and the `extra`
+    per-request parts, or None when the response must not be reused
+    (pending flash messages).
+    """
+    if request.COOKIES.get('messages'):
+        return None
+    session = request.session
+    parts = [
+        templates_digest(),
+        invalidation.version(*entities),
+        session.get(SESSION_KEY, ''),
+        session.get(HASH_SESSION_KEY, ''),
+        _user_parts(request) if session.get(SESSION_KEY) else None,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        extra,
+    ]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def versioned(*entities, extra=None):
+    """
+    View decorator: conditional GET keyed on the versions of `entities`
+    and, when given, on `extra(request, *args, **kwargs)`.
+    """
+    def etag(request, *args, **kwargs):
+        return page_etag(request, entities, extra(request, *args, **kwargs) if extra else ())
+
+    def decorator(view):
+        conditional = condition(etag_func=etag)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            if response.has_header('ETag'):
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+class CompressionMiddleware:
+    """
+    Compresses non-streaming responses above `MIN_SIZE` bytes with the best
+    encoding the client accepts, without brotli for responses that vary on
+    `Cookie`. An ETag is made weak, because it was computed for the
+    uncompressed body.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding') or len(response.content) < MIN_SIZE:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        if brotli is not None and 'br' in accepted and not has_vary_header(response, 'Cookie'):
+            encoding, body = 'br', brotli.compress(response.content, quality=BROTLI_QUALITY)
+        elif 'gzip' in accepted:
+            encoding, body = 'gzip', compress_string(response.content, max_random_bytes=MAX_RANDOM_BYTES)
+        else:
+            return response
+        if len(body) >= len(response.content):
+            return response
+        response.content = body
+        response.headers['Content-Length'] = str(len(body))
+        response.headers['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,183 @@
+"""
+Module: rollups.py
+
+This module maintains daily per-course and per-category sales rollups
+(`DailyCourseSales`, `DailyCategorySales`) so that reporting never scans
+`Payment` or `UserCourse`.
+
+Views call `record_order`, `record_payment` and `record_free_enrollment`
+as orders are created, verified and free courses are enrolled; each call is
+two single-row UPDATEs. Enrollments provisioned for corporate cohorts are
+neither orders nor free enrollments and are not counted. Everything is bucketed by the day the order was
+created. `backfill()` rebuilds a date range from the source tables with
+grouped queries, reading archived payments too. Revenue is always the
+amount recorded when the order was created (`Payment.amount`, or
+`PaymentItem.amount` for cart orders, which are counted once per item), so
+later price changes do not alter past days.
+
+"""
+from datetime import datetime, time, timedelta
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from myapp.models import (
+    ArchivedPayment, ArchivedPaymentItem, DailyCategorySales, DailyCourseSales, Payment, PaymentItem, UserCourse,
+)
+
+FIELDS = ['orders', 'paid_count', 'revenue', 'free_enrollments']
+
+
+def _bump(when, course, **increments):
+    day = timezone.localdate(when)
+    updates = {field: F(field) + value for field, value in increments.items()}
+    with transaction.atomic():
+        for model, key in ((DailyCourseSales, {'course_id': course.id}),
+                           (DailyCategorySales, {'category_id': course.category_id})):
+            if not model.objects.filter(day=day, **key).update(**updates):
+                model.objects.get_or_create(day=day, **key)
+                model.objects.filter(day=day, **key).update(**updates)
+
+
+def _lines(payment):
+    if payment.course_id is not None:
+        return [(payment.course, payment.amount)]
+    return [(item.course, item.amount) for item in payment.items.select_related('course')]
+
+
+def record_order(payment):
+    """
+    Counts a newly created (unpaid) order, once per course it covers.
+    """
+    for course, _ in _lines(payment):
+        _bump(payment.date, course, orders=1)
+
+
+def record_payment(payment):
+    """
+    Counts an order that has just been verified as paid.
+    """
+    for course, amount in _lines(payment):
+        _bump(payment.date, course, paid_count=1, revenue=amount)
+
+
+def record_free_enrollment(usercourse):
+    """
+    Counts an enrollment in a free course.
+    """
+    _bump(usercourse.date, usercourse.course, free_enrollments=1)
+
+
+def _bounds(start, end):
+    return (
+        timezone.make_aware(datetime.combine(start, time.min)),
+        timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+    )
+
+
+def _payment_totals(model, low, high):
+    return (
+        model.objects.filter(date__gte=low, date__lt=high, course__isnull=False)
+        .annotate(day=TruncDate('date'))
+        .values('day', 'course_id', 'course__category_id')
+        .annotate(
+            orders=Count('id'),
+            paid_count=Count('id', filter=Q(status=True)),
+            revenue=Sum('amount', filter=Q(status=True)),
+        )
+        .order_by()
+    )
+
+
+def _item_totals(model, low, high):
+    return (
+        model.objects.filter(payment__date__gte=low, payment__date__lt=high)
+        .annotate(day=TruncDate('payment__date'))
+        .values('day', 'course_id', 'course__category_id')
+        .annotate(
+            orders=Count('id'),
+            paid_count=Count('id', filter=Q(payment__status=True)),
+            revenue=Sum('amount', filter=Q(payment__status=True)),
+        )
+        .order_by()
+    )
+
+
+def backfill(start, end):
+    """
+    Recomputes the rollups for every day from `start` to `end` inclusive.
+
+    Returns:
+        int: The number of per-course rows written.
+    """
+    low, high = _bounds(start, end)
+    rows = {}
+
+    def row(day, course_id, category_id):
+        return rows.setdefault((day, course_id), {'category_id': category_id, **dict.fromkeys(FIELDS, 0)})
+
+    totals = chain(
+        _payment_totals(Payment, low, high), _payment_totals(ArchivedPayment, low, high),
+        _item_totals(PaymentItem, low, high), _item_totals(ArchivedPaymentItem, low, high),
+    )
+    for values in totals:
+        target = row(values['day'], values['course_id'], values['course__category_id'])
+        target['orders'] += values['orders']
+        target['paid_count'] += values['paid_count']
+        target['revenue'] += values['revenue'] or 0
+
+    free = (
+        UserCourse.objects.filter(date__gte=low, date__lt=high, source='SELF', payment__isnull=True,
+                                  paymentitem__isnull=True, archivedpayment__isnull=True,
+                                  archivedpaymentitem__isnull=True)
+        .annotate(day=TruncDate('date'))
+        .values('day', 'course_id', 'course__category_id')
+        .annotate(free_enrollments=Count('id'))
+        .order_by()
+    )
+    for values in free:
+        row(values['day'], values['course_id'], values['course__category_id'])['free_enrollments'] = values['free_enrollments']
+
+    categories = {}
+    for (day, _), values in rows.items():
+        target = categories.setdefault((day, values['category_id']), dict.fromkeys(FIELDS, 0))
+        for field in FIELDS:
+            target[field] += values[field]
+
+    with transaction.atomic():
+        DailyCourseSales.objects.filter(day__gte=start, day__lte=end).delete()
+        DailyCategorySales.objects.filter(day__gte=start, day__lte=end).delete()
+        DailyCourseSales.objects.bulk_create(
+            [DailyCourseSales(day=day, course_id=course_id, **{field: values[field] for field in FIELDS})
+             for (day, course_id), values in rows.items()],
+            batch_size=500,
+        )
+        DailyCategorySales.objects.bulk_create(
+            [DailyCategorySales(day=day, category_id=category_id, **values)
+             for (day, category_id), values in categories.items()],
+            batch_size=500,
+        )
+    return len(rows)
+
+
+def report(start, end, group='category'):
+    """
+    Sums the rollups between `start` and `end` (inclusive) per course or
+    per category, reading only the rollup tables.
+
+    Returns:
+        list: One dict per course/category, highest revenue first.
+    """
+    if group == 'course':
+        queryset, key, label = DailyCourseSales.objects, 'course_id', 'course__title'
+    else:
+        queryset, key, label = DailyCategorySales.objects, 'category_id', 'category__name'
+    return list(
+        queryset.filter(day__gte=start, day__lte=end)
+        .values(key, label)
+        .annotate(**{'total_' + field: Sum(field) for field in FIELDS})
+        .order_by('-total_revenue', key)
+    )
@@ -0,0 +1,167 @@
+"""
+Module: singleflight.py
+
+This module coalesces cached computations so that an expired or invalidated
+entry is recomputed by one request at a time instead of by every concurrent
+request.
+
+`get(key, compute, ttl)` stores `{'value', 'expires', 'evicts', 'delta'}`
+in the Django cache, where `evicts` is when the cache drops the entry
+(`ttl + grace` after it was computed) and `delta` is how long the last
+computation took. Each
+read decides to refresh early with probability growing as expiry
+approaches and with the cost of the computation (the "XFetch" rule:
+refresh when `now - delta * BETA * log(random()) >= expires`). Only the
+caller that wins a per-key lock (`cache.add`) recomputes; the others keep
+serving the previous value until `ttl + grace`, or, when nothing is cached
+yet, wait up to `wait` seconds for the winner before computing themselves.
+
+Entries and locks live in the cache named by `SINGLEFLIGHT_CACHE`
+(default: 'default'). With the project's `LocMemCache` that cache is per
+process, so coalescing only happens between the threads of one worker:
+N workers still compute a key up to N times, once each. Point
+`SINGLEFLIGHT_CACHE` at a shared backend with an atomic `add()` (Redis,
+Memcached) to coalesce across workers. The file-based cache is shared but
+its `add()` is not atomic, so it would not make a reliable lock.
+
+Counters are kept per process and returned by `stats()`: `hits`, `misses`
+(computed because nothing was cached), `early_refreshes`,
+`stale_refreshes`, `coalesced` (served another caller's value instead of
+computing) and `timeouts` (gave up waiting and computed anyway). They
+describe only the worker that answers the request, whatever the cache.
+
+"""
+import threading
+from collections import Counter
+from math import ceil, log
+from random import random
+from time import monotonic, sleep, time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from myapp import invalidation
+
+CACHE_ALIAS = getattr(settings, 'SINGLEFLIGHT_CACHE', 'default')
+KEY_PREFIX = 'singleflight:'
+LOCK_PREFIX = 'singleflight-lock:'
+LOCK_TIMEOUT = 30
+BETA = 1.0
+WAIT = 2.0
+POLL_INTERVAL = 0.05
+
+COUNTERS = ['hits', 'misses', 'early_refreshes', 'stale_refreshes', 'coalesced', 'timeouts']
+
+_counters = Counter(dict.fromkeys(COUNTERS, 0))
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def stats():
+    """
+    Returns this process's counters, plus the hit ratio.
+    """
+    with _counters_lock:
+        counters = dict(_counters)
+    lookups = sum(counters.values())
+    computed = counters['misses'] + counters['timeouts']
+    counters['hit_ratio'] = round((lookups - computed) / lookups, 4) if lookups else None
+    return counters
+
+
+def _should_refresh(entry, now, beta):
+    return now - entry['delta'] * beta * log(1.0 - random()) >= entry['expires']
+
+
+def _compute_and_store(key, compute, ttl, grace):
+    started = monotonic()
+    value = compute()
+    now = time()
+    entry = {'value': value, 'expires': now + ttl, 'evicts': now + ttl + grace, 'delta': monotonic() - started}
+    _cache().set(KEY_PREFIX + key, entry, ttl + grace)
+    return value
+
+
+def _recompute(key, compute, ttl, grace):
+    try:
+        return _compute_and_store(key, compute, ttl, grace)
+    finally:
+        _cache().delete(LOCK_PREFIX + key)
+
+
+def get(key, compute, ttl, grace=None, beta=BETA, wait=WAIT):
+    """
+    Returns the cached value for `key`, computing it with `compute()` when
+    needed. At most one caller per key recomputes at a time.
+
+    Args:
+        key: The cache key (prefixed with `KEY_PREFIX`).
+        compute: A no-argument callable returning a picklable value.
+        ttl: Seconds the value is considered fresh.
+        grace: Seconds a stale value may still be served while another
+            caller recomputes it (defaults to `ttl`).
+        beta: Early refresh eagerness; 0 disables early refresh.
+        wait: Seconds to wait for another caller's computation on a miss.
+
+    Returns:
+        The cached or freshly computed value.
+    """
+    grace = ttl if grace is None else grace
+    cache = _cache()
+    entry = cache.get(KEY_PREFIX + key)
+    if entry is not None:
+        now = time()
+        if not _should_refresh(entry, now, beta):
+            _count('hits')
+            return entry['value']
+        if not cache.add(LOCK_PREFIX + key, 1, LOCK_TIMEOUT):
+            _count('coalesced')
+            return entry['value']
+        _count('early_refreshes' if entry['expires'] > now else 'stale_refreshes')
+        return _recompute(key, compute, ttl, grace)
+
+    if cache.add(LOCK_PREFIX + key, 1, LOCK_TIMEOUT):
+        _count('misses')
+        return _recompute(key, compute, ttl, grace)
+    deadline = monotonic() + wait
+    while monotonic() < deadline:
+        sleep(POLL_INTERVAL)
+        entry = cache.get(KEY_PREFIX + key)
+        if entry is not None:
+            _count('coalesced')
+            return entry['value']
+    _count('timeouts')
+    return _compute_and_store(key, compute, ttl, grace)
+
+
+def invalidate(*keys):
+    """
+    Marks the given keys stale. Their values keep being served to everyone
+    but the one caller that recomputes them, until the end of their
+    original `ttl + grace`.
+    """
+    cache = _cache()
+    now = time()
+    for cache_key, entry in cache.get_many([KEY_PREFIX + key for key in keys]).items():
+        entry['expires'] = 0
+        remaining = entry.get('evicts', now) - now
+        if remaining > 0:
+            cache.set(cache_key, entry, ceil(remaining))
+        else:
+            cache.delete(cache_key)
+
+
+def invalidate_on(entities, *keys):
+    """
+    Marks `keys` stale whenever any of `entities` changes, in any worker
+    (see `myapp.invalidation`).
+    """
+    invalidation.subscribe(entities, lambda object_ids: invalidate(*keys))
@@ -0,0 +1,159 @@
+"""
+Module: staticfiles.py
+
+This module is the static asset pipeline.
+
+`CompressedManifestStaticFilesStorage` is used by `collectstatic`. It
+copies assets to `STATIC_ROOT` with content-hashed names, rewrites the
+references between them (Django's manifest storage, which `{% static %}`
+also reads), and writes a `.gz` (and, when the optional `brotli` package is
+installed, a `.br`) copy next to every hashed text asset. A copy is only
+kept when it is smaller than the original. The sizes are recorded in
+`COMPRESSION_MANIFEST` for `manage.py static_report`.
+
+`PrecompressedStaticMiddleware` serves `STATIC_URL` requests straight from
+`STATIC_ROOT` before sessions and authentication run. It picks the best
+precompressed variant allowed by `Accept-Encoding`, and marks hashed names
+as immutable for a year.
+
+"""
+import gzip
+import json
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MANIFEST = 'compression.json'
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico', '.eot', '.ttf', '.otf'}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=3600'
+
+# Preferred first.
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def compress(data):
+    """
+    Returns `{encoding: compressed bytes}` for every available encoding
+    that makes `data` smaller.
+    """
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also precompresses the hashed files. Missing
+    manifest entries fall back to the unhashed name instead of raising,
+    so templates referencing files outside the manifest keep rendering.
+    """
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        sizes = {}
+        for hashed_name in sorted(set(self.hashed_files.values())):
+            if os.path.splitext(hashed_name)[1].lower() not in COMPRESSIBLE:
+                continue
+            with self.open(hashed_name) as f:
+                data = f.read()
+            entry = {'size': len(data)}
+            for encoding, body in compress(data).items():
+                suffix = dict(ENCODINGS)[encoding]
+                with open(self.path(hashed_name) + suffix, 'wb') as f:
+                    f.write(body)
+                entry[encoding] = len(body)
+            sizes[hashed_name] = entry
+        with open(self.path(COMPRESSION_MANIFEST), 'w') as f:
+            json.dump(sizes, f, indent=0, sort_keys=True)
+
+
+def accepted_encodings(header):
+    """
+    Parses an `Accept-Encoding` header into the set of codings with a
+    non-zero quality.
+    """
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def load_manifest():
+    """
+    Returns the set of hashed file names from `collectstatic`'s manifest
+    (empty before the first build).
+    """
+    try:
+        with open(os.path.join(settings.STATIC_ROOT, ManifestStaticFilesStorage.manifest_name)) as f:
+            return set(json.load(f).get('paths', {}).values())
+    except (OSError, ValueError, TypeError):
+        return set()
+
+
+class PrecompressedStaticMiddleware:
+    """
+    Serves collected static files with precompressed variants and
+    long-lived cache headers. Requests for files that were not collected
+    fall through to the rest of the stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.hashed = load_manifest()
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and settings.STATIC_ROOT and request.path.startswith(settings.STATIC_URL):
+            response = self.serve(request, request.path[len(settings.STATIC_URL):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            raise Http404
+        if not os.path.isfile(path):
+            return None
+        content_type, _ = mimetypes.guess_type(path)
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        encoding = None
+        for coding, suffix in ENCODINGS:
+            if coding in accepted and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, coding
+                break
+        response = FileResponse(
+            open(path, 'rb'),
+            content_type=content_type or 'application/octet-stream',
+            filename=os.path.basename(name),
+        )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = IMMUTABLE if name in self.hashed else REVALIDATE
+        return response
@@ -1,14 +1,35 @@
 from django import template
-import math
+
+from myapp import pricing, templating
+
 register = template.Library()
 
 
 @register.simple_tag
+def discount_calculation(price,discount):
+    return pricing.format_rupees(pricing.effective_price(price, discount))
 
 
-def discount_calculation(price,discount):
-    if discount is None or discount is 0:
-        return price
-    sellprice = price
-    sellprice = price - (price * discount/100)
-    return math.floor(sellprice)
\ No newline at end of file
+@register.filter
+def rupees(paise):
+    return pricing.format_rupees(paise)
+
+
+@register.filter
+def duration(minutes):
+    hours, minutes = divmod(int(round(minutes or 0)), 60)
+    if hours:
+        return "%dh %dm" % (hours, minutes)
+    return "%dm" % minutes
+
+
+@register.simple_tag(takes_context=True)
+def static_include(context, name):
+    """
+    Includes a request-independent component prerendered once per worker
+    (see `myapp.templating`).
+    """
+    if not templating.enabled:
+        with context.push():
+            return context.template.engine.get_template(name).render(context)
+    return templating.static_include(name, context.get('csrf_token'))
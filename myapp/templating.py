@@ -0,0 +1,117 @@
+"""
+Module: templating.py
+
+This module keeps template work off the request path.
+
+- `settings.TEMPLATES` uses the cached loader explicitly, in development
+  as well as production, so each template is read and compiled once per
+  worker. (The runserver autoreloader still resets it when a template
+  changes.)
+- Components that do not depend on the request, listed in `STATIC_INCLUDES`,
+  are rendered once per worker into strings by `static_include()`, which
+  the `{% static_include %}` tag in `base.html` uses in place of
+  `{% include %}`. The only per-request part they may contain is the CSRF
+  token, rendered as `prerender.CSRF_PLACEHOLDER` and substituted when the
+  string is included.
+- `warm()` compiles every project template, renders the static components
+  and computes the templates digest used in page ETags. `wsgi.py` calls it
+  at worker startup, so the first requests do not pay for any of it.
+
+The `render_benchmark` command compares page render times with and without
+all of this.
+
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.template import engines
+from django.template.loader import get_template, render_to_string
+from django.template.utils import get_app_template_dirs
+from django.utils.safestring import mark_safe
+
+from myapp.prerender import CSRF_PLACEHOLDER
+
+STATIC_INCLUDES = ['components/footer.html', 'components/modals.html']
+CSRF_INPUT = '<input type="hidden" name="csrfmiddlewaretoken" value="%s">'
+
+# Turned off by `render_benchmark` to measure plain includes.
+enabled = True
+
+_rendered = {}
+_lock = threading.Lock()
+
+
+def render_static(name):
+    """
+    Returns the request-independent HTML of the component `name`,
+    rendering it on first use.
+    """
+    html = _rendered.get(name)
+    if html is None:
+        with _lock:
+            html = _rendered.get(name)
+            if html is None:
+                html = _rendered[name] = render_to_string(name, {'csrf_token': CSRF_PLACEHOLDER})
+    return html
+
+
+def static_include(name, csrf_token):
+    """
+    Returns the prerendered component `name` with the request's CSRF token
+    filled in (the token field is dropped if there is no token, as
+    `{% csrf_token %}` does).
+    """
+    html = render_static(name)
+    if CSRF_PLACEHOLDER in html:
+        token = str(csrf_token or '')
+        if token and token != 'NOTPROVIDED':
+            html = html.replace(CSRF_PLACEHOLDER, token)
+        else:
+            html = html.replace(CSRF_INPUT % CSRF_PLACEHOLDER, '')
+    return mark_safe(html)
+
+
+def clear(**kwargs):
+    """
+    Forgets the prerendered components, e.g. when the autoreloader reports
+    a changed template.
+    """
+    with _lock:
+        _rendered.clear()
+
+
+def template_names():
+    """
+    Returns the names of the project's templates (Django's own admin
+    templates are left to load on demand).
+    """
+    directories = [os.path.join(settings.BASE_DIR, directory) for directory in engines['django'].engine.dirs]
+    directories += [str(directory) for directory in get_app_template_dirs('templates')
+                    if str(directory).startswith(str(settings.BASE_DIR))]
+    names = set()
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith('.html'):
+                    names.add(os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/'))
+    return sorted(names)
+
+
+def warm():
+    """
+    Compiles every project template into the cached loader, renders the
+    static components and computes the templates digest.
+
+    Returns:
+        int: The number of templates compiled.
+    """
+    from myapp import responses
+
+    names = template_names()
+    for name in names:
+        get_template(name)
+    for name in STATIC_INCLUDES:
+        render_static(name)
+    responses.templates_digest()
+    return len(names)
@@ -1,3 +1,1612 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from io import StringIO
+from time import sleep
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from myapp import (
+    archive, cart, catalog, contact, course_stats, enrollment, exports, gateway, invalidation, prerender, pricing,
+    profiling, progress, provisioning, rankings, recommendations, responses, rollups, singleflight, staticfiles,
+    templating, uploads,
+)
+from myapp.models import (
+    ArchivedPayment, ArchivedPaymentItem, Author, Categories, Course, CourseCooccurrence, CourseProgress,
+    CourseRanking, CourseRecommendation, DailyCategorySales, DailyCourseSales, InvalidationEvent, Lesson, Level,
+    Payment, PaymentItem, SlowQuery, StoredFile, UserCourse, Video, contactdb, reviewdb,
+)
+
+
+# The manifest storage needs `collectstatic`; tests render pages without it.
+PLAIN_STATIC = override_settings(STORAGES={
+    **settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+
+
+class PricingTests(TestCase):
+    """
+    Prices are computed in integer paise, rounded down, and stored on the
+    course so listings, filters and checkout agree.
+    """
+
+    def test_effective_price(self):
+        self.assertEqual(pricing.effective_price(499, 10), 44910)
+        self.assertEqual(pricing.effective_price(333, 33), 22311)
+        self.assertEqual(pricing.effective_price(None, 10), 0)
+        self.assertEqual(pricing.effective_price(500, None), 50000)
+        self.assertEqual(pricing.effective_price(500, 150), 0)
+        self.assertEqual(pricing.effective_price(500, -5), 50000)
+
+    def test_formatting(self):
+        self.assertEqual(pricing.format_rupees(44910), '449.10')
+        self.assertEqual(pricing.format_rupees(49900), '499')
+        self.assertEqual(pricing.format_rupees(None), '0')
+        self.assertEqual(pricing.rupees_to_paise('449'), 44900)
+
+    def test_saved_on_course(self):
+        category = Categories.objects.create(name='Category')
+        course = Course.objects.create(title='Course', description='', price=999, discount=15, category=category)
+        self.assertEqual(course.effective_price, 84915)
+        course.discount = None
+        course.save()
+        course.refresh_from_db()
+        self.assertEqual(course.effective_price, 99900)
+        self.assertQuerysetEqual(Course.objects.filter(effective_price__lte=pricing.rupees_to_paise(999)), [course])
+
+
+class CourseStatsTests(TestCase):
+    """
+    Curriculum statistics are computed in one query, served from the cache,
+    and refreshed in the background once stale.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name='Category')
+        cls.course = Course.objects.create(title='Course', description='', category=category)
+        cls.empty = Course.objects.create(title='Empty', description='', category=category)
+        for i in range(2):
+            lesson = Lesson.objects.create(course=cls.course, name='Lesson %d' % i)
+            for j in range(3):
+                Video.objects.create(course=cls.course, lesson=lesson, serial_number=i * 3 + j, title='Video',
+                                     youtube_id='yt', time_duration=1.5, preview=j == 0)
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(course_stats, 'refresh_in_background')
+        self.refresh = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_compute_stats(self):
+        with self.assertNumQueries(1):
+            stats = course_stats.compute_stats([self.course.id, self.empty.id])
+        self.assertEqual(stats[self.course.id], {'total_minutes': 9.0, 'lesson_count': 2, 'video_count': 6,
+                                                 'preview_count': 2})
+        self.assertEqual(stats[self.empty.id], course_stats.EMPTY_STATS)
+
+    def test_cached_then_stale(self):
+        with self.assertNumQueries(1):
+            first = course_stats.get_stats([self.course.id, self.empty.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(course_stats.get_stats([self.course.id, self.empty.id]), first)
+        self.refresh.assert_not_called()
+
+        Video.objects.filter(course=self.course).delete()
+        course_stats.mark_stale([self.course.id])
+        self.refresh.assert_called_once_with([self.course.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(course_stats.get_stats([self.course.id]), {self.course.id: first[self.course.id]})
+        self.assertEqual(self.refresh.call_args_list, [mock.call([self.course.id])] * 2)
+
+        # What the background refresh does, minus closing the connection.
+        course_stats._store(course_stats.compute_stats([self.course.id]))
+        self.assertEqual(course_stats.get_stats([self.course.id])[self.course.id]['video_count'], 0)
+
+
+@PLAIN_STATIC
+class AdminQueryTests(TestCase):
+    """
+    Admin pages run the same number of queries however many videos,
+    lessons or courses they show.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.category = Categories.objects.create(name='Category')
+        cls.empty = Course.objects.create(title='Empty', description='', category=cls.category)
+        cls.full = Course.objects.create(title='Full', description='', category=cls.category)
+        for i in range(6):
+            lesson = Lesson.objects.create(course=cls.full, name='Lesson %d' % i)
+            for j in range(10):
+                Video.objects.create(course=cls.full, lesson=lesson, serial_number=i * 10 + j, title='Video', youtube_id='yt')
+
+    def setUp(self):
+        patcher = mock.patch.object(invalidation, 'CHECK_INTERVAL', 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        invalidation.check(force=True)
+        self.client.force_login(self.admin)
+
+    def queries(self, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_course_change_page(self):
+        lesson = Lesson.objects.create(course=self.empty, name='Lesson')
+        counts = [self.queries(reverse('admin:myapp_course_change', args=[self.empty.id]))]
+        Video.objects.create(course=self.empty, lesson=lesson, serial_number=0, title='Video', youtube_id='yt')
+        counts.append(self.queries(reverse('admin:myapp_course_change', args=[self.empty.id])))
+        counts.append(self.queries(reverse('admin:myapp_course_change', args=[self.full.id])))
+        # Only the page of video rows is skipped when there are none.
+        self.assertEqual(counts, [counts[0], counts[0] + 1, counts[0] + 1])
+
+    def test_changelists(self):
+        counts = []
+        for extra in (0, 20):
+            for i in range(extra):
+                course = Course.objects.create(title='Extra %d' % i, description='', category=self.category)
+                Lesson.objects.create(course=course, name='Lesson')
+            counts.append((self.queries(reverse('admin:myapp_course_changelist')),
+                           self.queries(reverse('admin:myapp_lesson_changelist'))))
+        self.assertEqual(counts[0], counts[1])
+
+
+class ExportTests(TestCase):
+    """
+    Exports stream the rows of a date range in date order, archived
+    payments included, to staff only.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', is_staff=True)
+        category = Categories.objects.create(name='Category')
+        cls.course = Course.objects.create(title='Course, "quoted"', description='', price=100, category=category)
+        cls.days = [timezone.make_aware(datetime(2026, 1, day, 12)) for day in (1, 2, 3)]
+        for i, day in enumerate(cls.days):
+            payment = Payment.objects.create(user=cls.staff, course=cls.course, order_id='order-%d' % i, amount=10000)
+            Payment.objects.filter(id=payment.id).update(date=day)
+        ArchivedPayment.objects.create(id=1000, order_id='archived', user=cls.staff, course=cls.course,
+                                       date=cls.days[0] - timedelta(hours=1), amount=5000,
+                                       archived_at=timezone.now(), reason='completed')
+
+    def export(self, name, **params):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_data', args=[name]), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_merges_archive_in_date_order(self):
+        lines = self.export('payments', start='2026-01-01', end='2026-01-02').splitlines()
+        self.assertEqual(lines[0], ','.join(exports.EXPORTS['payments'][1]))
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['archived', 'order-0', 'order-1'])
+        self.assertIn('"Course, ""quoted"""', lines[1])
+
+    def test_jsonl(self):
+        rows = [json.loads(line) for line in self.export('payments', format='jsonl', start='2026-01-03').splitlines()]
+        self.assertEqual([(row['order_id'], row['amount']) for row in rows], [('order-2', 10000)])
+        self.assertEqual(rows[0]['date'], self.days[2].isoformat())
+
+    def test_one_query_per_table(self):
+        with self.assertNumQueries(1):
+            columns, rows = exports.export_rows('contacts')
+            list(rows)
+        with self.assertNumQueries(2):
+            columns, rows = exports.export_rows('payments')
+            self.assertEqual(len(list(rows)), 4)
+
+    def test_rejects(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('export_data', args=['payments']), {'start': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_data', args=['payments']), {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_data', args=['secrets'])).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('export_data', args=['payments'])).status_code, 302)
+
+
+class ProgressTests(TestCase):
+    """
+    Buffered heartbeats are ORed into the stored bitmaps, and only count for
+    enrolled users and the course's real videos.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('watcher', 'watcher@example.com', 'password')
+        cls.stranger = User.objects.create_user('stranger', 'stranger@example.com', 'password')
+        category = Categories.objects.create(name='Category')
+        cls.course = Course.objects.create(title='Course', description='', status='PUBLISH', category=category)
+        lesson = Lesson.objects.create(course=cls.course, name='Lesson')
+        for serial_number in range(4):
+            Video.objects.create(course=cls.course, lesson=lesson, serial_number=serial_number, title='Video', youtube_id='yt')
+        UserCourse.objects.create(user=cls.user, course=cls.course)
+
+    def setUp(self):
+        cache.clear()
+        for name, value in [('_pending', {}), ('_start_worker', lambda: None)]:
+            patcher = mock.patch.object(progress, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def watched(self, user):
+        row = CourseProgress.objects.filter(user=user, course=self.course).first()
+        return progress.from_bitmap(row.watched) if row else 0
+
+    def test_flush_ors_with_stored_bits(self):
+        progress.record_heartbeat(self.user.id, self.course.id, 0)
+        self.assertEqual(progress.flush(), 1)
+        # Another worker flushed bit 1 meanwhile.
+        CourseProgress.objects.filter(user=self.user).update(watched=progress.to_bitmap(0b11))
+        progress.record_heartbeat(self.user.id, self.course.id, 3)
+        progress.record_heartbeat(self.user.id, self.course.id, 3)
+        progress.flush()
+        self.assertEqual(self.watched(self.user), 0b1011)
+
+    def test_flush_query_count_does_not_grow(self):
+        users = [User.objects.create_user('user%d' % i) for i in range(20)]
+        UserCourse.objects.bulk_create([UserCourse(user=user, course=self.course) for user in users])
+        progress.course_serials([self.course.id])
+        for user in users:
+            progress.record_heartbeat(user.id, self.course.id, 2)
+        # Enrollments, then insert, read and update the rows (in a savepoint).
+        with self.assertNumQueries(6):
+            self.assertEqual(progress.flush(), 20)
+
+    def test_failed_flush_keeps_the_buffer(self):
+        progress.record_heartbeat(self.user.id, self.course.id, 1)
+        with mock.patch.object(CourseProgress.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                progress.flush()
+        progress.record_heartbeat(self.user.id, self.course.id, 2)
+        self.assertEqual(progress.flush(), 1)
+        self.assertEqual(self.watched(self.user), 0b110)
+
+    def test_background_flush(self):
+        progress.record_heartbeat(self.user.id, self.course.id, 0)
+        with mock.patch.object(progress, 'close_old_connections'), \
+                mock.patch.object(progress._wake, 'wait', side_effect=[True, SystemExit]):
+            with self.assertRaises(SystemExit):
+                progress._run()
+        self.assertEqual(self.watched(self.user), 0b1)
+        self.assertEqual(progress._pending, {})
+
+    def test_flush_drops_unenrolled_users(self):
+        progress.record_heartbeat(self.stranger.id, self.course.id, 0)
+        self.assertEqual(progress.flush(), 0)
+        self.assertFalse(CourseProgress.objects.exists())
+
+    def test_heartbeat_for_unknown_video_is_rejected(self):
+        with self.assertRaises(ValueError):
+            progress.record_heartbeat(self.user.id, self.course.id, 9)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('progress_heartbeat'), {'course': self.course.id, 'serial_number': 9})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(progress._pending, {})
+
+    def test_attach_counts_only_real_videos(self):
+        bits = 0b11 | sum(1 << serial_number for serial_number in range(10, 40))
+        CourseProgress.objects.create(user=self.user, course=self.course, watched=progress.to_bitmap(bits))
+        usercourse = UserCourse.objects.select_related('course').get(user=self.user)
+        course_stats.prime([usercourse.course])
+        progress.attach([usercourse])
+        self.assertEqual(usercourse.progress, 50)
+
+
+class CatalogSnapshotTests(TestCase):
+    """
+    Snapshot filters select the same courses as the equivalent ORM queries,
+    without running any.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories = [Categories.objects.create(name='Category %d' % i) for i in range(3)]
+        cls.levels = [Level.objects.create(name='Level %d' % i) for i in range(2)]
+        for i in range(24):
+            Course.objects.create(
+                title='Python %d' % i if i % 4 == 0 else 'Course %d' % i, description='',
+                featured_image='Media/featured_img/course.png',
+                price=[0, 500, 1000, 2000][i % 4], discount=[None, 10][i % 2],
+                status='PUBLISH' if i % 3 else 'DRAFT', category=cls.categories[i % 3],
+                level=cls.levels[i % 2] if i % 5 else None,
+            )
+
+    def setUp(self):
+        with self.assertNumQueries(1):
+            self.snapshot = catalog.build_snapshot(0)
+
+    def ids(self, **facets):
+        with self.assertNumQueries(0):
+            return [card.id for card in self.snapshot.select(self.snapshot.filter(**facets))]
+
+    def expected(self, queryset):
+        return list(queryset.order_by('-id').values_list('id', flat=True))
+
+    def test_facets_match_queries(self):
+        courses = Course.objects.all()
+        category, level = self.categories[1].id, self.levels[0].id
+        self.assertEqual(self.ids(), self.expected(courses))
+        self.assertEqual(self.ids(published=True), self.expected(courses.filter(status='PUBLISH')))
+        self.assertEqual(self.ids(categories=[category, self.categories[2].id]),
+                         self.expected(courses.filter(category__in=[category, self.categories[2].id])))
+        self.assertEqual(self.ids(categories=[category], levels=[level]),
+                         self.expected(courses.filter(category=category, level=level)))
+        self.assertEqual(self.ids(price='free'), self.expected(courses.filter(effective_price=0)))
+        self.assertEqual(self.ids(price='paid', published=True),
+                         self.expected(courses.filter(effective_price__gt=0, status='PUBLISH')))
+        self.assertEqual(self.ids(min_price=45000, max_price=100000),
+                         self.expected(courses.filter(effective_price__range=(45000, 100000))))
+        self.assertEqual(self.ids(query='python'), self.expected(courses.filter(title__icontains='python')))
+
+    def test_sort_orders(self):
+        mask = self.snapshot.filter(published=True)
+        prices = [card.effective_price for card in self.snapshot.select(mask, 'price_asc')]
+        self.assertEqual(prices, sorted(prices))
+        prices = [card.effective_price for card in self.snapshot.select(mask, 'price_desc')]
+        self.assertEqual(prices, sorted(prices, reverse=True))
+
+    def test_facet_counts(self):
+        category_counts, level_counts = self.snapshot.facet_counts()
+        for category in self.categories:
+            self.assertEqual(category_counts[category.id], Course.objects.filter(category=category).count())
+        self.assertEqual(level_counts[0], Course.objects.filter(level=None).count())
+
+    def test_course_save_reaches_the_snapshot(self):
+        catalog.get_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            course = Course.objects.create(title='New', description='', status='PUBLISH', category=self.categories[0])
+        snapshot = catalog.get_snapshot()
+        self.assertIn(course.id, [card.id for card in snapshot.select(snapshot.filter(published=True))])
+
+    @PLAIN_STATIC
+    def test_filter_view(self):
+        category = self.categories[1]
+        response = self.client.get(reverse('filter-data'), {'category[]': [category.id], 'price[]': ['PricePaid']})
+        html = response.json()['data']
+        expected = Course.objects.filter(category=category, effective_price__gt=0)
+        self.assertTrue(expected.exists())
+        for course in Course.objects.all():
+            self.assertEqual('>%s</h4>' % course.title in html, course in expected, course.title)
+
+    def test_invalidation_rebuilds_the_snapshot(self):
+        snapshot = catalog.get_snapshot()
+        self.assertIs(catalog.get_snapshot(), snapshot)
+        catalog.invalidate()
+        with self.assertNumQueries(1):
+            self.assertIsNot(catalog.get_snapshot(), snapshot)
+
+
+class RecommendationTests(TestCase):
+    """
+    Incremental updates keep the matrix equal to a full rebuild, in a
+    number of queries that does not grow with the user's history.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name='Category')
+        cls.courses = [Course.objects.create(title='Course %d' % i, description='', category=category) for i in range(40)]
+        cls.users = [User.objects.create_user('user%d' % i) for i in range(6)]
+
+    def enroll(self, user, courses):
+        UserCourse.objects.bulk_create([UserCourse(user=user, course=course) for course in courses])
+        recommendations.record_enrollments(user.id, [course.id for course in courses])
+
+    def snapshot(self):
+        cells = set(CourseCooccurrence.objects.values_list('course_id', 'other_id', 'count'))
+        lists = dict(CourseRecommendation.objects.exclude(neighbours=[]).values_list('course_id', 'neighbours'))
+        return cells, lists
+
+    def test_incremental_matches_rebuild(self):
+        for i, user in enumerate(self.users):
+            self.enroll(user, self.courses[i:i + 3])
+            self.enroll(user, [self.courses[i + 10]])
+            self.enroll(user, self.courses[i + 20:i + 22])
+        incremental = self.snapshot()
+        recommendations.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_query_count_does_not_grow_with_history(self):
+        light, heavy = self.users[:2]
+        self.enroll(light, self.courses[:2])
+        self.enroll(heavy, self.courses[:30])
+        counts = []
+        for user in (light, heavy):
+            UserCourse.objects.create(user=user, course=self.courses[35 + len(counts)])
+            with CaptureQueriesContext(connection) as queries:
+                recommendations.record_enrollments(user.id, [self.courses[35 + len(counts)].id])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+    def test_benchmark_rebuilds_and_rolls_back(self):
+        self.enroll(self.users[0], self.courses[:3])
+        before = self.snapshot(), UserCourse.objects.count(), Course.objects.count()
+        out = StringIO()
+        call_command('rebuild_recommendations', benchmark=200, courses=20, stdout=out)
+        self.assertIn('200 synthetic enrollments', out.getvalue())
+        self.assertEqual(before, (self.snapshot(), UserCourse.objects.count(), Course.objects.count()))
+
+class RankingTests(TransactionTestCase):
+    """
+    Incremental refreshes, including concurrent ones, keep the same scores
+    as a full replay of every event.
+    """
+    PARALLEL = 4
+
+    def setUp(self):
+        category = Categories.objects.create(name='Category')
+        self.courses = [Course.objects.create(title='Course %d' % i, description='', category=category) for i in range(3)]
+        self.users = [User.objects.create_user('learner%d' % i) for i in range(4)]
+
+    def scores(self):
+        return {
+            course_id: (round(popularity, 9), round(trending, 9))
+            for course_id, popularity, trending in CourseRanking.objects.values_list('course_id', 'popularity', 'trending')
+        }
+
+    def test_incremental_matches_full(self):
+        UserCourse.objects.create(user=self.users[0], course=self.courses[0])
+        rankings.refresh(now=timezone.now())
+        for user in self.users[1:]:
+            UserCourse.objects.create(user=user, course=self.courses[1])
+        now = timezone.now() + timedelta(days=1)
+        rankings.refresh(now=now)
+        incremental = self.scores()
+        rankings.refresh(full=True, now=now)
+        self.assertEqual(incremental, self.scores())
+
+    def test_concurrent_refreshes(self):
+        for user in self.users:
+            UserCourse.objects.create(user=user, course=self.courses[0])
+        rankings.refresh()
+        UserCourse.objects.create(user=self.users[0], course=self.courses[1])
+        barrier = threading.Barrier(self.PARALLEL)
+        errors = []
+
+        def refresh():
+            try:
+                barrier.wait()
+                rankings.refresh()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=refresh) for _ in range(self.PARALLEL)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        incremental = self.scores()
+        rankings.refresh(full=True, now=CourseRanking.objects.values_list('updated_at', flat=True).first())
+        self.assertEqual(incremental, self.scores())
+
+
+class RollupTests(TestCase):
+    """
+    The rollups kept up to date by orders, payments and free enrollments
+    equal a backfill of the same day, even after prices change, and
+    provisioned enrollments count as neither.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user('buyer%d' % i) for i in range(3)]
+        categories = [Categories.objects.create(name='Category %d' % i) for i in range(2)]
+        cls.courses = [
+            Course.objects.create(title='Course %d' % i, description='', price=100 * (i + 1), discount=10,
+                                  status='PUBLISH', category=categories[i % 2])
+            for i in range(3)
+        ]
+        cls.free = Course.objects.create(title='Free', description='', price=0, status='PUBLISH', category=categories[0])
+
+    def rollup_rows(self):
+        return (
+            sorted(DailyCourseSales.objects.values_list('day', 'course_id', *rollups.FIELDS)),
+            sorted(DailyCategorySales.objects.values_list('day', 'category_id', *rollups.FIELDS)),
+        )
+
+    def test_incremental_matches_backfill(self):
+        course = self.courses[0]
+        for i, user in enumerate(self.users):
+            payment = Payment.objects.create(user=user, course=course, order_id='single-%d' % i, amount=course.effective_price)
+            rollups.record_order(payment)
+            if i:
+                cart.fulfil(payment.order_id, 'pay-single-%d' % i)
+        payment = cart.create_payment(self.users[0], self.courses[1:], 'cart-0')
+        cart.fulfil('cart-0', 'pay-cart-0')
+        cart.create_payment(self.users[1], self.courses[1:], 'cart-1')
+        for user in self.users[:2]:
+            enrollment.enroll_one(user, self.free)
+        # A provisioned cohort is neither an order nor a free enrollment.
+        provisioning.provision([('learner@example.com', self.free.id), ('learner@example.com', course.id)])
+
+        # Later price changes must not rewrite past revenue.
+        for course in self.courses:
+            course.price *= 2
+            course.save()
+
+        incremental = self.rollup_rows()
+        self.assertEqual(sum(row[4] for row in incremental[0]), 2 * 9000 + 18000 + 27000)
+        today = timezone.localdate()
+        rollups.backfill(today, today)
+        self.assertEqual(self.rollup_rows(), incremental)
+
+
+    def test_report(self):
+        for i, course in enumerate(self.courses):
+            cart.create_payment(self.users[i], [course], 'report-%d' % i)
+            cart.fulfil('report-%d' % i, 'pay-report-%d' % i)
+        enrollment.enroll_one(self.users[0], self.free)
+        today = timezone.localdate()
+        by_category = rollups.report(today, today)
+        self.assertEqual([(row['category__name'], row['total_revenue'], row['total_free_enrollments']) for row in by_category],
+                         [('Category 0', 9000 + 27000, 1), ('Category 1', 18000, 0)])
+        by_course = rollups.report(today, today, group='course')
+        self.assertEqual([row['course__title'] for row in by_course], ['Course 2', 'Course 1', 'Course 0', 'Free'])
+        self.assertEqual(rollups.report(today + timedelta(days=1), today + timedelta(days=1)), [])
+
+    def test_backfill_command_starts_at_the_first_archived_order(self):
+        payment = cart.create_payment(self.users[0], self.courses[:1], 'old-order')
+        cart.fulfil('old-order', 'pay-old-order')
+        day = timezone.localdate() - timedelta(days=400)
+        Payment.objects.filter(id=payment.id).update(date=timezone.now() - timedelta(days=400))
+        UserCourse.objects.filter(user=self.users[0]).update(date=timezone.now() - timedelta(days=400))
+        self.assertEqual(archive.archive(pause=0), {'completed': 1, 'abandoned': 0})
+        DailyCourseSales.objects.all().delete()
+        DailyCategorySales.objects.all().delete()
+
+        out = StringIO()
+        call_command('backfill_rollups', stdout=out)
+        self.assertIn('from %s' % day, out.getvalue())
+        self.assertEqual(list(DailyCourseSales.objects.values_list('day', 'course_id', 'revenue')),
+                         [(day, self.courses[0].id, 9000)])
+
+class InvalidationTests(TestCase):
+    """
+    Workers apply each other's events once, and drop everything when they
+    cannot tell what they missed.
+    """
+
+    def setUp(self):
+        self.received = []
+        for name, value in [('CHECK_INTERVAL', 3600), ('_last_seen', None), ('_next_check', 0.0),
+                            ('_published', set()), ('_versions', {}),
+                            ('_subscribers', {'widget': [self.received.append]})]:
+            patcher = mock.patch.object(invalidation, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        invalidation.check(force=True)
+
+    def other_worker(self, object_id=None):
+        return InvalidationEvent.objects.create(entity='widget', object_id=object_id).id
+
+    def test_applies_other_workers_events(self):
+        self.other_worker(3)
+        newest = self.other_worker(4)
+        with self.assertNumQueries(0):
+            self.assertEqual(invalidation.check(), 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(invalidation.check(force=True), 2)
+        self.assertEqual(self.received, [{3, 4}])
+        self.assertEqual(invalidation.version('widget'), newest)
+        self.assertEqual(invalidation.check(force=True), 0)
+        self.assertEqual(self.received, [{3, 4}])
+
+    def test_own_events_are_applied_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidation.publish('widget', 7)
+        self.assertEqual(self.received, [{7}])
+        invalidation.check(force=True)
+        self.assertEqual(self.received, [{7}])
+        self.assertFalse(invalidation._published)
+
+    def test_pruned_log_drops_everything(self):
+        seen = self.other_worker(1)
+        invalidation.check(force=True)
+        missed = self.other_worker(2)
+        newest = self.other_worker(3)
+        InvalidationEvent.objects.filter(id__in=[seen, missed]).delete()
+        invalidation.check(force=True)
+        self.assertEqual(self.received, [{1}, None])
+        self.assertEqual(invalidation.current_version(), newest)
+
+    def test_reset_log_drops_everything(self):
+        self.other_worker(1)
+        invalidation.check(force=True)
+        InvalidationEvent.objects.all().delete()
+        invalidation.check(force=True)
+        self.assertEqual(self.received, [{1}, None])
+        self.assertEqual(invalidation.version('widget'), 0)
+        self.other_worker(2)
+        invalidation.check(force=True)
+        self.assertEqual(self.received, [{1}, None, {2}])
+
+    def test_prune_keeps_newest_event_per_entity(self):
+        old = [self.other_worker(i) for i in range(3)]
+        course = InvalidationEvent.objects.create(entity='course').id
+        InvalidationEvent.objects.update(created_at=timezone.now() - invalidation.RETENTION * 2)
+        self.assertEqual(invalidation.prune(), 2)
+        self.assertEqual(sorted(InvalidationEvent.objects.values_list('id', flat=True)), [old[-1], course])
+
+
+    def test_middleware_checks_once_per_interval(self):
+        middleware = invalidation.InvalidationMiddleware(lambda request: 'response')
+        request = RequestFactory().get('/')
+        self.other_worker(5)
+        with self.assertNumQueries(0):
+            self.assertEqual(middleware(request), 'response')
+        self.assertEqual(self.received, [])
+        invalidation._next_check = 0.0
+        with self.assertNumQueries(1):
+            middleware(request)
+        self.assertEqual(self.received, [{5}])
+
+    def test_model_changes_are_published(self):
+        invalidation.subscribe(['categories'], self.received.append)
+        with self.captureOnCommitCallbacks(execute=True):
+            category_id = Categories.objects.create(name='Category').id
+        with self.captureOnCommitCallbacks(execute=True):
+            Categories.objects.get(id=category_id).delete()
+        self.assertEqual(self.received, [{category_id}, {category_id}])
+        self.assertEqual(invalidation.version('categories'), InvalidationEvent.objects.latest('id').id)
+
+class SingleflightTests(TestCase):
+    """
+    One caller recomputes an expired or missing key while the others are
+    served the previous value or wait for the new one.
+    """
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(singleflight, '_counters', Counter(dict.fromkeys(singleflight.COUNTERS, 0)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_hit_until_invalidated(self):
+        self.assertEqual(singleflight.get('key', self.compute, 60, beta=0), 1)
+        self.assertEqual(singleflight.get('key', self.compute, 60, beta=0), 1)
+        singleflight.invalidate('key')
+        self.assertEqual(singleflight.get('key', self.compute, 60, beta=0), 2)
+        self.assertIsNone(cache.get(singleflight.LOCK_PREFIX + 'key'))
+        stats = singleflight.stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['stale_refreshes']), (1, 1, 1))
+
+    def test_stale_value_served_while_locked(self):
+        singleflight.get('key', self.compute, 60, beta=0)
+        singleflight.invalidate('key')
+        cache.add(singleflight.LOCK_PREFIX + 'key', 1)
+        self.assertEqual(singleflight.get('key', self.compute, 60, beta=0), 1)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(singleflight.stats()['coalesced'], 1)
+
+    def test_miss_gives_up_waiting(self):
+        cache.add(singleflight.LOCK_PREFIX + 'key', 1)
+        with mock.patch.object(singleflight, 'POLL_INTERVAL', 0.01):
+            self.assertEqual(singleflight.get('key', self.compute, 60, wait=0.05), 1)
+        self.assertEqual(singleflight.stats()['timeouts'], 1)
+
+    def test_concurrent_misses_compute_once(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return self.compute()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(singleflight.get('key', slow, 60)))
+                   for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(singleflight.stats()['misses'], 1)
+
+
+    def test_invalidate_keeps_the_original_lifetime(self):
+        clock = [1000.0]
+        for target in ('time.time', 'myapp.singleflight.time'):
+            patcher = mock.patch(target, lambda: clock[0])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        singleflight.get('key', self.compute, 10, grace=5, beta=0)
+        clock[0] = 1012.0
+        singleflight.invalidate('key')
+        cache.add(singleflight.LOCK_PREFIX + 'key', 1)
+        clock[0] = 1014.0
+        self.assertEqual(singleflight.get('key', self.compute, 10, grace=5, beta=0, wait=0), 1)
+        clock[0] = 1016.0
+        self.assertEqual(singleflight.get('key', self.compute, 10, grace=5, beta=0, wait=0), 2)
+        stats = singleflight.stats()
+        self.assertEqual((stats['coalesced'], stats['timeouts']), (1, 1))
+
+@PLAIN_STATIC
+class PrerenderTests(TestCase):
+    """
+    A build renders every catalog page through the middleware stack, and
+    the next build only the pages whose inputs changed.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name='Category')
+        cls.course = Course.objects.create(title='Prerendered', description='', status='PUBLISH', category=category,
+                                           featured_image='Media/featured_img/course.png')
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        patcher = mock.patch.object(catalog, '_snapshot', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_build_is_incremental(self):
+        result = prerender.build(processes=0, root=self.root)
+        self.assertEqual((result['failed'], result['unchanged']), (0, 0))
+        self.assertGreater(result['rendered'], 0)
+        with open(prerender._file_for(self.root, reverse('home')), 'rb') as f:
+            self.assertIn(b'Prerendered', f.read())
+        result = prerender.build(processes=0, root=self.root)
+        self.assertEqual((result['rendered'], result['failed']), (0, 0))
+
+        Course.objects.filter(id=self.course.id).update(title='Renamed')
+        result = prerender.build(processes=0, root=self.root)
+        self.assertEqual(result['unchanged'], 0)
+
+
+class StaticPipelineTests(TestCase):
+    """
+    collectstatic writes hashed, precompressed assets, and the middleware
+    serves the best variant the client accepts with the right lifetime.
+    """
+
+    def setUp(self):
+        source, self.root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, self.root)
+        with open(os.path.join(source, 'site.css'), 'w') as f:
+            f.write('body { background: url("logo.svg"); }\n' * 100)
+        with open(os.path.join(source, 'logo.svg'), 'w') as f:
+            f.write('<svg xmlns="http://www.w3.org/2000/svg"></svg>')
+        settings_override = override_settings(
+            STATIC_ROOT=self.root, STATICFILES_DIRS=[source],
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.middleware = staticfiles.PrecompressedStaticMiddleware(lambda request: 'fallthrough')
+        self.css = next(name for name in self.middleware.hashed if name.startswith('site.'))
+
+    def get(self, name, accept=''):
+        return self.middleware(RequestFactory().get(settings.STATIC_URL + name, HTTP_ACCEPT_ENCODING=accept))
+
+    def test_collectstatic_precompresses_hashed_text_assets(self):
+        with open(os.path.join(self.root, staticfiles.COMPRESSION_MANIFEST)) as f:
+            sizes = json.load(f)
+        self.assertLess(sizes[self.css]['gzip'], sizes[self.css]['size'])
+        self.assertTrue(os.path.isfile(os.path.join(self.root, self.css + '.gz')))
+        # Too small to gain anything from compression.
+        svg = next(name for name in sizes if name.startswith('logo.'))
+        self.assertNotIn('gzip', sizes[svg])
+        with open(os.path.join(self.root, self.css)) as f:
+            self.assertIn(svg, f.read())
+
+    def test_serves_the_accepted_variant(self):
+        response = self.get(self.css, 'gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], staticfiles.IMMUTABLE)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        response = self.get(self.css, 'gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(self.get('site.css')['Cache-Control'], staticfiles.REVALIDATE)
+        self.assertEqual(self.get('missing.css'), 'fallthrough')
+
+    def test_accepted_encodings(self):
+        self.assertEqual(staticfiles.accepted_encodings('GZip;q=0.5, br;q=0, identity, x;q=bad'), {'gzip', 'identity'})
+
+
+@PLAIN_STATIC
+class ConditionalResponseTests(TestCase):
+    """
+    A page's ETag changes with the visitor's own profile and enrollment,
+    not with other visitors' activity, and compressed bodies are padded.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name='Category')
+        cls.course, cls.other = [
+            Course.objects.create(title='Course %d' % i, description='', price=1000, status='PUBLISH',
+                                  category=category, featured_image='Media/featured_img/course.png')
+            for i in range(2)
+        ]
+        cls.user = User.objects.create_user('learner', 'learner@example.com', 'password', first_name='Ada')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('course_details', args=[self.course.id])
+
+    def etag(self):
+        # The first response sets the CSRF cookie, which is part of the ETag.
+        self.client.get(self.url)
+        return self.client.get(self.url)['ETag']
+
+    def revalidate(self, etag):
+        return self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def test_etag_follows_the_profile(self):
+        etag = self.etag()
+        self.assertEqual(self.revalidate(etag), 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Grace'
+            self.user.save()
+        self.assertEqual(self.revalidate(etag), 200)
+
+    def test_etag_follows_own_enrollments_only(self):
+        etag = self.etag()
+        someone = User.objects.create_user('someone')
+        with self.captureOnCommitCallbacks(execute=True):
+            enrollment.enroll_one(someone, self.other)
+        self.assertEqual(self.revalidate(etag), 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            enrollment.enroll_one(self.user, self.course)
+        self.assertEqual(self.revalidate(etag), 200)
+
+    def test_gzip_body_is_padded(self):
+        body = b'<p>%s</p>' % (b'course ' * 500)
+        middleware = responses.CompressionMiddleware(lambda request: HttpResponse(body))
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip, br')
+        sizes = set()
+        for _ in range(20):
+            response = middleware(request)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(response.content), body)
+            sizes.add(len(response.content))
+        self.assertGreater(len(sizes), 1)
+
+
+class SlowQueryTests(TestCase):
+    """
+    Slow statements are aggregated per fingerprint, and a failure to
+    record them never reaches the response.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(profiling, 'SLOW_QUERY_MS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def view(self, request):
+        Categories.objects.filter(name='Category %d' % len(request.GET)).count()
+        return HttpResponse('ok')
+
+    def test_records_per_fingerprint(self):
+        middleware = profiling.SlowQueryMiddleware(self.view)
+        middleware(RequestFactory().get('/first'))
+        middleware(RequestFactory().get('/second', {'page': 2}))
+        row = SlowQuery.objects.get(sql__contains='myapp_categories')
+        self.assertEqual((row.count, row.last_path), (2, '/second'))
+
+    def test_failure_to_record_is_logged(self):
+        middleware = profiling.SlowQueryMiddleware(self.view)
+        with mock.patch.object(profiling, 'record', side_effect=DatabaseError('database is locked')), \
+                self.assertLogs('myapp.profiling', 'ERROR'):
+            response = middleware(RequestFactory().get('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SlowQuery.objects.exists())
+
+
+class UploadTests(TestCase):
+    """
+    Identical uploads are stored once and deleted with their last
+    reference; oversized uploads are refused.
+    """
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def author(self, name, content):
+        author = Author(name=name, about_author='')
+        author.author_profile.save('%s.png' % name, ContentFile(content), save=False)
+        author.save()
+        return author
+
+    def refcounts(self):
+        return dict(StoredFile.objects.values_list('name', 'refcount'))
+
+    def test_refcounts_follow_references(self):
+        first, second = self.author('first', b'same'), self.author('second', b'same')
+        shared = first.author_profile.name
+        self.assertEqual(second.author_profile.name, shared)
+        self.assertEqual(self.refcounts(), {shared: 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.author_profile.save('other.png', ContentFile(b'other'))
+        other = second.author_profile.name
+        self.assertEqual(self.refcounts(), {shared: 1, other: 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.refcounts(), {other: 1})
+        self.assertFalse(first.author_profile.storage.exists(shared))
+        self.assertTrue(second.author_profile.storage.exists(other))
+
+    def test_release_skips_content_stored_again(self):
+        first = self.author('first', b'same')
+        shared = first.author_profile.name
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.delete()
+        self.assertEqual(self.refcounts(), {shared: 0})
+        # The same bytes are uploaded before the release runs.
+        second = Author(name='second', about_author='')
+        second.author_profile.save('second.png', ContentFile(b'same'), save=False)
+        for callback in callbacks:
+            callback()
+        second.save()
+        self.assertEqual(self.refcounts(), {shared: 1})
+        self.assertTrue(second.author_profile.storage.exists(shared))
+
+    def test_storing_the_same_content_again_keeps_the_count(self):
+        author = self.author('first', b'same')
+        with self.captureOnCommitCallbacks(execute=True):
+            author.author_profile.save('again.png', ContentFile(b'same'))
+        self.assertEqual(self.refcounts(), {author.author_profile.name: 1})
+
+    def test_oversized_csv_is_refused(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+        upload = SimpleUploadedFile('learners.csv', b'email\n' + b'learner@example.com\n' * 10)
+        with mock.patch.object(uploads, 'UPLOAD_MAX_SIZE', 64):
+            response = self.client.post(reverse('provision_learners'), {'file': upload})
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(User.objects.exclude(id=staff.id).exists())
+
+
+class ProvisioningTests(TestCase):
+    """
+    Provisioning the same cohort again creates nothing, and the matrix it
+    updates incrementally equals a rebuild.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name='Category')
+        cls.courses = [Course.objects.create(title='Course %d' % i, description='', category=category) for i in range(4)]
+        cls.existing = User.objects.create_user('existing', 'Existing@Example.com')
+        UserCourse.objects.create(user=cls.existing, course=cls.courses[3])
+
+    def snapshot(self):
+        return (
+            set(CourseCooccurrence.objects.values_list('course_id', 'other_id', 'count')),
+            dict(CourseRecommendation.objects.exclude(neighbours=[]).values_list('course_id', 'neighbours')),
+        )
+
+    def test_repeat_is_idempotent(self):
+        rows = [('learner%d@example.com' % i, course.id) for i in range(5) for course in self.courses[:2]]
+        rows += [('existing@example.com', self.courses[0].id), ('learner0@example.com', None)]
+        with self.captureOnCommitCallbacks(execute=True):
+            first = provisioning.provision(rows)
+        self.assertEqual((first['created'], first['existing'], first['enrolled']), (5, 1, 11))
+        self.assertEqual(UserCourse.objects.filter(source='PROVISIONED').count(), 11)
+        incremental = self.snapshot()
+        self.assertIn((self.courses[0].id, self.courses[1].id, 5), incremental[0])
+        self.assertIn((self.courses[3].id, self.courses[0].id, 1), incremental[0])
+        recommendations.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            again = provisioning.provision(rows)
+        self.assertEqual((again['created'], again['existing'], again['enrolled'], again['already_enrolled']),
+                         (0, 6, 0, 11))
+        self.assertEqual(again['credentials'], [])
+        self.assertEqual(callbacks, [])
+        self.assertEqual(User.objects.count(), 6)
+        self.assertEqual(UserCourse.objects.count(), 12)
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_view_hashes_passwords_without_forking(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+        csv = b'email,course\n' + b''.join(b'learner%d@example.com,%d\n' % (i, self.courses[0].id) for i in range(3))
+        with mock.patch('concurrent.futures.ProcessPoolExecutor') as pool, \
+                self.settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+            response = self.client.post(reverse('provision_learners'),
+                                        {'file': SimpleUploadedFile('learners.csv', csv), 'mode': 'password'})
+            credentials = response.json()['credentials']
+            for entry in credentials:
+                self.assertTrue(User.objects.get(email=entry['email']).check_password(entry['password']))
+        pool.assert_not_called()
+        self.assertEqual(len(credentials), 3)
+
+
+class PaymentCallbackTests(TransactionTestCase):
+    """
+    A payment is fulfilled once, however often its verification callback
+    is repeated or raced.
+    """
+    PARALLEL = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = Categories.objects.create(name='Category')
+        self.courses = [
+            Course.objects.create(title='Course %d' % i, description='', price=1000, status='PUBLISH', category=category)
+            for i in range(3)
+        ]
+        cart.create_payment(self.user, self.courses, 'order-1')
+
+    def assertFulfilledOnce(self):
+        payment = Payment.objects.get(order_id='order-1')
+        self.assertTrue(payment.status)
+        self.assertEqual(UserCourse.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(sorted(DailyCourseSales.objects.values_list('course_id', 'orders', 'paid_count', 'revenue')),
+                         [(course.id, 1, 1, 100000) for course in self.courses])
+        self.assertEqual(payment.items.filter(user_course=None).count(), 0)
+        return payment
+
+    def test_repeated_callbacks(self):
+        for i in range(3):
+            payment = cart.fulfil('order-1', 'pay-%d' % i)
+            self.assertEqual(payment.payment_id, 'pay-0')
+        self.assertFulfilledOnce()
+
+    def test_concurrent_callbacks(self):
+        barrier = threading.Barrier(self.PARALLEL)
+        errors = []
+
+        def callback(i):
+            try:
+                barrier.wait()
+                cart.fulfil('order-1', 'pay-%d' % i)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=callback, args=[i]) for i in range(self.PARALLEL)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertFulfilledOnce()
+
+    def test_unknown_order(self):
+        with self.assertRaises(Payment.DoesNotExist):
+            cart.fulfil('order-2', 'pay-0')
+
+
+class ArchiveTests(TransactionTestCase):
+    """
+    Payments survive an archive and restore round trip unchanged, a
+    payment that changes meanwhile stays hot, and both wait for a
+    concurrent writer instead of failing.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = Categories.objects.create(name='Category')
+        self.courses = [
+            Course.objects.create(title='Course %d' % i, description='', price=1000, status='PUBLISH', category=category)
+            for i in range(2)
+        ]
+
+    def order(self, order_id, courses, days):
+        payment = cart.create_payment(self.user, courses, order_id)
+        Payment.objects.filter(id=payment.id).update(date=timezone.now() - timedelta(days=days))
+        return payment
+
+    def rows(self, order_id):
+        payment = Payment.objects.filter(order_id=order_id).values(*archive.PAYMENT_FIELDS).get()
+        items = list(PaymentItem.objects.filter(payment_id=payment['id']).order_by('id').values(*archive.ITEM_FIELDS))
+        return payment, items
+
+    def hold_write_lock(self, seconds):
+        locked = threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    Categories.objects.create(name='Held')
+                    locked.set()
+                    sleep(seconds)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait(5)
+        self.addCleanup(thread.join)
+
+    def test_round_trip(self):
+        self.order('paid', self.courses, 400)
+        cart.fulfil('paid', 'pay-paid')
+        self.order('abandoned', self.courses[1:], 10)
+        self.order('fresh', self.courses, 0)
+        before = self.rows('paid')
+
+        self.assertEqual(archive.archive(pause=0, batch_size=1), {'completed': 1, 'abandoned': 1})
+        self.assertEqual(list(Payment.objects.values_list('order_id', flat=True)), ['fresh'])
+        self.assertEqual(dict(ArchivedPayment.objects.values_list('order_id', 'reason')),
+                         {'paid': 'completed', 'abandoned': 'abandoned'})
+        self.assertEqual(ArchivedPaymentItem.objects.count(), 3)
+        self.assertIsInstance(archive.find('abandoned'), ArchivedPayment)
+
+        self.assertEqual(archive.restore('paid').order_id, 'paid')
+        self.assertEqual(self.rows('paid'), before)
+        self.assertIsNone(archive.restore('paid'))
+        # A late payment for an abandoned order restores it.
+        self.assertTrue(cart.fulfil('abandoned', 'pay-late').status)
+        self.assertFalse(ArchivedPayment.objects.exists())
+        self.assertFalse(ArchivedPaymentItem.objects.exists())
+
+    def test_payment_changed_meanwhile_stays_hot(self):
+        self.order('late', self.courses, 10)
+        bulk_create = ArchivedPayment.objects.bulk_create
+
+        def paid_meanwhile(*args, **kwargs):
+            Payment.objects.filter(order_id='late').update(status=True)
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(ArchivedPayment.objects, 'bulk_create', paid_meanwhile):
+            self.assertEqual(archive.archive(pause=0), {'completed': 0, 'abandoned': 0})
+        self.assertFalse(ArchivedPayment.objects.exists())
+        self.assertEqual(PaymentItem.objects.count(), 2)
+
+    def test_waits_for_a_concurrent_writer(self):
+        self.order('abandoned', self.courses, 10)
+        self.hold_write_lock(0.3)
+        self.assertEqual(archive.archive(pause=0), {'completed': 0, 'abandoned': 1})
+        self.hold_write_lock(0.3)
+        self.assertEqual(archive.restore('abandoned').order_id, 'abandoned')
+
+
+class GatewayTests(TestCase):
+    """
+    The Razorpay client is built once, on first use; its calls time out,
+    and only connections that were never established are retried.
+    """
+
+    def setUp(self):
+        for name, value in [('_client', None), ('TIMEOUT', 0.2), ('RETRY_BACKOFF', 0)]:
+            patcher = mock.patch.object(gateway, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def listener(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen()
+        self.addCleanup(server.close)
+        return server
+
+    def test_urlconf_does_not_import_razorpay(self):
+        code = ("import sys, django; django.setup(); import SkillAcademy.urls; "
+                "print(sorted({'razorpay', 'requests'} & set(sys.modules)))")
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=settings.BASE_DIR, env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'SkillAcademy.settings'})
+        self.assertEqual(output.stdout.strip(), '[]')
+
+    def test_client_is_shared(self):
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(gateway.client())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(client) for client in clients}), 1)
+
+    def test_sent_request_times_out_without_retry(self):
+        import requests
+
+        server = self.listener()
+        client = gateway.client()
+        client.base_url = 'http://127.0.0.1:%d' % server.getsockname()[1]
+        with self.assertRaises(requests.Timeout):
+            client.order.create({'amount': 100, 'currency': 'INR'})
+        server.settimeout(0)
+        accepted = []
+        with self.assertRaises(BlockingIOError):
+            while True:
+                accepted.append(server.accept()[0])
+        for connection_ in accepted:
+            connection_.close()
+        self.assertEqual(len(accepted), 1)
+
+    def test_failed_connection_is_retried(self):
+        import requests
+        from urllib3.util import connection as urllib3_connection
+
+        server = self.listener()
+        port = server.getsockname()[1]
+        server.close()
+        client = gateway.client()
+        client.base_url = 'http://127.0.0.1:%d' % port
+        with mock.patch.object(urllib3_connection, 'create_connection', wraps=urllib3_connection.create_connection) as connect, \
+                self.assertRaises(requests.ConnectionError):
+            client.order.create({'amount': 100, 'currency': 'INR'})
+        self.assertEqual(connect.call_count, gateway.CONNECT_RETRIES + 1)
+
+
+class CatalogApiTests(TestCase):
+    """
+    The JSON API runs a fixed number of queries per endpoint, whatever the
+    number of rows, and none at all to answer a matching `If-None-Match`.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.level = Level.objects.create(name='Beginner')
+        cls.author = Author.objects.create(name='Ada', author_profile='Media/author/ada.png', about_author='')
+        cls.categories = [Categories.objects.create(name='Category %d' % i, icon='fa-%d' % i) for i in range(3)]
+        cls.courses = [
+            Course.objects.create(
+                title='Course %d' % i, description='', price=1000, discount=10, status='PUBLISH',
+                category=cls.categories[i % 3], level=cls.level, author=cls.author,
+            )
+            for i in range(30)
+        ]
+        cls.draft = Course.objects.create(title='Draft', description='', status='DRAFT', category=cls.categories[0])
+        cls.course = cls.courses[0]
+        for i in range(4):
+            lesson = Lesson.objects.create(course=cls.course, name='Lesson %d' % i)
+            for j in range(5):
+                Video.objects.create(course=cls.course, lesson=lesson, serial_number=i * 5 + j,
+                                     title='Video %d.%d' % (i, j), youtube_id='yt%d' % (i * 5 + j), preview=i + j == 0)
+        for i in range(25):
+            reviewdb.objects.create(selectcourse=cls.course.title, selectuser='User %d' % i, Review='Good')
+
+    def setUp(self):
+        # Keep the invalidation log check out of the counted queries.
+        patcher = mock.patch.object(invalidation, 'CHECK_INTERVAL', 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        invalidation.check(force=True)
+
+    def get(self, name, queries, *args, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse(name, args=args), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_categories(self):
+        data = self.get('api_categories', 1).json()
+        self.assertEqual([row['name'] for row in data['results']], ['Category 0', 'Category 1', 'Category 2'])
+        self.assertIsNone(data['next'])
+
+    def test_courses_query_count_does_not_grow(self):
+        self.assertEqual(len(self.get('api_courses', 1, limit=5).json()['results']), 5)
+        data = self.get('api_courses', 1, limit=100, fields='id,title,category,level,author').json()
+        self.assertEqual(len(data['results']), 30)
+        self.assertEqual(data['results'][0], {
+            'id': self.course.id, 'title': 'Course 0', 'category': 'Category 0', 'level': 'Beginner', 'author': 'Ada',
+        })
+
+    def test_courses_cursor_pagination(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 7, 'fields': 'id'}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.get('api_courses', 1, **params).json()
+            seen += [row['id'] for row in data['results']]
+            cursor = data['next']
+            if cursor is None:
+                break
+        self.assertEqual(seen, [course.id for course in self.courses])
+
+    def test_courses_filter(self):
+        data = self.get('api_courses', 1, category=self.categories[1].id, fields='id').json()
+        self.assertEqual(len(data['results']), 10)
+
+    def test_course(self):
+        data = self.get('api_course', 1, self.course.id, fields='title,effective_price,author_image').json()
+        self.assertEqual(data, {
+            'title': 'Course 0', 'effective_price': 90000, 'author_image': settings.MEDIA_URL + 'Media/author/ada.png',
+        })
+
+    def test_draft_course_is_hidden(self):
+        self.assertEqual(self.client.get(reverse('api_course', args=[self.draft.id])).status_code, 404)
+
+    def test_curriculum(self):
+        data = self.get('api_curriculum', 3, self.course.id).json()
+        self.assertEqual(len(data['lessons']), 4)
+        self.assertEqual([len(lesson['videos']) for lesson in data['lessons']], [5, 5, 5, 5])
+
+    def test_curriculum_hides_paid_videos(self):
+        def youtube_ids(queries):
+            response = self.get('api_curriculum', queries, self.course.id, fields='youtube_id,preview')
+            videos = [video for lesson in response.json()['lessons'] for video in lesson['videos']]
+            return response, {video['youtube_id'] for video in videos if not video['preview']}
+
+        response, paid = youtube_ids(3)
+        self.assertEqual(paid, {None})
+        self.assertIn('public', response['Cache-Control'])
+        user = User.objects.create_user('learner', password='password')
+        self.client.force_login(user)
+        response, paid = youtube_ids(5)
+        self.assertEqual(paid, {None})
+        self.assertIn('private', response['Cache-Control'])
+        with self.captureOnCommitCallbacks(execute=True):
+            UserCourse.objects.create(user=user, course=self.course)
+        enrolled, paid = youtube_ids(4)
+        self.assertEqual(paid, {'yt%d' % i for i in range(1, 20)})
+        self.assertNotEqual(enrolled['ETag'], response['ETag'])
+
+    def test_reviews(self):
+        data = self.get('api_reviews', 2, self.course.id, limit=10).json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertIsNotNone(data['next'])
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse('api_courses'), {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_not_modified_without_queries(self):
+        response = self.get('api_courses', 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('api_courses'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_catalog(self):
+        etag = self.get('api_course', 1, self.course.id)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidation.publish('course', self.course.id)
+        response = self.client.get(reverse('api_course', args=[self.course.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ContactTests(TestCase):
+    """
+    A message is a duplicate while it is buffered and once it is stored,
+    but not after a failed write; the client IP can come from a proxy.
+    """
+
+    def setUp(self):
+        cache.clear()
+        for name, value in [('_pending', []), ('_pending_digests', set()), ('_start_worker', lambda: None)]:
+            patcher = mock.patch.object(contact, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def submit(self, message='Hello  there'):
+        return contact.submit('Ada', 'ada@example.com', message, '10.0.0.1')
+
+    def test_duplicates(self):
+        self.assertEqual(self.submit(), contact.ACCEPTED)
+        self.assertEqual(self.submit('hello there'), contact.DUPLICATE)
+        with mock.patch.object(contactdb.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                contact.flush()
+        self.assertEqual(self.submit(), contact.DUPLICATE)
+        self.assertEqual(contact.flush(), 1)
+        self.assertEqual(self.submit(), contact.DUPLICATE)
+
+        cache.clear()
+        self.assertEqual(self.submit(), contact.ACCEPTED)
+        contact.flush()
+        self.assertEqual(contactdb.objects.count(), 1)
+
+    def test_lost_buffer_can_be_resent(self):
+        self.assertEqual(self.submit(), contact.ACCEPTED)
+        contact._pending.clear()
+        contact._pending_digests.clear()
+        self.assertEqual(self.submit(), contact.ACCEPTED)
+
+    def test_client_ip(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='1.2.3.4, 5.6.7.8')
+        self.assertEqual(contact.client_ip(request), '10.0.0.2')
+        with mock.patch.object(contact, 'IP_HEADER', 'HTTP_X_FORWARDED_FOR'):
+            self.assertEqual(contact.client_ip(request), '5.6.7.8')
+            self.assertEqual(contact.client_ip(RequestFactory().post('/', REMOTE_ADDR='10.0.0.2')), '10.0.0.2')
+
+    def test_throttle_window(self):
+        window = contact.BURST * contact.REFILL_SECONDS
+        self.assertEqual([contact.take_token('10.0.0.1', 0) for _ in range(contact.BURST + 1)],
+                         [True] * contact.BURST + [False])
+        self.assertTrue(contact.take_token('10.0.0.2', 0))
+        self.assertFalse(contact.take_token('10.0.0.1', window - 1))
+        self.assertTrue(contact.take_token('10.0.0.1', window))
+
+    def test_concurrent_posts_share_the_limit(self):
+        # Each thread has its own cache object, so patch the backend class.
+        backend = type(caches['default'])
+        get = backend.get
+
+        def slow_get(*args, **kwargs):
+            # Widen the gap between reading and writing the count.
+            value = get(*args, **kwargs)
+            sleep(0.01)
+            return value
+
+        results = []
+        barrier = threading.Barrier(contact.BURST * 2)
+
+        def post():
+            barrier.wait()
+            results.append(contact.take_token('10.0.0.1', 0))
+
+        with mock.patch.object(backend, 'get', slow_get):
+            threads = [threading.Thread(target=post) for _ in range(contact.BURST * 2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results.count(True), contact.BURST)
+
+
+class TemplatingTests(TestCase):
+    """
+    Static components are rendered once per worker, keyed by template name,
+    and get each request's CSRF token.
+    """
+
+    def setUp(self):
+        templating.clear()
+        self.addCleanup(templating.clear)
+
+    def test_component_is_rendered_once(self):
+        with mock.patch.object(templating, 'render_to_string', wraps=templating.render_to_string) as render:
+            footer = templating.render_static('components/footer.html')
+            self.assertEqual(templating.render_static('components/footer.html'), footer)
+            self.assertNotEqual(templating.render_static('components/modals.html'), footer)
+            self.assertEqual(render.call_count, 2)
+            templating.clear()
+            templating.render_static('components/footer.html')
+            self.assertEqual(render.call_count, 3)
+
+    def test_csrf_token_is_filled_in(self):
+        html = templating.static_include('components/modals.html', 'token123')
+        self.assertIn(templating.CSRF_INPUT % 'token123', html)
+        self.assertNotIn(prerender.CSRF_PLACEHOLDER, html)
+        html = templating.static_include('components/modals.html', 'NOTPROVIDED')
+        self.assertNotIn('csrfmiddlewaretoken', html)
+        self.assertNotIn(prerender.CSRF_PLACEHOLDER, html)
+
+    @PLAIN_STATIC
+    def test_page_includes_components_with_its_token(self):
+        response = self.client.get(reverse('home'))
+        html = response.content.decode()
+        self.assertIn(templating.render_static('components/footer.html'), html)
+        self.assertNotIn(prerender.CSRF_PLACEHOLDER, html)
+        self.assertIn('name="csrfmiddlewaretoken"', html)
+        with mock.patch.object(templating, 'enabled', False):
+            self.assertInHTML(templating.render_static('components/footer.html'),
+                              self.client.get(reverse('home')).content.decode())
+
+    def test_warm_compiles_project_templates(self):
+        names = templating.template_names()
+        self.assertIn('base.html', names)
+        self.assertIn('components/modals.html', names)
+        self.assertNotIn('admin/base.html', names)
+        with mock.patch.object(templating, 'get_template', wraps=templating.get_template) as get_template:
+            self.assertEqual(templating.warm(), len(names))
+        self.assertEqual(sorted(call.args[0] for call in get_template.call_args_list), names)
+        self.assertEqual(set(templating._rendered), set(templating.STATIC_INCLUDES))
+
+
+class FreeEnrollmentTests(TransactionTestCase):
+    """
+    Enrolling in a free course is idempotent, even when requests race.
+    """
+    PARALLEL = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user('learner', 'learner@example.com', 'password')
+        category = Categories.objects.create(name='Free')
+        self.course = Course.objects.create(title='Free course', description='', price=0, status='PUBLISH', category=category)
+        self.url = reverse('checkout', args=[self.course.id])
+
+    def test_repeated_requests_enroll_once(self):
+        self.client.force_login(self.user)
+        for _ in range(3):
+            self.assertRedirects(self.client.get(self.url), reverse('my_course'), fetch_redirect_response=False)
+        self.assertEqual(UserCourse.objects.filter(user=self.user, course=self.course).count(), 1)
+
+    def test_parallel_requests_enroll_once(self):
+        clients = [Client() for _ in range(self.PARALLEL)]
+        for client in clients:
+            client.force_login(self.user)
+        barrier = threading.Barrier(self.PARALLEL)
+        statuses, errors = [], []
+
+        def enroll(client):
+            try:
+                barrier.wait()
+                statuses.append(client.get(self.url).status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=enroll, args=[client]) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(statuses, [302] * self.PARALLEL)
+        self.assertEqual(UserCourse.objects.filter(user=self.user, course=self.course).count(), 1)
+
+    @PLAIN_STATIC
+    def test_parallel_free_cart_checkouts_enroll_once(self):
+        second = Course.objects.create(title='Second free course', description='', price=0, status='PUBLISH',
+                                       category=self.course.category)
+        clients = [Client() for _ in range(self.PARALLEL)]
+        for client in clients:
+            client.force_login(self.user)
+            for course in (self.course, second):
+                client.post(reverse('cart_add', args=[course.id]))
+        barrier = threading.Barrier(self.PARALLEL)
+        statuses, errors = [], []
+
+        def checkout(client):
+            try:
+                barrier.wait()
+                statuses.append(client.post(reverse('cart') + '?action=create_payment').status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=[client]) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        # Carts read after the first enrollment no longer list the courses.
+        self.assertIn(302, statuses)
+        self.assertEqual(set(statuses) - {200, 302}, set())
+        self.assertEqual(UserCourse.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(sorted(DailyCourseSales.objects.values_list('course_id', 'free_enrollments')),
+                         [(self.course.id, 1), (second.id, 1)])
+
+    def test_anonymous_is_not_enrolled(self):
+        self.assertRedirects(self.client.get(self.url), reverse('login'), fetch_redirect_response=False)
+        self.assertFalse(UserCourse.objects.exists())
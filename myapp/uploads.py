@@ -0,0 +1,229 @@
+"""
+Module: uploads.py
+
+This module is the media upload pipeline.
+
+`HashingUploadHandler` replaces Django's memory and temporary-file
+handlers. Every uploaded file is streamed to a temporary file on disk in
+chunks and SHA-256 hashed as it arrives. Requests whose `Content-Length`
+already exceeds the limit are refused before any of the body is read, and
+a file that grows past `UPLOAD_MAX_SIZE` stops the upload at that chunk.
+Either way `request.upload_too_large` is set.
+
+`ContentAddressedStorage` stores each distinct content once, under
+`Media/content/<sha[:2]>/<sha><ext>`, whatever the field's `upload_to`.
+Saving bytes that are already stored just returns the existing name.
+`StoredFile` counts how many model fields point at each file, and
+`track_files` keeps the counts right as rows are saved and deleted. A file
+is removed when its last reference goes.
+
+Storing and releasing the same content can race (an upload of bytes whose
+last reference is being dropped). Storing counts the new reference at once
+(a "claim", which `track_files` then does not count again) and releasing
+deletes the row only while its count is zero. Each does its check and its
+file operation in one transaction that starts with that write, so SQLite
+runs them one after the other.
+
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.db import models, transaction
+from django.db.models import F
+
+from myapp.models import StoredFile
+
+UPLOAD_MAX_SIZE = getattr(settings, 'UPLOAD_MAX_SIZE', 5 * 1024 * 1024)
+CONTENT_DIR = 'Media/content'
+INCOMING_DIR = '.incoming'
+
+_local = threading.local()
+
+
+def _claims():
+    """
+    Returns this thread's names stored (and counted) but not yet seen by
+    `track_files`.
+    """
+    if not hasattr(_local, 'claims'):
+        _local.claims = Counter()
+    return _local.claims
+
+
+def content_name(sha256, original_name):
+    extension = os.path.splitext(original_name)[1].lower()
+    return '%s/%s/%s%s' % (CONTENT_DIR, sha256[:2], sha256, extension)
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams uploads to disk, hashing them and enforcing `UPLOAD_MAX_SIZE`.
+    The finished file carries its digest as `sha256`.
+    """
+    too_large = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # The body also carries the other form fields, hence the allowance.
+        self.too_large = content_length > UPLOAD_MAX_SIZE + settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+    def new_file(self, *args, **kwargs):
+        if self.too_large:
+            self.request.upload_too_large = True
+            raise StopUpload(connection_reset=True)
+        super().new_file(*args, **kwargs)
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > UPLOAD_MAX_SIZE:
+            self.request.upload_too_large = True
+            raise StopUpload(connection_reset=True)
+        self.hash.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.sha256 = self.hash.hexdigest()
+        return super().file_complete(file_size)
+
+
+def validate_image(upload):
+    """
+    Checks an uploaded image's size and that Pillow can parse it.
+
+    Raises:
+        ValidationError: If the file is too large or not an image.
+    """
+    from PIL import Image
+
+    if upload.size > UPLOAD_MAX_SIZE:
+        raise ValidationError("Images must be smaller than %d MB." % (UPLOAD_MAX_SIZE // (1024 * 1024)))
+    try:
+        with Image.open(upload) as image:
+            image.verify()
+    except Exception:
+        raise ValidationError("Upload a valid image.")
+    finally:
+        upload.seek(0)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names files by their content hash, so each
+    distinct content is stored once.
+    """
+
+    def _save(self, name, content):
+        sha256 = getattr(content, 'sha256', None)
+        if sha256 and hasattr(content, 'temporary_file_path'):
+            source, owned = content.temporary_file_path(), False
+        else:
+            incoming = self.path(INCOMING_DIR)
+            os.makedirs(incoming, exist_ok=True)
+            fd, source = tempfile.mkstemp(dir=incoming)
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            sha256, owned = digest.hexdigest(), True
+
+        target = content_name(sha256, name)
+        full_path = self.path(target)
+        size = os.path.getsize(source)
+        with transaction.atomic():
+            # Claim before looking for the file, so that a concurrent
+            # release_unreferenced() either removed it already or cannot.
+            if not StoredFile.objects.filter(name=target).update(refcount=F('refcount') + 1):
+                StoredFile.objects.create(name=target, sha256=sha256, size=size, refcount=1)
+            if os.path.exists(full_path):
+                if owned:
+                    os.remove(source)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                file_move_safe(source, full_path, allow_overwrite=True)
+                os.chmod(full_path, self.file_permissions_mode or 0o644)
+        _claims()[target] += 1
+        return target
+
+
+def file_fields(model):
+    return [field.attname for field in model._meta.concrete_fields if isinstance(field, models.FileField)]
+
+
+def _adjust(names, delta):
+    names = [name for name in names if name]
+    if names:
+        StoredFile.objects.filter(name__in=names).update(refcount=F('refcount') + delta)
+
+
+def release_unreferenced(names):
+    """
+    Deletes the stored files among `names` that no field references.
+    """
+    for name in sorted({name for name in names if name}):
+        with transaction.atomic():
+            # The count is checked by the DELETE itself, and the file goes
+            # before a concurrent store can claim it again.
+            deleted, _ = StoredFile.objects.filter(name=name, refcount__lte=0).delete()
+            if deleted:
+                try:
+                    os.remove(os.path.join(settings.MEDIA_ROOT, name))
+                except FileNotFoundError:
+                    pass
+
+
+def remember_files(sender, instance, raw=False, **kwargs):
+    """
+    `pre_save` receiver: remembers the file names the row had before.
+    """
+    fields = file_fields(sender)
+    previous = None
+    if instance.pk is not None and not raw:
+        previous = sender._default_manager.filter(pk=instance.pk).values_list(*fields).first()
+    instance._previous_files = dict(zip(fields, previous or [''] * len(fields)))
+
+
+def track_files(sender, instance, raw=False, **kwargs):
+    """
+    `post_save` receiver: moves references from the old file names to
+    the new ones. A name this thread has just stored was already counted
+    by the storage; if the field held it before, that claim is returned.
+    """
+    previous = getattr(instance, '_previous_files', {})
+    claims = _claims()
+    added, removed, reclaimed = [], [], []
+    for field in file_fields(sender):
+        new, old = getattr(instance, field).name or '', previous.get(field, '')
+        claimed = claims[new] > 0
+        if claimed:
+            claims[new] -= 1
+        if new != old:
+            if not claimed:
+                added.append(new)
+            removed.append(old)
+        elif claimed:
+            reclaimed.append(new)
+    _adjust(added, 1)
+    _adjust(removed + reclaimed, -1)
+    if any(removed):
+        transaction.on_commit(lambda: release_unreferenced(removed))
+
+
+def untrack_files(sender, instance, **kwargs):
+    """
+    `post_delete` receiver: drops the deleted row's references.
+    """
+    names = [getattr(instance, field).name for field in file_fields(sender)]
+    _adjust(names, -1)
+    transaction.on_commit(lambda: release_unreferenced(names))
@@ -1,5 +1,5 @@
 from django.urls import path,include
-from myapp import views,user_login
+from myapp import api,views,user_login
 
 
 urlpatterns = [
@@ -9,8 +9,10 @@ urlpatterns = [
 
  path('courses',views.SINGLE_COURSE,name='single_course'),
  path('course/<int:id>',views.COURSE_DETAILS,name='course_details'),
+ path('courses/category/<int:id>',views.CATEGORY_COURSES,name='category_courses'),
  path('course/filter-data/',views.filter_data,name="filter-data"),
  path('mycourse/',views.My_Course,name='my_course'),
+ path('progress/heartbeat',views.PROGRESS_HEARTBEAT,name='progress_heartbeat'),
 
  path('search',views.SEARCH_COURSE,name='search_course'),
  path('contact',views.CONTACT_US,name='contact_us'),
@@ -23,5 +25,19 @@ urlpatterns = [
 
  path('checkout/<int:id>',views.CHECKOUT,name='checkout'),
  path('verify_payment',views.VERIFY_PAYMENT, name= 'verify_payment'),
+ path('cart',views.CART,name='cart'),
+ path('cart/add/<int:id>',views.CART_ADD,name='cart_add'),
+ path('cart/remove/<int:id>',views.CART_REMOVE,name='cart_remove'),
+
+ path('export/<str:name>',views.EXPORT_DATA,name='export_data'),
+ path('reports/sales',views.SALES_REPORT,name='sales_report'),
+ path('reports/cache',views.CACHE_REPORT,name='cache_report'),
+ path('provision',views.PROVISION_LEARNERS,name='provision_learners'),
+
+ path('api/categories',api.API_CATEGORIES,name='api_categories'),
+ path('api/courses',api.API_COURSES,name='api_courses'),
+ path('api/courses/<int:id>',api.API_COURSE,name='api_course'),
+ path('api/courses/<int:id>/curriculum',api.API_CURRICULUM,name='api_curriculum'),
+ path('api/courses/<int:id>/reviews',api.API_REVIEWS,name='api_reviews'),
 
 ]
\ No newline at end of file
@@ -1,24 +1,45 @@
-import razorpay
+import os
 from time import time
 
 from django.shortcuts import render,redirect
+from django.urls import reverse
 from django.template.loader import render_to_string
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
 from django.contrib import messages
-from django.conf import settings 
+from django.db import transaction
+from django.core.exceptions import ValidationError
 from django.views.decorators.csrf import csrf_exempt
 
-from myapp.models import Categories,Course,Level,UserCourse,Payment,contactdb,reviewdb
+from myapp import cart, catalog, contact, course_stats, enrollment, exports, gateway, pricing, progress, provisioning, rankings, recommendations, rollups, singleflight, uploads
+from myapp.responses import CATALOG, versioned
+from myapp.models import Categories,Course,Level,UserCourse,Payment,reviewdb
 
-client = razorpay.Client(auth=(settings.KEY_ID,settings.KEY_SECRET))
+
+PRICE_FILTERS = {
+    'PriceFree': 'free',
+    'PricePaid': 'paid',
+}
+
+CATEGORY_TTL = 10 * 60
+singleflight.invalidate_on(['categories'], 'categories')
+
+
+def all_categories():
+    return singleflight.get('categories', lambda: list(Categories.get_all_category(Categories)), CATEGORY_TTL)
 # Create your views here.
 
 def BASE(request):
     return render(request,"base.html")
 
+@versioned(*CATALOG, 'ranking')
 def HOME(request):
-    category = Categories.objects.all().order_by('id')[0:6]
-    course= Course.objects.filter(status='PUBLISH').order_by('-id')   
+    category = all_categories()[0:6]
+    snapshot = catalog.get_snapshot()
+    course = snapshot.select(snapshot.filter(published=True))
+    course = rankings.order_cards(course, request.GET.get('sort'))
+    course_stats.prime(course)
 
     context = {
         'category': category,
@@ -26,12 +47,30 @@ def HOME(request):
     }
     return render(request,'Main/home.html',context,)
 
+@versioned(*CATALOG, 'ranking')
 def SINGLE_COURSE(request):
-    category = Categories.get_all_category(Categories)
+    return course_listing(request)
+
+@versioned(*CATALOG, 'ranking')
+def CATEGORY_COURSES(request, id):
+    if not any(i.id == id for i in all_categories()):
+        raise Http404
+    return course_listing(request, categories=[id])
+
+def course_listing(request, categories=()):
+    category = all_categories()
     level = Level.objects.all()
-    course = Course.objects.all()
-    FreeCourse_count = Course.objects.filter(price = 0).count()
-    PaidCourse_count = Course.objects.filter(price__gte=1).count()
+    snapshot = catalog.get_snapshot()
+    course = snapshot.select(snapshot.filter(categories=categories))
+    course = rankings.order_cards(course, request.GET.get('sort'))
+    course_stats.prime(course)
+    FreeCourse_count = snapshot.count(snapshot.free_mask)
+    PaidCourse_count = snapshot.count(snapshot.paid_mask)
+    category_counts, level_counts = snapshot.facet_counts()
+    for i in category:
+        i.course_count = category_counts.get(i.id, 0)
+    for i in level:
+        i.course_count = level_counts.get(i.id, 0)
 
     context ={
         'category':category,
@@ -42,37 +81,42 @@ def SINGLE_COURSE(request):
     }
     return render(request,'Main/single_course.html',context)
 
+@versioned(*CATALOG, 'ranking')
 def filter_data(request):
     category = request.GET.getlist('category[]')
     level = request.GET.getlist('level[]')
     price = request.GET.getlist('price[]')
-    if price == ['PriceFree']:
-        course = Course.objects.filter(price=0)
-    elif price == ['PricePaid']:
-        course = Course.objects.filter(price__gte=1)
-    elif price == ['PriceAll']:
-        course = Course.objects.all()
-    elif category:
-        course =Course.objects.filter(category__id__in = category).order_by('-id')
-    elif level:
-        course = Course.objects.filter(level__id__in = level).order_by('-id')
-    else:
-        course = Course.objects.all().order_by('-id')
+    min_price = request.GET.get('min_price')
+    max_price = request.GET.get('max_price')
+    sort = request.GET.get('sort')
+
+    snapshot = catalog.get_snapshot()
+    mask = snapshot.filter(
+        categories=[i for i in category if i.isdigit()],
+        levels=[i for i in level if i.isdigit()],
+        price=PRICE_FILTERS.get(price[0]) if len(price) == 1 else None,
+        min_price=pricing.rupees_to_paise(min_price) if min_price and min_price.isdigit() else None,
+        max_price=pricing.rupees_to_paise(max_price) if max_price and max_price.isdigit() else None,
+    )
+    course = rankings.order_cards(snapshot.select(mask, sort), sort)
+    course_stats.prime(course)
     context = {
         'course': course
     }
     t = render_to_string('ajax/course.html',context)
     return JsonResponse({'data': t})
 
+@versioned('categories')
 def CONTACT_US(request):
-    category = Categories.get_all_category(Categories)
+    category = all_categories()
     context = {
         'category': category
     }
     return render(request,'Main/contact_us.html',context)
 
+@versioned('categories', 'reviewdb')
 def ABOUT_US(request):
-    category = Categories.get_all_category(Categories)
+    category = all_categories()
     review = reviewdb.objects.all()
     context = {
         'category': category,
@@ -83,32 +127,50 @@ def ABOUT_US(request):
 def LOGIN(request):
     return render(request,'Main/registration/login.html')
 
+@versioned(*CATALOG)
 def SEARCH_COURSE(request):
-    category = Categories.get_all_category(Categories)
+    category = all_categories()
     query = request.GET['query']
-    course = Course.objects.filter(title__icontains= query)
+    snapshot = catalog.get_snapshot()
+    course = snapshot.select(snapshot.filter(query=query))
+    course_stats.prime(course)
     context = {
         'course': course,
         'category':category,
     }
     return render(request,"search/search.html",context)
 
+def course_details_state(request, id):
+    """
+    The ETag parts of COURSE_DETAILS beyond the catalog: the visitor's own
+    enrollment in the course and its related courses.
+    """
+    enrolled = None
+    if request.user.is_authenticated:
+        enrolled = UserCourse.objects.filter(user=request.user, course_id=id).values_list('id', flat=True).first()
+    return enrolled, recommendations.recommended_ids(id)
+
+
+@versioned(*CATALOG, 'reviewdb', extra=course_details_state)
 def COURSE_DETAILS(request,id):
-    category = Categories.get_all_category(Categories)
-    cdata = Course.objects.all()
-    selectcourse = Course.objects.all()
+    category = all_categories()
+    snapshot = catalog.get_snapshot()
+    selectcourse = snapshot.select(snapshot.all_mask)
     course_id = Course.objects.get(id = id)
-    try:
-     check_enroll = UserCourse.objects.get(user = request.user, course = course_id)
-     print(check_enroll)
-    except UserCourse.DoesNotExist:
-     check_enroll = None
+    check_enroll = None
+    if request.user.is_authenticated:
+        try:
+         check_enroll = UserCourse.objects.get(user = request.user, course = course_id)
+        except UserCourse.DoesNotExist:
+         check_enroll = None
 
     course = Course.objects.filter(id = id)
     if course.exists():
         course = course.first()
     else:
         return redirect('404')
+    cdata = related_courses(snapshot, course.id, selectcourse)
+    course_stats.prime(cdata + [course])
     
     reviews = reviewdb.objects.filter(selectcourse=course)
     context= {
@@ -122,8 +184,15 @@ def COURSE_DETAILS(request,id):
     return render(request,"course/course_details.html",context)
 
 
+def related_courses(snapshot, course_id, fallback):
+    cards = [snapshot.cards[i] for i in recommendations.recommended_ids(course_id) if i in snapshot.cards]
+    seen = {course_id, *(card.id for card in cards)}
+    cards += [card for card in fallback if card.id not in seen]
+    return cards[:recommendations.TOP_K]
+
+
 def PAGE_NOT_FOUND(request):
-    category = Categories.get_all_category(Categories)
+    category = all_categories()
     context = {
         'category': category,
     }
@@ -133,89 +202,128 @@ def CHECKOUT(request,id):
     course = Course.objects.get(id = id)
     action = request.GET.get('action')
     order = None
-    if course.price == 0:
-        course = UserCourse(
-            user = request.user,
-            course = course,
-        )
-        course.save()
-        messages.success(request,"Courses are successfully Enrolled")
+    if course.effective_price == 0:
+        if not request.user.is_authenticated:
+            return redirect('login')
+        usercourse, created = enrollment.enroll_one(request.user, course)
+        if created:
+            messages.success(request,"Courses are successfully Enrolled")
         return redirect('my_course')
     
     elif action == 'create_payment':
         if request.method == "POST":
-            first_name = request.POST.get('first_name')
-            last_name = request.POST.get('last_name')
-            country = request.POST.get('country')
-            address_1 = request.POST.get('address_1')
-            city = request.POST.get('city')
-            state = request.POST.get('state')
-            postcode = request.POST.get('postcode')
-            phone = request.POST.get('phone')
-            email = request.POST.get('email')
-
-            amount_cal = course.price - (course.price * course.discount / 100)
-            amount = int(amount_cal) * 100
-            currency = "INR"
-            notes = {
-                "name": f'{first_name}  {last_name}',
-                "country": country,
-                "address" : address_1,
-                "city": city,
-                "state": state,
-                "postcode":postcode,
-                "phone": phone,
-                "email": email,
-            }
-            receipt = f"SKILLACADEMY-{int(time())}"
-            order = client.order.create(
-                {
-                    'receipt':receipt,
-                    'notes':notes,
-                    'amount':amount,
-                    'currency': currency,
-                }
-            )
+            order = gateway_order(request, course.effective_price)
             payment = Payment(
                 course = course,
                 user=request.user,
-                order_id = order.get('id')
+                order_id = order.get('id'),
+                amount = course.effective_price,
             )
             payment.save()
+            rollups.record_order(payment)
 
     context = {
         'course': course,
+        'items': [course],
+        'total': course.effective_price,
         'order': order,
     }
 
     return render(request,"checkout/checkout.html",context)
 
+def gateway_order(request, amount):
+    """
+    Creates one Razorpay order for `amount` paise from the billing form.
+    """
+    first_name = request.POST.get('first_name')
+    last_name = request.POST.get('last_name')
+    notes = {
+        "name": f'{first_name}  {last_name}',
+        "country": request.POST.get('country'),
+        "address" : request.POST.get('address_1'),
+        "city": request.POST.get('city'),
+        "state": request.POST.get('state'),
+        "postcode": request.POST.get('postcode'),
+        "phone": request.POST.get('phone'),
+        "email": request.POST.get('email'),
+    }
+    receipt = f"SKILLACADEMY-{int(time())}"
+    return gateway.client().order.create(
+        {
+            'receipt':receipt,
+            'notes':notes,
+            'amount':amount,
+            'currency': "INR",
+        }
+    )
+
+@require_POST
+def CART_ADD(request, id):
+    if not Course.objects.filter(id=id).exists():
+        raise Http404
+    cart.add(request, id)
+    return redirect('cart')
+
+@require_POST
+def CART_REMOVE(request, id):
+    cart.remove(request, id)
+    return redirect('cart')
+
+def CART(request):
+    items = cart.courses(request)
+    amount = cart.total(items)
+    order = None
+    if request.GET.get('action') == 'create_payment' and request.method == "POST" and items:
+        if not request.user.is_authenticated:
+            return redirect('login')
+        if amount == 0:
+            with transaction.atomic():
+                enrolled = enrollment.enroll(request.user, items)
+            for usercourse in enrolled.values():
+                rollups.record_free_enrollment(usercourse)
+            cart.clear(request)
+            messages.success(request,"Courses are successfully Enrolled")
+            return redirect('my_course')
+        order = gateway_order(request, amount)
+        cart.create_payment(request.user, items, order.get('id'))
+
+    context = {
+        'items': items,
+        'total': amount,
+        'order': order,
+        'cart': True,
+    }
+    return render(request,"checkout/checkout.html",context)
+
 def My_Course(request):
-    course = UserCourse.objects.filter(user = request.user)
+    course = UserCourse.objects.filter(user = request.user).select_related('course')
+    course_stats.prime([usercourse.course for usercourse in course])
+    progress.attach(course)
     context = {
         'course': course
     }
     return render(request,'course/mycourse.html',context)
 
+@require_POST
+def PROGRESS_HEARTBEAT(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'login required'}, status=403)
+    try:
+        course_id = int(request.POST.get('course'))
+        serial_number = int(request.POST.get('serial_number'))
+        progress.record_heartbeat(request.user.id, course_id, serial_number)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'invalid heartbeat'}, status=400)
+    return JsonResponse({'status': 'ok'})
+
 @csrf_exempt
 def VERIFY_PAYMENT(request):
     if request.method ==  'POST':
         data = request.POST
         try:
-            client.utility.verify_payment_signature(data)
-            razorpay_order_id = data['razorpay_order_id']
-            razorpay_payment_id = data['razorpay_order_id']
-            payment = Payment.objects.get(order_id = razorpay_order_id )
-            payment.payment_id = razorpay_payment_id
-            payment.status = True
-            usercourse = UserCourse(
-                user = payment.user,
-                course = payment.course,
-
-            )
-            usercourse.save()
-            payment.user_course = usercourse
-            payment.save()
+            gateway.client().utility.verify_payment_signature(data)
+            payment = cart.fulfil(data['razorpay_order_id'], data['razorpay_payment_id'])
+            cart.clear(request)
 
             context = {
                 'data':data,
@@ -230,16 +338,86 @@ def  contactdata(request):
           na = request.POST.get('name')
           em = request.POST.get('email')
           mes = request.POST.get('message')
-          obj = contactdb(NAME=na, EMAIL=em, MESSAGE=mes)
-          obj.save()
+          result = contact.submit(na, em, mes, contact.client_ip(request))
+          if result == contact.THROTTLED:
+               messages.error(request, "You have sent too many messages. Please try again in a few minutes.")
+          elif result == contact.INVALID:
+               messages.error(request, "Please write a message.")
+          else:
+               messages.success(request, "Thank you, we have received your message.")
           return redirect(CONTACT_US)
      
 def reviewdata(request):
     if request.method == "POST":
         cr = request.POST.get('course')
         us = request.POST.get('user')
-        ph = request.FILES['photo']
+        ph = request.FILES.get('photo')
         re = request.POST.get('message')
+        if getattr(request, 'upload_too_large', False):
+            messages.error(request, "The photo is too large.")
+            return redirect(ABOUT_US)
+        if ph is not None:
+            try:
+                uploads.validate_image(ph)
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
+                return redirect(ABOUT_US)
         obj = reviewdb(selectcourse=cr,selectuser=us,Userphoto=ph,Review=re)
         obj.save()
         return redirect(ABOUT_US)
+
+@staff_member_required
+def EXPORT_DATA(request, name):
+    if name not in exports.EXPORTS:
+        raise Http404
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return HttpResponseBadRequest("unknown format")
+    try:
+        start = exports.parse_day(request.GET['start']) if request.GET.get('start') else None
+        end = exports.parse_day(request.GET['end']) if request.GET.get('end') else None
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    columns, rows = exports.export_rows(name, start, end)
+    response = StreamingHttpResponse(exports.render_lines(fmt, columns, rows), content_type=exports.FORMATS[fmt])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (name, fmt)
+    return response
+
+@staff_member_required
+def SALES_REPORT(request):
+    try:
+        start = exports.parse_day(request.GET['start'])
+        end = exports.parse_day(request.GET['end'])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("start and end (YYYY-MM-DD) are required")
+    group = 'course' if request.GET.get('group') == 'course' else 'category'
+    return JsonResponse({'group': group, 'rows': rollups.report(start, end, group)})
+
+@staff_member_required
+@require_POST
+def PROVISION_LEARNERS(request):
+    upload = request.FILES.get('file')
+    if getattr(request, 'upload_too_large', False):
+        return HttpResponse("the CSV is larger than %d MB" % (uploads.UPLOAD_MAX_SIZE // (1024 * 1024)), status=413)
+    if upload is None:
+        return HttpResponseBadRequest("upload a CSV as 'file'")
+    mode = request.POST.get('mode', 'token')
+    if mode not in provisioning.MODES:
+        return HttpResponseBadRequest("unknown mode")
+    try:
+        rows = provisioning.read_rows(line.decode('utf-8-sig') for line in upload)
+    except (UnicodeDecodeError, ValueError) as e:
+        return HttpResponseBadRequest(str(e))
+    # Never fork a pool from a web worker; see myapp.provisioning.
+    report = provisioning.provision(rows, mode, processes=0, paid=request.POST.get('paid', '1') == '1')
+    for entry in report['credentials']:
+        if 'token' in entry:
+            entry['reset_url'] = request.build_absolute_uri(
+                reverse('password_reset_confirm', args=[entry['uid'], entry['token']]))
+    return JsonResponse(report)
+
+@staff_member_required
+def CACHE_REPORT(request):
+    # The counters belong to the worker answering this request.
+    return JsonResponse({'pid': os.getpid(), 'singleflight': singleflight.stats()})